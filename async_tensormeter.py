@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio client for the tensormeter protocol (same framing and commands as
+tensormeter.py). Integration windows are awaited instead of busy-waiting, so
+one process can drive several tensormeters concurrently:
+
+    values = measure_all(['134.30.1.138', '134.30.1.139'], int_time=3)
+
+or inside a running event loop:
+
+    async with AsyncTensormeter('134.30.1.138') as tens:
+        d = await tens.get_all_data()
+"""
+
+import asyncio
+import struct
+
+import numpy as np
+
+from tensormeter_protocol import HEADER_SIZE, pack_frame, unpack_header
+
+
+class AsyncTensormeter(object):
+    '''
+    Connection to one tensormeter. Requests on the same connection are
+    serialized with a lock, different instances run concurrently. A request
+    that times out or loses the connection is retried on a new connection, as
+    the rest of a broken off frame would otherwise be read as the next header.
+    INPUT:
+        HOST, PORT: address of the tensormeter server
+        n_max_attempts: number of retries for a failed request (default is 10)
+        timeout: timeout in seconds for connecting and for every answer (default is 5)
+    '''
+    def __init__(self, HOST = 'localhost', PORT = 6340, n_max_attempts = 10, timeout = 5):
+        self.HOST = HOST
+        self.PORT = PORT
+        self.n_max_attempts = n_max_attempts
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        # created in connect(), inside the event loop that uses it
+        self._lock = None
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (type(self).__name__, self.HOST, self.PORT)
+
+    async def connect(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.HOST, self.PORT), self.timeout)
+        return self
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+            self.reader = self.writer = None
+
+    async def reconnect(self):
+        await self.close()
+        try:
+            await self.connect()
+        except (asyncio.TimeoutError, OSError) as e:
+            # the next attempt fails on the missing connection and reconnects again
+            print("%s: reconnect failed (%r)" % (self, e))
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def send(self, command, fmt = None, value = None):
+        if self.writer is None:
+            raise ConnectionError('%s is not connected' % self)
+        self.writer.write(pack_frame(command, fmt, value))
+        await self.writer.drain()
+
+    async def send_meas(self, N_samples):
+        await self.send('meas', 'i', N_samples)
+
+    async def send_vodc(self, voltage):
+        await self.send('vodc', 'd', voltage)
+
+    async def send_cldt(self):
+        await self.send('cldt')
+
+    async def send_newd(self):
+        await self.send('newd')
+
+    async def send_alld(self):
+        await self.send('alld')
+
+    async def recv_frame(self):
+        '''
+        OUTPUT:
+            (command, payload) of the next frame
+        '''
+        header = await asyncio.wait_for(self.reader.readexactly(HEADER_SIZE), self.timeout)
+        length, command = unpack_header(header)
+        payload = await asyncio.wait_for(self.reader.readexactly(length), self.timeout)
+        return command, payload
+
+    async def request_matrix(self, command):
+        '''
+        Send a newd/alld request and return the answer as rows x columns
+        np.array, frames with other commands are skipped.
+        '''
+        async with self._lock:
+            for attempt in range(self.n_max_attempts):
+                try:
+                    await self.send(command)
+                    while True:
+                        rcv_command, payload = await self.recv_frame()
+                        if rcv_command == command:
+                            break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+                    print("%s: failed.. %d (%r), reconnecting" % (self, attempt+1, e))
+                    await self.reconnect()
+                    continue
+                try:
+                    rows, columns = struct.unpack_from('>ii', payload)
+                    return np.frombuffer(payload, dtype='>f8', count=rows*columns, offset=8).reshape(rows, columns)
+                except (struct.error, ValueError) as e:
+                    print("%s: failed.. %d (%s)" % (self, attempt+1, e))
+        raise IOError('%s: could not retrieve data!' % self)
+
+    async def get_data(self, int_time):
+        '''
+        New data since the last request, restricted to the last int_time seconds.
+        '''
+        rawdata = await self.request_matrix('newd')
+        valids = rawdata[:,0][np.abs(rawdata[:,0]-rawdata[-1,0])<int_time].shape[0]
+        return rawdata[-valids:,:]
+
+    async def get_all_data(self):
+        return await self.request_matrix('alld')
+
+    async def measure_data_point(self, int_time = 1, channel = 9):
+        '''
+        Clear the buffer, integrate for int_time seconds and return the mean of one channel.
+        '''
+        await self.send_cldt()
+        await asyncio.sleep(int_time)
+        d = await self.get_all_data()
+        return d[:,channel].mean()
+
+
+async def poll(tensormeters, int_time = 1, channel = 9):
+    '''
+    Measure one data point on several connected tensormeters at the same time.
+    OUTPUT:
+        list of mean values in the order of tensormeters
+    '''
+    return await asyncio.gather(*[t.measure_data_point(int_time, channel) for t in tensormeters])
+
+
+async def _measure_all(hosts, int_time, channel, PORT, n_points):
+    tensormeters = [AsyncTensormeter(host, PORT) for host in hosts]
+    await asyncio.gather(*[t.connect() for t in tensormeters])
+    try:
+        return [await poll(tensormeters, int_time, channel) for _ in range(n_points)]
+    finally:
+        await asyncio.gather(*[t.close() for t in tensormeters])
+
+
+def measure_all(hosts, int_time = 1, channel = 9, PORT = 6340, n_points = 1):
+    '''
+    Blocking helper: connect to all hosts and measure n_points data points on
+    all of them concurrently.
+    OUTPUT:
+        np.array of shape (n_points, len(hosts))
+    '''
+    return np.array(asyncio.run(_measure_all(hosts, int_time, channel, PORT, n_points)))
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Time per exported quicklook of pymaxymus.plot (matplotlib figure) against
+plot(..., fast=True) (colormap lookup table, no figure), and where the time
+of the fast path goes (--stages). Both paths write images of --size pixels.
+PNG is timed at the default compress_level 1 and at 0 (uncompressed, fastest);
+TIFF is the fastest format for quicklooks.
+
+    python benchmarks/bench_export.py [--size 500] [--n 20] [--stages]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library'))
+import pymaxymus as mx
+import imageio
+
+
+def bench(fast, images, folder, ext, compress_level = 1):
+    # matplotlib saves at dpi 150, so both paths write images of the same size in pixels
+    size = (images[0].shape[1] / 150, images[0].shape[0] / 150)
+    t0 = time.perf_counter()
+    for i, image in enumerate(images):
+        mx.plot(image, os.path.join(folder, '%03d_%d.%s' % (i, fast, ext)), 20, 1000, 'r', units = 'nm', size = size,
+                scale = (1, 99), fast = fast, close = True, compress_level = compress_level)
+    return (time.perf_counter() - t0) / len(images)
+
+
+def stages(images, folder):
+    '''
+    Time per image in ms of the steps of export_image() for PNG and TIFF.
+    '''
+    lut = mx.colormap_lut('gray')
+    limits = [mx.contrast_limits(image, (1, 99), method = 'subsample', max_samples = 2**16) for image in images]
+    rgbs = [mx.apply_lut(image, mi, ma, lut) for image, (mi, ma) in zip(images, limits)]
+    steps = [('contrast_limits (exact)', lambda i: mx.contrast_limits(images[i], (1, 99), cache = False)),
+             ('contrast_limits (2**16)', lambda i: mx.contrast_limits(images[i], (1, 99), method = 'subsample', max_samples = 2**16)),
+             ('apply_lut', lambda i: mx.apply_lut(images[i], limits[i][0], limits[i][1], lut)),
+             ('burn_scalebar', lambda i: mx.burn_scalebar(rgbs[i], 50, 'r')),
+             ('write png (zlib level 1)', lambda i: imageio.imwrite(os.path.join(folder, 's.png'), rgbs[i], compress_level = 1)),
+             ('write png (zlib level 0)', lambda i: imageio.imwrite(os.path.join(folder, 's.png'), rgbs[i], compress_level = 0)),
+             ('write tif', lambda i: imageio.imwrite(os.path.join(folder, 's.tif'), rgbs[i]))]
+    for name, step in steps:
+        t0 = time.perf_counter()
+        for i in range(len(images)):
+            step(i)
+        print('  %-26s %6.1f ms' % (name, (time.perf_counter() - t0) / len(images) * 1e3))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Quicklook export speed of pymaxymus.plot with and without fast=True.')
+    parser.add_argument('--size', type = int, default = 500, help = 'image size in pixels (default 500)')
+    parser.add_argument('--n', type = int, default = 20, help = 'number of images (default 20)')
+    parser.add_argument('--stages', action = 'store_true', help = 'also time the steps of the fast path')
+    args = parser.parse_args(argv)
+
+    # stripe domains with noise, similar to a magnetic STXM image
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[:args.size, :args.size]
+    images = [np.tanh(5 * np.sin(2 * np.pi * (x * np.cos(a) + y * np.sin(a)) / 40)) + rng.normal(0, .2, x.shape)
+              for a in rng.uniform(0, np.pi, args.n)]
+    with tempfile.TemporaryDirectory() as folder:
+        for ext, level in (('png', 1), ('png', 0), ('tif', 1)):
+            slow = bench(False, images, folder, ext)
+            fast = bench(True, images, folder, ext, level)
+            name = ext + (' (compress_level 0)' if ext == 'png' and level == 0 else '')
+            print('%s %d x %d: matplotlib %.1f ms, lookup table %.1f ms per image, %.1fx faster, %d open figures' % (
+                name, args.size, args.size, slow*1e3, fast*1e3, slow / fast, len(plt.get_fignums())))
+        if args.stages:
+            print('fast path per image:')
+            stages(images, folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Speed of pymaxymus.parse_header (hand-written parser, cached) against the
+former pyparsing grammar, on a folder of .hdr files. Without a folder, a set
+of synthetic headers in the MAXYMUS format is written to a temporary folder.
+If pyparsing is installed, both parsers are also checked to return the same
+nested dict for every file.
+
+    python benchmarks/bench_header.py [folder] [--n 50] [--points 1000] [--repeat 3]
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+import warnings
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library'))
+import pymaxymus as mx
+from maxymus_io import _parse_header_file
+
+
+def parse_header_pyparsing(fname):
+    # the grammar pymaxymus.parse_header used before, built on every call
+    import pyparsing as pp
+    warnings.filterwarnings('ignore', category = DeprecationWarning, module = 'pyparsing')
+    EQ, LBRACE, RBRACE, LPAR, RPAR, COMMA, SEMICOLON = map(pp.Suppress, '={}(),;')
+
+    value = pp.Forward()
+    listvalue = pp.Forward()
+
+    name = pp.Word(pp.alphanums + '_')
+    entry = pp.Group(name + EQ + value + SEMICOLON)
+
+    strings = pp.quotedString.setParseAction(pp.removeQuotes)
+    numbers = pp.Word(pp.nums + '.-').setParseAction(lambda n: float(n[0]))
+    listcount = pp.Word(pp.nums).suppress()
+
+    dict_entry = pp.Dict(LBRACE + pp.OneOrMore(entry) + RBRACE)
+    list_entry = pp.Group(LPAR + listcount + COMMA + pp.delimitedList(listvalue) + RPAR)
+
+    listvalue << (dict_entry | numbers)
+    value << (dict_entry | list_entry | numbers | strings)
+
+    result = entry.parseFile(fname)
+    return result[0].asDict()
+
+
+def axis(name, lo, hi, points):
+    positions = ', '.join('%.3f' % p for p in np.linspace(lo, hi, points))
+    return ('%s = { Name = "%s"; Unit = "um"; Min = %.3f; Max = %.3f; Dir = 1; Points = (%d, %s);\n};\n'
+            % (name[0] + 'Axis', name, lo, hi, points, positions))
+
+
+def synthetic_header(rng, points):
+    # ScanDefinition of an image scan as written by the MAXYMUS control software
+    x0, y0 = rng.uniform(-50, 50, 2)
+    return ('ScanDefinition = { Label = "Sample Image"; Type = "Sample Image"; Flags = "Image"; '
+            'ScanType = "Point by Point"; Dwell = %.2f; Regions = (1,\n{ ' % rng.uniform(.5, 5)
+            + axis('PAxis', x0, x0 + 5, points) + axis('QAxis', y0, y0 + 5, points)
+            + '});\nStorageRingCurrent = %.2f; EnergyRegions = (1,\n{ StartEnergy = 707.5; EndEnergy = 707.5; '
+              'Range = 0; Step = 0; Points = 1; DwellTime = 1;\n});\n' % rng.uniform(290, 300)
+            + 'PolarizationRegions = (1, { Polarization = -1; });\n};\n'
+            + 'Time = "2020 Jan 10 12:00:00";\n')
+
+
+def write_headers(folder, n, points):
+    rng = np.random.default_rng(0)
+    for i in range(n):
+        with open(os.path.join(folder, 'Sample_Image_%03d.hdr' % i), 'w') as f:
+            f.write(synthetic_header(rng, points))
+
+
+def bench(parse, fnames, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for fname in fnames:
+            parse(fname)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(fnames)
+
+
+def run(folder, repeat):
+    fnames = sorted(glob.glob(os.path.join(folder, '*.hdr')))
+    if not fnames:
+        raise SystemExit('No .hdr files in %s' % folder)
+    print('%d headers in %s' % (len(fnames), folder))
+    try:
+        import pyparsing
+    except ImportError:
+        pyparsing = None
+    if pyparsing is not None:
+        for fname in fnames:
+            if parse_header_pyparsing(fname) != mx.parse_header(fname, cache = False):
+                raise AssertionError('%s: parsers disagree' % fname)
+        print('  both parsers return the same dict for all files')
+        t_pp = bench(parse_header_pyparsing, fnames, repeat)
+        print('  %-24s %10.3f ms per file' % ('pyparsing', t_pp*1e3))
+    t_new = bench(lambda f: mx.parse_header(f, cache = False), fnames, repeat)
+    _parse_header_file.cache_clear()
+    t_cache = bench(mx.parse_header, fnames, repeat)
+    print('  %-24s %10.3f ms per file' % ('parse_header', t_new*1e3))
+    print('  %-24s %10.3f ms per file' % ('parse_header (cached)', t_cache*1e3))
+    if pyparsing is not None:
+        print('  speedup %.0fx, cached %.0fx' % (t_pp / t_new, t_pp / t_cache))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Header parsing speed of pymaxymus.parse_header.')
+    parser.add_argument('folder', nargs = '?', help = 'folder with .hdr files (default: synthetic headers)')
+    parser.add_argument('--n', type = int, default = 50, help = 'number of synthetic headers (default 50)')
+    parser.add_argument('--points', type = int, default = 1000, help = 'points per axis of synthetic headers (default 1000)')
+    parser.add_argument('--repeat', type = int, default = 3)
+    args = parser.parse_args(argv)
+
+    if args.folder:
+        run(args.folder, args.repeat)
+        return
+    with tempfile.TemporaryDirectory() as folder:
+        write_headers(folder, args.n, args.points)
+        run(folder, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
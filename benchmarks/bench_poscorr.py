@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and speed comparison of the position correction methods in
+library/poscorr.py against the griddata 'linear' path of loadSingleImage.py.
+
+Runs on the example file in test_data/ and on a synthetic raster scan with
+jittered readback positions, for which the true image is known.
+
+    python benchmarks/bench_poscorr.py [--size 500] [--repeat 3]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import h5py
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library'))
+import poscorr
+
+
+TEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test_data', 'Sample_Image_2024-04-12_003.hdf5')
+
+
+def load_example(fname = TEST_FILE, entry = 'entry1', detector = 'APD'):
+    with h5py.File(fname, 'r') as f:
+        setpx = f['/'+entry+'/'+detector+'/sample_x'][()]
+        setpy = f['/'+entry+'/'+detector+'/sample_y'][()]
+        readx = f['/'+entry+'/instrument/sample_x/data'][()]
+        ready = f['/'+entry+'/instrument/sample_y/data'][()]
+        data = f['/'+entry+'/instrument/'+detector+'/data'][()]
+    return setpx, setpy, readx, ready, data
+
+
+def synthetic_scan(n, step = 0.02, jitter = 0.2, seed = 0):
+    '''
+    n x n raster scan of a smooth test pattern. The readback positions deviate
+    from the setpoints by jitter * step (gaussian) plus a slow drift in x.
+    OUTPUT:
+        setpx, setpy, readx, ready, data, true image on the setpoint grid
+    '''
+    rng = np.random.default_rng(seed)
+    setpx = np.arange(n) * step
+    setpy = np.arange(n) * step
+    X, Y = np.meshgrid(setpx, setpy)
+    readx = (X + rng.normal(0, jitter * step, X.shape) + 0.1 * step * np.sin(Y / (n * step) * np.pi)).ravel()
+    ready = (Y + rng.normal(0, jitter * step, Y.shape)).ravel()
+
+    def pattern(x, y):
+        return 1000 + 200 * np.sin(2 * np.pi * x / (25 * step)) * np.cos(2 * np.pi * y / (40 * step))
+
+    return setpx, setpy, readx, ready, pattern(readx, ready), pattern(X, Y)
+
+
+def timed(method, args, repeat):
+    '''
+    Best of repeat runs; the 'cached' method is reported both for the first
+    call (triangulation) and for repeated calls (weights reused).
+    '''
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = poscorr.correct_positions(*args, method=method)
+        times.append(time.perf_counter() - t0)
+    return result, times
+
+
+def compare(name, args, truth, repeat):
+    print('\n%s: %d x %d pixels' % (name, len(args[1]), len(args[0])))
+    poscorr._triangulations = poscorr.TriangulationCache()
+    reference, ref_times = timed('linear', args, repeat)
+    interior = (slice(2, -2), slice(2, -2))
+    header = '%-8s %12s %12s %14s' % ('method', 'first [s]', 'best [s]', 'rms vs linear')
+    if truth is not None:
+        header += ' %14s' % 'rms vs truth'
+    print(header)
+    for method in ('linear', 'cached', 'lines'):
+        result, times = (reference, ref_times) if method == 'linear' else timed(method, args, repeat)
+        diff = (result - reference)[interior]
+        line = '%-8s %12.4f %12.4f %14.3e' % (method, times[0], min(times), np.sqrt(np.mean(diff**2)) / np.std(reference[interior]))
+        if truth is not None:
+            err = (result - truth)[interior]
+            line += ' %14.3e' % (np.sqrt(np.mean(err**2)) / np.std(truth[interior]))
+        print(line)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type = int, default = 500, help = 'size of the synthetic scan (default 500)')
+    parser.add_argument('--repeat', type = int, default = 3)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(TEST_FILE):
+        compare(os.path.basename(TEST_FILE), load_example(), None, args.repeat)
+    scan = synthetic_scan(args.size)
+    compare('synthetic scan', scan[:5], scan[5], args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Drift correction of a synthetic image series: library/registration.py
+(batched, reference spectrum computed once) against the notebook approach
+(skimage phase_cross_correlation and scipy.ndimage.shift per image).
+
+    python benchmarks/bench_registration.py [--n 100] [--size 256] [--workers -1]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from scipy.ndimage import fourier_shift, gaussian_filter, shift as scipy_shift
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library'))
+import registration
+
+
+def drifting_series(n, size, seed = 0):
+    '''
+    n noisy images of a smooth random pattern drifting along a random walk.
+    OUTPUT:
+        float32 stack, true drift (n, 2) relative to the first image
+    '''
+    rng = np.random.default_rng(seed)
+    spectrum = np.fft.fft2(gaussian_filter(rng.normal(size = (size, size)), 3))
+    drift = np.cumsum(rng.normal(0, .7, (n, 2)), axis = 0)
+    images = np.array([np.fft.ifft2(fourier_shift(spectrum, -d)).real for d in drift])
+    images += rng.normal(0, .02, images.shape)
+    return images.astype(np.float32), drift - drift[0]
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Batched registration against per image skimage registration.')
+    parser.add_argument('--n', type = int, default = 100, help = 'number of images (default 100)')
+    parser.add_argument('--size', type = int, default = 256, help = 'image size in pixels (default 256)')
+    parser.add_argument('--upsample', type = int, default = 100)
+    parser.add_argument('--workers', type = int, default = None, help = 'scipy.fft threads (default 1, -1 for all cores)')
+    args = parser.parse_args(argv)
+
+    images, drift = drifting_series(args.n, args.size)
+    print('%d images of %d x %d pixels, upsample_factor %d' % (args.n, args.size, args.size, args.upsample))
+
+    try:
+        from skimage.registration import phase_cross_correlation
+    except ImportError:
+        phase_cross_correlation = None
+    if phase_cross_correlation is not None:
+        t0 = time.perf_counter()
+        shifts_sk = np.array([phase_cross_correlation(images[0], image, upsample_factor = args.upsample)[0] for image in images])
+        t_reg_sk = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for image, s in zip(images, shifts_sk):
+            scipy_shift(image, s, mode = 'reflect')
+        t_shift_sk = time.perf_counter() - t0
+        print('  skimage loop          register %7.3f s   shift %7.3f s   max error %.3f px' % (
+            t_reg_sk, t_shift_sk, np.abs(shifts_sk - drift).max()))
+
+    for coarse in (1, None):
+        t0 = time.perf_counter()
+        shifts = registration.register_stack(images, upsample_factor = args.upsample, workers = args.workers, coarse_upsample = coarse)
+        t_reg = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        registration.apply_shifts(images, shifts, workers = args.workers)
+        t_shift = time.perf_counter() - t0
+        line = '  batched, %-12s register %7.3f s   shift %7.3f s   max error %.3f px' % (
+            'one step' if coarse == 1 else 'two steps', t_reg, t_shift, np.abs(shifts - drift).max())
+        if phase_cross_correlation is not None:
+            line += '   max difference to skimage %.3f px' % np.abs(shifts - shifts_sk).max()
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
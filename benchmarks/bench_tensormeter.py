@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the tensormeter protocol against the local mock server
+(mock_tensormeter.py). For every scenario get_data and get_all_data are timed
+and checked against the data sent by the mock; reported are messages/s, MB/s
+and the per-request latency.
+
+Scenarios:
+    plain        answers sent at once
+    fragmented   answers sent in 1400 byte fragments (one TCP segment each)
+    short-reads  answers sent in 7 byte fragments, every recv returns a few bytes
+    unsolicited  5 frames with other commands before every answer
+    latency      1 ms server side delay before every answer
+
+    python benchmarks/bench_tensormeter.py [--rows 10000] [--columns 12] [--repeat 50] [--scenario plain ...]
+"""
+
+import os
+import sys
+import time
+import struct
+import argparse
+import contextlib
+import io
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tensormeter import tensormeter
+from mock_tensormeter import MockTensormeter
+
+
+SCENARIOS = dict()
+SCENARIOS['plain'] = dict()
+SCENARIOS['fragmented'] = dict(chunk_size = 1400)
+SCENARIOS['short-reads'] = dict(chunk_size = 7)
+SCENARIOS['unsolicited'] = dict(unsolicited = 5)
+SCENARIOS['latency'] = dict(latency = 1e-3)
+
+
+def decode_struct(rawdata, rows, columns):
+    # previous decoding: struct.unpack into a tuple, then np.array
+    X = rows*columns
+    return np.array(struct.unpack(">"+str(X)+"d", rawdata)).reshape(rows, columns)
+
+
+def decode_frombuffer(rawdata, rows, columns):
+    return np.frombuffer(rawdata, dtype='>f8').reshape(rows, columns)
+
+
+def bench_decode(rows, columns, repeat):
+    print('\ndecoding %d x %d doubles' % (rows, columns))
+    rawdata = bytearray(np.random.default_rng(0).normal(size = rows*columns).astype('>f8').tobytes())
+    for decode in (decode_struct, decode_frombuffer):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            decode(rawdata, rows, columns)
+        dt = (time.perf_counter() - t0) / repeat
+        print('  %-18s %10.3f ms %12.1f MB/s' % (decode.__name__, dt*1e3, len(rawdata) / dt / 1e6))
+
+
+def bench_scenario(name, rows, columns, repeat):
+    '''
+    OUTPUT:
+        dict request name -> np.array of request times in seconds
+    '''
+    options = SCENARIOS[name]
+    if options.get('chunk_size', 1e9) < 100:
+        rows = min(rows, 200)   # byte-wise fragments are too slow for large payloads
+    results = {}
+    with MockTensormeter(rows = rows, columns = columns, **options) as server:
+        tens = tensormeter(0, HOST = server.host, PORT = server.port)
+        tens.s.settimeout(10)
+        try:
+            for request, call in (('get_data', lambda: tens.get_data(1e9)), ('get_all_data', tens.get_all_data)):
+                times = np.zeros(repeat)
+                for i in range(repeat):
+                    t0 = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        d, _ = call()
+                    times[i] = time.perf_counter() - t0
+                    if not np.array_equal(d[:, 1:], server._data[:, 1:]):
+                        raise AssertionError('%s/%s: received data differs from the data sent' % (name, request))
+                results[request] = times
+        finally:
+            tens.s.close()
+    nbytes = rows*columns*8 + 16
+    for request, times in results.items():
+        print('  %-12s %-12s %6d rows %10.1f msg/s %10.1f MB/s   latency median %8.3f ms  p95 %8.3f ms' % (
+            name, request, rows, len(times) / times.sum(), nbytes * len(times) / times.sum() / 1e6,
+            np.median(times)*1e3, np.percentile(times, 95)*1e3))
+    return results
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Tensormeter protocol benchmark against the local mock server.')
+    parser.add_argument('--rows', type = int, default = 10000)
+    parser.add_argument('--columns', type = int, default = 12)
+    parser.add_argument('--repeat', type = int, default = 50)
+    parser.add_argument('--scenario', nargs = '+', default = list(SCENARIOS), choices = list(SCENARIOS))
+    args = parser.parse_args(argv)
+
+    bench_decode(args.rows, args.columns, args.repeat)
+    print('\nrequests')
+    for name in args.scenario:
+        bench_scenario(name, args.rows, args.columns, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Wiki upload of a set of synthetic files against a local mock MediaWiki
+(library/mock_mediawiki.py): the former loop of bulkupload.gui_upload (one
+session, one file after the other) against bulkupload.UploadEngine with
+several workers, and a second run of the engine that skips everything via the
+manifest. Finally checks that two different files of the same wiki name (also
+after conversion, a/img.tif -> img.png) are reported as a conflict on the first
+and on a resumed run, in both orders, and never overwrite each other.
+
+    python benchmarks/bench_upload.py [--n 40] [--size 500] [--latency 0.02] [--workers 1 4 8]
+"""
+
+import io
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import mwclient
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'library'))
+import bulkupload
+from mock_mediawiki import MockMediaWiki
+
+
+def make_files(folder, n, size):
+    files = []
+    for i in range(n):
+        fname = os.path.join(folder, 'Sample_Image_%03d.png' % i)
+        with open(fname, 'wb') as f:
+            f.write(os.urandom(size))
+        files.append(fname)
+    return files
+
+
+def check_conflicts(folder):
+    '''
+    Upload a/img and b/img (different content, same wiki name) twice with the same
+    manifest: the first file of the list must be uploaded and then skipped, the
+    other one must fail as a conflict on both runs and never replace it on the wiki.
+    OUTPUT:
+        True if all runs behave so
+    '''
+    ok = True
+    values = dict(a = 50, b = 200)
+    for ext in ('.png', '.tif'):
+        for order in ('ab', 'ba'):
+            conflict = os.path.join(folder, 'conflict')
+            files = {}
+            for sub, value in values.items():
+                os.makedirs(os.path.join(conflict, sub))
+                files[sub] = os.path.join(conflict, sub, 'img' + ext)
+                Image.fromarray(np.full((20, 20), value, np.uint8)).save(files[sub])
+            with MockMediaWiki() as wiki:
+                engine = bulkupload.UploadEngine(bulkupload.site_factory(wiki.host, 'user', 'password', wikipath = wiki.path, scheme = 'http'),
+                                                 manifest = os.path.join(conflict, 'manifest.json'), manifest_key = wiki.host, backoff = 0.1)
+                for expected in ('uploaded', 'skipped'):
+                    results, _ = bulkupload.upload_batch([files[k] for k in order], engine, n_processes = 1)
+                    status = [r['status'] for r in results]
+                    ok &= status == [expected, 'failed']
+                    print('  img%s %s: %s' % (ext, ', '.join(order), ', '.join(status)))
+                on_wiki = np.asarray(Image.open(io.BytesIO(wiki.files['img.png'])))
+                ok &= len(wiki.files) == 1 and (on_wiki == values[order[0]]).all()
+            shutil.rmtree(conflict)
+    print('  name conflicts: %s' % ('ok' if ok else 'FAILED'))
+    return ok
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Sequential wiki upload against the concurrent UploadEngine.')
+    parser.add_argument('--n', type = int, default = 40, help = 'number of files (default 40)')
+    parser.add_argument('--size', type = int, default = 500, help = 'file size in kB (default 500)')
+    parser.add_argument('--latency', type = float, default = 0.02, help = 'delay of every request in s (default 0.02)')
+    parser.add_argument('--bandwidth', type = float, default = 20., help = 'upload bandwidth per connection in MB/s (default 20)')
+    parser.add_argument('--failure-rate', type = float, default = 0., help = 'probability of HTTP 503 per upload request')
+    parser.add_argument('--workers', type = int, nargs = '+', default = [1, 4, 8])
+    args = parser.parse_args(argv)
+
+    folder = tempfile.mkdtemp()
+    try:
+        files = make_files(folder, args.n, args.size * 1000)
+        mb = args.n * args.size * 1000 / 2**20
+        print('%d files, %.1f MB, latency %.0f ms, %.0f MB/s per connection' % (args.n, mb, 1000 * args.latency, args.bandwidth))
+        kwargs = dict(latency = args.latency, bandwidth = args.bandwidth * 2**20, failure_rate = args.failure_rate)
+
+        if args.failure_rate == 0:
+            with MockMediaWiki(**kwargs) as wiki:
+                t0 = time.perf_counter()
+                site = mwclient.Site(wiki.host, path = wiki.path, scheme = 'http')
+                site.login('user', 'password')
+                for fname in files:
+                    with open(fname, 'rb') as f:
+                        site.upload(f, os.path.basename(fname), ignore = True)
+                t = time.perf_counter() - t0
+            print('  sequential loop      %6.2f s   %6.2f files/s   %6.2f MB/s' % (t, args.n / t, mb / t))
+
+        for n_workers in args.workers:
+            with MockMediaWiki(**kwargs) as wiki:
+                manifest = os.path.join(folder, 'manifest_%d.json' % n_workers)
+                engine = bulkupload.UploadEngine(bulkupload.site_factory(wiki.host, 'user', 'password', wikipath = wiki.path, scheme = 'http'),
+                                                 n_workers = n_workers, manifest = manifest, manifest_key = wiki.host, backoff = 0.1)
+                engine.upload(files)
+                s = engine.stats
+                line = '  engine, %2d workers   %6.2f s   %6.2f files/s   %6.2f MB/s' % (n_workers, s['seconds'], s['files_per_s'], s['mb_per_s'])
+                if s['files'] != args.n:
+                    line += '   %s' % s['counts']
+                engine.upload(files)
+                print(line + '   rerun %.3f s (%s)' % (engine.stats['seconds'], ', '.join('%d %s' % (v, k) for k, v in engine.stats['counts'].items())))
+        if not check_conflicts(folder):
+            sys.exit(1)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Import time of pymaxymus and its modules, measured with python -X importtime
+in fresh interpreters (best of --repeat runs) and checked against the budgets
+in importtime_baseline.json. A module also fails if it pulls in one of its
+'forbidden' heavy dependencies (e.g. matplotlib for pymaxymus), which does not
+depend on the speed of the machine. The exit code is 1 if any check fails, so
+the script can run in a cron job or CI.
+
+    python benchmarks/importtime.py              # compare with the baseline
+    python benchmarks/importtime.py --update     # store new measurements and budgets
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LIBRARY = os.path.join(HERE, '..', 'library')
+BASELINE = os.path.join(HERE, 'importtime_baseline.json')
+
+
+def import_time(module, repeat = 5):
+    '''
+    Cumulative import time of module in ms (best of repeat fresh interpreters)
+    and the set of all modules imported with it.
+    '''
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(p for p in (LIBRARY, os.environ.get('PYTHONPATH')) if p))
+    best = None
+    imported = set()
+    for i in range(repeat + 1):
+        out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], env = env,
+                             capture_output = True, text = True)
+        if out.returncode != 0:
+            raise RuntimeError('import %s failed:\n%s' % (module, out.stderr))
+        cumulative = None
+        for line in out.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            _, total, name = line.split('|')
+            if total.strip().isdigit():
+                name = name.strip()
+                imported.add(name)
+                if name == module:
+                    cumulative = int(total) / 1000
+        if i > 0:       # the first run also writes the .pyc files
+            best = cumulative if best is None else min(best, cumulative)
+    return best, imported
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Check the import time of pymaxymus against importtime_baseline.json.')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--baseline', default = BASELINE)
+    parser.add_argument('--update', action = 'store_true', help = 'store the measurements and budgets of 2x the measured time')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+
+    failed = False
+    print('%-20s %10s %10s %10s' % ('module', 'measured', 'baseline', 'budget'))
+    for module, entry in baseline['modules'].items():
+        ms, imported = import_time(module, args.repeat)
+        problems = [m for m in entry.get('forbidden', []) if m in imported]
+        line = '%-20s %8.1f ms %8.1f ms %8.1f ms' % (module, ms, entry['measured_ms'], entry['budget_ms'])
+        if args.update:
+            entry['measured_ms'] = round(ms, 1)
+            entry['budget_ms'] = round(2 * ms, 1)
+        elif ms > entry['budget_ms']:
+            line += '   over budget'
+            failed = True
+        if problems:
+            line += '   imports %s' % ', '.join(problems)
+            failed = True
+        print(line)
+
+    if args.update:
+        with open(args.baseline + '.tmp', 'w') as f:
+            json.dump(baseline, f, indent = 1)
+        os.replace(args.baseline + '.tmp', args.baseline)
+        print('Updated %s' % args.baseline)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Batch conversion of MAXYMUS .hdf5 images into .tif images (raw and position
+corrected), spread over a process pool.
+
+Usage from the command line:
+    python batchconvert.py Z:\\data2 2024-04-07 10-13 20 --workers 8
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import h5py
+import imageio
+import numpy as np
+
+from poscorr import correct_positions
+
+
+MANIFEST = 'convert_manifest.json'
+
+
+def image_name(date, number):
+    return 'Sample_Image_%s_%03d' % (date, int(number))
+
+
+def file_hash(fname, block_size = 2**20):
+    '''
+    sha1 digest of a file, read in blocks of block_size bytes.
+    '''
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def convert_image(image_path, save_path, entry = 'entry1', detector = 'APD', interpolation = 'linear'):
+    '''
+    Load one .hdf5 image, correct the readback positions and save the raw and
+    the position corrected image as float32 .tif.
+    INPUT:
+        image_path: .hdf5 file to convert
+        save_path: folder to save the .tif images in
+        entry: hdf5 entry (default is 'entry1')
+        detector: 'APD', 'timemachine', 'PMT' or 'VCO' (default is 'APD')
+        interpolation: position correction method, 'linear', 'cubic', 'cached' or 'lines',
+                       see poscorr.py (default is 'linear')
+    OUTPUT:
+        list of the two written filenames
+    '''
+    datasetDet = '/'+entry+'/'+detector
+    datasetInst = '/'+entry+'/instrument'
+
+    with h5py.File(image_path, 'r') as f:
+        I = f[datasetDet+'/data'][()]
+        setpx = f[datasetDet+'/sample_x'][()]
+        setpy = f[datasetDet+'/sample_y'][()]
+        readx = f[datasetInst+'/sample_x/data'][()]
+        ready = f[datasetInst+'/sample_y/data'][()]
+        data = f[datasetInst+'/'+detector+'/data'][()]
+
+    I_pc = correct_positions(setpx, setpy, readx, ready, data, method=interpolation, fill_value=0)
+
+    I = np.flip(I, 0)
+    I_pc = np.flip(I_pc, 0)
+
+    outputs = output_names(image_path, save_path)
+    imageio.imwrite(outputs[0], I.astype(np.float32), format='tif')
+    imageio.imwrite(outputs[1], I_pc.astype(np.float32), format='tif')
+    return outputs
+
+
+def output_names(image_path, save_path):
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    return [os.path.join(save_path, name+'.tif'), os.path.join(save_path, name+'_posCorr.tif')]
+
+
+def _is_current(image_path, outputs, record, params):
+    '''
+    Check whether the outputs of a previous run are still valid. Returns the
+    (possibly refreshed) manifest record if so, None otherwise. The content hash
+    is only computed if size or mtime of the input changed.
+    '''
+    if record is None or record.get('params') != params:
+        return None
+    if not all(os.path.exists(o) for o in outputs):
+        return None
+    st = os.stat(image_path)
+    if record['size'] == st.st_size and record['mtime'] == st.st_mtime:
+        if min(os.path.getmtime(o) for o in outputs) >= st.st_mtime:
+            return record
+    if record['sha1'] == file_hash(image_path):
+        return dict(record, size = st.st_size, mtime = st.st_mtime)
+    return None
+
+
+def _convert_job(image_path, save_path, params, record, force):
+    '''
+    Worker for convert_batch(), never raises. Returns a dict with the keys
+    name, status ('converted', 'up to date', 'missing' or 'failed'), seconds,
+    record (new manifest record or None) and error.
+    '''
+    t0 = time.perf_counter()
+    result = dict(name = os.path.basename(image_path), status = 'converted', record = None, error = None)
+    try:
+        if not os.path.exists(image_path):
+            result['status'] = 'missing'
+        else:
+            outputs = output_names(image_path, save_path)
+            current = None if force else _is_current(image_path, outputs, record, params)
+            if current is not None:
+                result['status'] = 'up to date'
+                result['record'] = current
+            else:
+                st = os.stat(image_path)
+                digest = file_hash(image_path)
+                convert_image(image_path, save_path, **params)
+                result['record'] = dict(size = st.st_size, mtime = st.st_mtime, sha1 = digest, params = params)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    result['seconds'] = time.perf_counter() - t0
+    return result
+
+
+def load_manifest(save_path):
+    fname = os.path.join(save_path, MANIFEST)
+    if not os.path.exists(fname):
+        return {}
+    with open(fname, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(save_path, manifest):
+    fname = os.path.join(save_path, MANIFEST)
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 1)
+    os.replace(fname + '.tmp', fname)
+
+
+def convert_batch(rootPath, date, imageNumbers, entry = 'entry1', detector = 'APD', interpolation = 'linear', n_workers = None, force = False):
+    '''
+    Convert a list of .hdf5 images of one day into .tif images in
+    <rootPath>/<date>/Analyzed, using a pool of n_workers processes. Images
+    whose outputs are up to date (same mtime or same content hash of the input
+    and same parameters) are skipped, missing or broken files are reported and
+    skipped.
+    INPUT:
+        rootPath: data folder containing one folder per date
+        date: date string as used in the file names, e.g. '2024-04-07'
+        imageNumbers: list of image numbers
+        entry, detector, interpolation: see convert_image()
+        n_workers: number of processes (default is None, i.e. the number of cores)
+        force: convert all images even if they are up to date (default is False)
+    OUTPUT:
+        list of result dicts (name, status, seconds, record, error) in input order
+    '''
+    savePath = os.path.join(rootPath, date, 'Analyzed')
+    if not os.path.exists(savePath):
+        os.makedirs(savePath)
+    manifest = load_manifest(savePath)
+    params = dict(entry = entry, detector = detector, interpolation = interpolation)
+
+    paths = [os.path.join(rootPath, date, image_name(date, n)+'.hdf5') for n in imageNumbers]
+    results = [None] * len(paths)
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers = n_workers) as pool:
+        futures = {}
+        for i, p in enumerate(paths):
+            name = os.path.basename(p)
+            futures[pool.submit(_convert_job, p, savePath, params, manifest.get(name), force)] = i
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results[futures[future]] = result
+            line = '[%*d/%d] %s: %s (%.2f s)' % (len(str(len(paths))), done, len(paths), result['name'], result['status'], result['seconds'])
+            if result['error'] is not None:
+                line += ' ' + result['error']
+            print(line)
+            if result['record'] is not None:
+                manifest[result['name']] = result['record']
+                save_manifest(savePath, manifest)
+
+    counts = {}
+    for r in results:
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+    print('%d images in %.1f s: ' % (len(paths), time.perf_counter() - t0) + ', '.join('%d %s' % (v, k) for k, v in counts.items()))
+    return results
+
+
+def _parse_numbers(tokens):
+    '''
+    Expand image numbers given as '12' or as inclusive range '10-13'.
+    '''
+    numbers = []
+    for token in tokens:
+        if '-' in token:
+            first, last = token.split('-')
+            numbers.extend(range(int(first), int(last)+1))
+        else:
+            numbers.append(int(token))
+    return numbers
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Convert MAXYMUS .hdf5 images into raw and position corrected .tif images.')
+    parser.add_argument('rootPath', help = 'data folder containing one folder per date')
+    parser.add_argument('date', help = "date as used in the file names, e.g. '2024-04-07'")
+    parser.add_argument('images', nargs = '+', help = "image numbers, e.g. '12' or inclusive ranges '10-13'")
+    parser.add_argument('--entry', default = 'entry1')
+    parser.add_argument('--detector', default = 'APD', help = "'APD', 'timemachine', 'PMT' or 'VCO'")
+    parser.add_argument('--interpolation', default = 'linear', help = "position correction method: 'linear', 'cubic', 'cached' or 'lines' (see poscorr.py)")
+    parser.add_argument('--workers', type = int, default = None, help = 'number of processes (default: number of cores)')
+    parser.add_argument('--force', action = 'store_true', help = 'convert images even if they are up to date')
+    args = parser.parse_args(argv)
+
+    results = convert_batch(args.rootPath, args.date, _parse_numbers(args.images), entry = args.entry, detector = args.detector,
+                            interpolation = args.interpolation, n_workers = args.workers, force = args.force)
+    return int(any(r['status'] == 'failed' for r in results))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
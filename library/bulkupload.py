@@ -4,19 +4,523 @@
 Created on Thu Mar 16 11:00:34 2017
 
 @author: Michael Schneider mschneid@mbi-berlin.de
+
+Uploads run on a small thread pool with one persistent, logged-in wiki session
+per thread. The wiki name and sha1 of every uploaded file are kept in a
+manifest (~/.bulkupload_manifest.json), so files that are already on the wiki
+under the same name are skipped and an interrupted upload continues where it
+stopped. Failed requests
+are retried with exponential backoff.
+
+    engine = UploadEngine(site_factory(wikiurl, user, passwd), manifest_key=wikiurl)
+    results = engine.upload(files)
+    print(engine.stats)     # files/s and MB/s
+
+Without a display, e.g. on analysis nodes or after the export scripts, the
+command line mode converts and uploads files given as glob patterns, folders or
+a list (one file per line, '-' for stdin) and prints the <gallery> block:
+
+    python bulkupload.py "Analyzed/*.png" movies/ --user schneider --max-size 1200 --page "Beamtime 2024-04"
+    python bulkupload.py --list exported.txt --format jpeg --quality 90
+
+Images are downscaled/recompressed with Pillow in a process pool before the
+upload (see prepare_images()); the password is read from BULKUPLOAD_PASSWORD
+or asked for on the terminal. Without files, the Tk dialogs are used as before.
+
+mock_mediawiki.MockMediaWiki serves a local api.php for testing.
 """
 
 import mwclient
+import requests
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import glob
+import shutil
+import getpass
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from os import path, linesep
-import tkinter
-from tkinter.filedialog import askopenfilenames
-from tkinter.simpledialog import askstring
-from tkinter.messagebox import showinfo
-from tkinter.simpledialog import Dialog
 import sys
+try:
+    import tkinter
+    from tkinter.filedialog import askopenfilenames
+    from tkinter.simpledialog import askstring
+    from tkinter.messagebox import showinfo
+    from tkinter.simpledialog import Dialog
+except ImportError:
+    # python without Tk on headless nodes, only the command line mode works
+    tkinter = None
+    Dialog = object
 
 
 wikiurl = 'wiki1.mbi-berlin.de'
+MANIFEST = path.join(path.expanduser('~'), '.bulkupload_manifest.json')
+
+# image formats the wiki shows inline, with their file extension
+FORMATS = {'png': '.png', 'jpeg': '.jpg', 'webp': '.webp', 'gif': '.gif'}
+IMAGE_EXTENSIONS = ('.png', '.gif', '.jpg', '.jpeg', '.webp', '.tif', '.tiff', '.svg', '.pdf')
+# upload results whose file is on the wiki afterwards
+GALLERY_STATUS = ('uploaded', 'unchanged', 'skipped', 'duplicate')
+
+# API errors that usually go away when the request is repeated
+RETRY_CODES = {'ratelimited', 'badtoken', 'stashfailed', 'backend-fail-internal',
+               'internal_api_error_DBConnectionError', 'internal_api_error_DBQueryError'}
+
+
+def file_hash(fname, block_size=2**20):
+    '''
+    sha1 digest of a file (the hash MediaWiki keeps for uploads), read in
+    blocks of block_size bytes.
+    '''
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def site_factory(wikiurl, user, passwd, domain='MBI-LDAP', wikipath='/sg/', max_retries=0, **kwargs):
+    '''
+    Function returning a new, logged in mwclient.Site.
+    INPUT:
+        wikiurl, user, passwd, domain: host and credentials
+        wikipath: script path of the wiki (default is '/sg/')
+        max_retries: retries of mwclient itself (default is 0, UploadEngine retries with backoff instead)
+        kwargs: passed to mwclient.Site, e.g. scheme='http' for a local mock
+    '''
+    def connect():
+        wiki = mwclient.Site(wikiurl, path=wikipath, max_retries=max_retries, **kwargs)
+        wiki.login(user, passwd, domain=domain)
+        return wiki
+    return connect
+
+
+def load_manifest(fname=MANIFEST):
+    if not path.exists(fname):
+        return {}
+    with open(fname, 'r') as f:
+        return json.load(f)
+
+
+def _by_name(entries):
+    # entries of a wiki by name; older manifests map sha1 -> dict(name, size, uploaded)
+    converted = {}
+    for key, entry in entries.items():
+        if 'sha1' in entry:
+            converted[key] = entry
+        else:
+            entry = dict(entry, sha1=key)
+            converted[entry.pop('name')] = entry
+    return converted
+
+
+def save_manifest(manifest, fname=MANIFEST):
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(fname + '.tmp', fname)
+
+
+def _retryable(error):
+    if isinstance(error, mwclient.errors.APIError):
+        return error.code in RETRY_CODES
+    if isinstance(error, requests.HTTPError):
+        status = getattr(error.response, 'status_code', None)
+        return status is None or status >= 500 or status == 429
+    return isinstance(error, (requests.RequestException, mwclient.errors.MaximumRetriesExceeded,
+                              mwclient.errors.InvalidResponse))
+
+
+def _hash_job(fname):
+    try:
+        return file_hash(fname), path.getsize(fname), None
+    except OSError as e:
+        return None, None, '%s: %s' % (type(e).__name__, e)
+
+
+class UploadEngine(object):
+    '''
+    Concurrent, resumable upload of files to the wiki.
+    INPUT:
+        connect: function returning a logged in mwclient.Site, see site_factory(); it is
+                 called once per worker thread and again after a failed request
+        n_workers: number of parallel uploads (default is 4)
+        manifest: filename of the manifest of uploaded files, None to upload everything
+                  (default is MANIFEST)
+        manifest_key: name of the wiki in the manifest (default is wikiurl)
+        retries: attempts after the first failed one (default is 4)
+        backoff: seconds before the first retry, doubled for every further one (default is 1)
+        ignore: upload despite warnings, e.g. if a different file of the same name
+                exists (default is True)
+    '''
+    def __init__(self, connect, n_workers=4, manifest=MANIFEST, manifest_key=wikiurl, retries=4, backoff=1.,
+                 ignore=True):
+        self.connect = connect
+        self.n_workers = n_workers
+        self.manifest_file = manifest
+        self.manifest_key = manifest_key
+        self.retries = retries
+        self.backoff = backoff
+        self.ignore = ignore
+        self.manifest = {}
+        self.stats = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def site(self):
+        '''
+        Session of the calling thread, reused for all its uploads.
+        '''
+        wiki = getattr(self._local, 'wiki', None)
+        if wiki is None:
+            wiki = self._local.wiki = self.connect()
+        return wiki
+
+    def stop(self):
+        '''
+        Cancel the files that have not started, running uploads are finished.
+        '''
+        self._stop.set()
+
+    def _record(self, sha1, name, size):
+        with self._lock:
+            self.manifest.setdefault(self.manifest_key, {})[name] = dict(
+                sha1=sha1, size=size, uploaded=time.strftime('%Y-%m-%dT%H:%M:%S'))
+            if self.manifest_file is not None:
+                save_manifest(self.manifest, self.manifest_file)
+
+    def _upload_job(self, fname, name, sha1, size):
+        # worker of upload(), never raises
+        t0 = time.perf_counter()
+        result = dict(file=fname, name=name, size=size, status='uploaded', response=None, attempts=0, error=None)
+        for attempt in range(self.retries + 1):
+            if self._stop.is_set():
+                result['status'] = 'cancelled'
+                break
+            result['attempts'] = attempt + 1
+            try:
+                with open(fname, 'rb') as f:
+                    response = self.site().upload(f, name, ignore=self.ignore)
+                # chunked uploads return the whole answer of the api
+                response = response.get('upload', response)
+                result['response'] = response
+                if response.get('result') != 'Success':
+                    result['status'] = 'warning'
+                break
+            except Exception as e:
+                if isinstance(e, mwclient.errors.APIError) and e.code == 'fileexists-no-change':
+                    result['status'] = 'unchanged'
+                    break
+                if attempt == self.retries or not _retryable(e):
+                    result.update(status='failed', error='%s: %s' % (type(e).__name__, e))
+                    break
+                # the session may be broken (connection, token), the next attempt logs in again
+                self._local.wiki = None
+                if self._stop.wait(self.backoff * 2**attempt * random.uniform(1, 1.5)):
+                    result.update(status='cancelled', error='%s: %s' % (type(e).__name__, e))
+                    break
+        if result['status'] in ('uploaded', 'unchanged'):
+            self._record(sha1, name, size)
+        result['seconds'] = time.perf_counter() - t0
+        return result
+
+    def upload(self, files, names=None, progress=None):
+        '''
+        Upload files on the worker pool. Files that are in the manifest with the
+        same content under the same wiki name are skipped, every successful
+        upload is added to the manifest at once, so running the same list again
+        after an interruption only uploads the rest. Content that is on the wiki
+        under another name is uploaded again under the new name.
+        INPUT:
+            files: list of filenames
+            names: names of the files on the wiki (default is None, i.e. the file names without folder)
+            progress: called as progress(done, total, result) for every finished file, in the
+                      thread running upload() (default is None)
+        OUTPUT:
+            list of result dicts in input order with the keys file, name (name on the wiki),
+            size, status, response (answer of the wiki), attempts, seconds and error.
+            status is one of
+                'uploaded'
+                'unchanged'  the same file already was on the wiki under this name
+                'skipped'    in the manifest with this name and content
+                'duplicate'  same content and name as an earlier file of the list
+                'warning'    not uploaded, see response['warnings']
+                'failed'     see error, also for a name an earlier file of the list with other
+                             content is uploaded as
+                'cancelled'  stop() was called
+        '''
+        files = list(files)
+        names = [path.split(f)[-1] for f in files] if names is None else list(names)
+        self._stop.clear()
+        self.manifest = load_manifest(self.manifest_file) if self.manifest_file is not None else {}
+        uploaded = self.manifest[self.manifest_key] = _by_name(self.manifest.get(self.manifest_key, {}))
+        results = [None] * len(files)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+            jobs = {}
+            first = {}
+            done = 0
+            hashes = list(pool.map(_hash_job, files))
+            # names whose content is on the wiki already belong to that file, wherever it is in the
+            # list, so a different file of the same name conflicts on every run
+            for i, (sha1, size, error) in enumerate(hashes):
+                if error is None and uploaded.get(names[i], {}).get('sha1') == sha1:
+                    first.setdefault(names[i], (sha1, i))
+            for i, (sha1, size, error) in enumerate(hashes):
+                result = dict(file=files[i], name=names[i], size=size, status=None, response=None,
+                              attempts=0, error=error, seconds=0.)
+                if error is not None:
+                    result['status'] = 'failed'
+                elif uploaded.get(names[i], {}).get('sha1') == sha1:
+                    result['status'] = 'skipped'
+                elif names[i] in first and first[names[i]][0] == sha1:
+                    result['status'] = 'duplicate'
+                elif names[i] in first:
+                    # different content for the same wiki name, e.g. files of the same name from two folders
+                    result.update(status='failed', error='a different file of the list is uploaded as %s' % names[i])
+                else:
+                    first[names[i]] = (sha1, i)
+                    jobs[pool.submit(self._upload_job, files[i], names[i], sha1, size)] = i
+                    continue
+                results[i] = result
+                done += 1
+                if progress is not None:
+                    progress(done, len(files), result)
+            for future in as_completed(jobs):
+                results[jobs[future]] = result = future.result()
+                done += 1
+                if progress is not None:
+                    progress(done, len(files), result)
+        self.stats = self._stats(results, time.perf_counter() - t0)
+        return results
+
+    @staticmethod
+    def _stats(results, seconds):
+        counts = {}
+        for r in results:
+            counts[r['status']] = counts.get(r['status'], 0) + 1
+        uploaded = [r for r in results if r['status'] == 'uploaded']
+        nbytes = sum(r['size'] for r in uploaded)
+        return dict(files=len(uploaded), bytes=nbytes, seconds=seconds, counts=counts,
+                    files_per_s=len(uploaded) / seconds if seconds else 0.,
+                    mb_per_s=nbytes / 2**20 / seconds if seconds else 0.)
+
+    def summary(self):
+        '''
+        One line with counts and throughput of the last upload().
+        '''
+        s = self.stats
+        return ('%d files (%.1f MB) uploaded in %.1f s: %.2f files/s, %.2f MB/s (%s)'
+                % (s['files'], s['bytes'] / 2**20, s['seconds'], s['files_per_s'], s['mb_per_s'],
+                   ', '.join('%d %s' % (v, k) for k, v in s['counts'].items())))
+
+
+def collect_files(patterns, extensions=IMAGE_EXTENSIONS):
+    '''
+    Files for an upload, in the given order without repetitions.
+    INPUT:
+        patterns: list of filenames, glob patterns (e.g. 'Analyzed/*.png') or folders
+        extensions: file extensions taken from folders (default is IMAGE_EXTENSIONS)
+    OUTPUT:
+        list of filenames; files that do not exist are kept, the upload reports them
+    '''
+    files = []
+    for pattern in patterns:
+        if path.isdir(pattern):
+            matches = sorted(f for f in glob.glob(path.join(glob.escape(pattern), '*'))
+                             if path.splitext(f)[1].lower() in extensions)
+        elif glob.escape(pattern) != pattern:
+            matches = sorted(glob.glob(pattern))
+        else:
+            matches = [pattern]
+        files.extend(f for f in matches if f not in files)
+    return files
+
+
+def _to_8bit(frame):
+    # float and 16 bit images (e.g. .tif from batchconvert) scaled to their min/max
+    import numpy as np
+    from PIL import Image
+    data = np.asarray(frame, dtype=np.float64)
+    vmin, vmax = np.nanmin(data), np.nanmax(data)
+    data = (data - vmin) / (vmax - vmin if vmax > vmin else 1.) * 255
+    return Image.fromarray(np.nan_to_num(data).astype(np.uint8))
+
+
+def shrink_image(fname, out_folder, max_size=None, fmt=None, quality=85, out_name=None):
+    '''
+    Downscale an image to at most max_size pixels on its longest side and/or
+    save it in another format; all frames of animated images are kept (they are
+    never converted to jpeg).
+    INPUT:
+        fname: image file
+        out_folder: folder for the converted image
+        max_size: longest side in pixels (default is None, i.e. no downscaling)
+        fmt: 'png', 'jpeg', 'webp' or 'gif' (default is None, i.e. the format of the
+             file, tif becomes png)
+        quality: quality of jpeg and webp (default is 85)
+        out_name: file name of the converted image without extension (default is None,
+                  i.e. that of fname)
+    OUTPUT:
+        filename of the converted image, fname itself if nothing had to be changed
+    '''
+    from PIL import Image, ImageSequence
+    with Image.open(fname) as im:
+        source = (im.format or '').lower()
+        target = fmt or {'tiff': 'png', 'mpo': 'jpeg'}.get(source, source)
+        animated = getattr(im, 'n_frames', 1) > 1 and source in ('gif', 'png', 'webp')
+        if animated and target == 'jpeg':
+            target = source     # keep movies animated
+        if target not in FORMATS:
+            raise ValueError('Cannot save %s as %r, choose one of %s.' % (fname, target, sorted(FORMATS)))
+        scale = 1. if not max_size or max(im.size) <= max_size else max_size / max(im.size)
+        if scale == 1. and fmt is None and target == source:
+            return fname
+        size = (max(1, round(im.size[0] * scale)), max(1, round(im.size[1] * scale)))
+        info = dict(im.info)
+        frames = []
+        for frame in (ImageSequence.Iterator(im) if animated else [im]):
+            if frame.mode in ('F', 'I', 'I;16', 'I;16B', 'I;16L'):
+                frame = _to_8bit(frame)
+            elif frame.mode not in ('L', 'RGB', 'RGBA'):
+                frame = frame.convert('RGBA' if 'transparency' in frame.info or 'A' in frame.mode else 'RGB')
+            if target == 'jpeg' and frame.mode == 'RGBA':
+                frame = frame.convert('RGB')
+            frames.append(frame.resize(size, Image.LANCZOS) if scale != 1. else frame.copy())
+    options = dict(png=dict(compress_level=9), jpeg=dict(quality=quality, optimize=True),
+                   webp=dict(quality=quality, method=4), gif=dict())[target]
+    if len(frames) > 1:
+        options.update(save_all=True, append_images=frames[1:], loop=info.get('loop', 0))
+        if 'duration' in info:
+            options['duration'] = info['duration']
+    if out_name is None:
+        out_name = path.splitext(path.basename(fname))[0]
+    destination = path.join(out_folder, out_name + FORMATS[target])
+    frames[0].save(destination, format=target.upper(), **options)
+    return destination
+
+
+def _shrink_job(fname, out_folder, max_size, fmt, quality, out_name):
+    # worker of prepare_images(), never raises
+    from PIL import UnidentifiedImageError
+    result = dict(file=fname, output=fname, name=path.basename(fname), status='unchanged', error=None)
+    try:
+        result['output'] = shrink_image(fname, out_folder, max_size, fmt, quality, out_name)
+        if result['output'] != fname:
+            result['status'] = 'converted'
+            result['name'] = path.splitext(result['name'])[0] + path.splitext(result['output'])[1]
+    except UnidentifiedImageError:
+        pass    # no raster image (svg, pdf, ...), uploaded as it is
+    except Exception as e:
+        result.update(status='failed', error='%s: %s' % (type(e).__name__, e))
+    return result
+
+
+def prepare_images(files, out_folder, max_size=None, fmt=None, quality=85, n_processes=None):
+    '''
+    shrink_image() for a list of files on a process pool. The converted files
+    are named <index>_<name> in out_folder, so files of the same name from
+    different folders do not overwrite each other; the name on the wiki is
+    kept separately.
+    INPUT:
+        files: list of filenames
+        out_folder: folder for the converted images
+        max_size, fmt, quality: see shrink_image()
+        n_processes: number of processes (default is None, i.e. the number of cores)
+    OUTPUT:
+        list of dicts in input order with the keys file, output (file to upload), name (name
+        on the wiki: the file name with the extension of output), status ('converted',
+        'unchanged' or 'failed') and error
+    '''
+    if not path.exists(out_folder):
+        os.makedirs(out_folder)
+    n = len(files)
+    out_names = ['%04d_%s' % (i, path.splitext(path.basename(f))[0]) for i, f in enumerate(files)]
+    with ProcessPoolExecutor(max_workers=n_processes) as pool:
+        return list(pool.map(_shrink_job, files, [out_folder] * n, [max_size] * n, [fmt] * n, [quality] * n, out_names))
+
+
+def gallery_string(names):
+    '''
+    <gallery> block showing the files with the given names on the wiki.
+    '''
+    gallerystring = '<gallery>\n'
+    for name in names:
+        gallerystring += 'Image: %s | \n' % name
+    gallerystring += '</gallery>'
+    return gallerystring
+
+
+def gallery_names(results):
+    '''
+    Wiki names of the files that are on the wiki after an upload, see UploadEngine.upload().
+    '''
+    names = []
+    for r in results:
+        if r['status'] in GALLERY_STATUS and r['name'] not in names:
+            names.append(r['name'])
+    return names
+
+
+def add_gallery(wiki, pagename, names):
+    '''
+    Append the <gallery> block of names to a wiki page.
+    OUTPUT:
+        gallery string
+    '''
+    page = wiki.pages[pagename]
+    gallerystring = gallery_string(names)
+    page.save(page.text(cache=False) + '\n' + gallerystring, minor=True)
+    return gallerystring
+
+
+def upload_batch(files, engine, page=None, max_size=None, fmt=None, quality=85, n_processes=None, work_dir=None,
+                 progress=None):
+    '''
+    Convert and upload a list of images without any dialog.
+    INPUT:
+        files: list of filenames, see collect_files()
+        engine: UploadEngine
+        page: wiki page the gallery is appended to (default is None, i.e. no edit)
+        max_size, fmt, quality: see shrink_image(), all None keeps the files as they are
+                                (except tif, which becomes png)
+        n_processes: processes for the conversion (default is None, i.e. the number of cores)
+        work_dir: folder for the converted images (default is None, i.e. a temporary folder
+                  that is removed afterwards)
+        progress: see UploadEngine.upload()
+    OUTPUT:
+        list of upload results (see UploadEngine.upload()) with the original file as 'source'
+        and the status of prepare_images() as 'conversion', gallery string
+    '''
+    files = list(files)
+    temporary = work_dir is None
+    if temporary:
+        work_dir = tempfile.mkdtemp(prefix='bulkupload_')
+    try:
+        prepared = prepare_images(files, work_dir, max_size, fmt, quality, n_processes)
+        ok = [p for p in prepared if p['status'] != 'failed']
+        uploaded = iter(engine.upload([p['output'] for p in ok], [p['name'] for p in ok], progress=progress))
+        results = []
+        for p in prepared:
+            if p['status'] == 'failed':
+                result = dict(file=p['file'], name=p['name'], size=None, status='failed',
+                              response=None, attempts=0, error=p['error'], seconds=0.)
+            else:
+                result = next(uploaded)
+            result.update(source=p['file'], conversion=p['status'])
+            results.append(result)
+    finally:
+        if temporary:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    names = gallery_names(results)
+    if page is not None and names:
+        return results, add_gallery(engine.site(), page, names)
+    return results, gallery_string(names)
 
 
 class gui_upload(object):
@@ -47,6 +551,7 @@ class gui_upload(object):
         return
 
     def connect(self, wikiurl):
+        self.wikiurl = wikiurl
         try:
             self.wiki = mwclient.Site(wikiurl, path='/sg/')
             self.wiki.login(self.user, self.passwd, domain='MBI-LDAP')
@@ -58,10 +563,29 @@ class gui_upload(object):
             sys.exit()
         return
 
-    def upload(self):
-        for fname in self.files:
-            with open(fname, 'rb') as f:
-                self.results.append(self.wiki.upload(f, path.split(fname)[-1], ignore=True))
+    def upload(self, n_workers=4):
+        self.engine = UploadEngine(site_factory(self.wikiurl, self.user, self.passwd),
+                                   n_workers=n_workers, manifest_key=self.wikiurl)
+        window = tkinter.Toplevel(self.root)
+        window.title('upload')
+        label = tkinter.Label(window, width=60, text='Checking %d files' % len(self.files))
+        label.pack(padx=10, pady=10)
+        window.protocol('WM_DELETE_WINDOW', self.engine.stop)
+        status = {}
+
+        def progress(done, total, result):
+            status['text'] = '%d/%d  %s: %s' % (done, total, result['name'], result['status'])
+
+        worker = threading.Thread(
+            target=lambda: self.results.extend(self.engine.upload(self.files, progress=progress)))
+        worker.start()
+        # the uploads run in the background, Tk keeps handling its events
+        while worker.is_alive():
+            if 'text' in status:
+                label.config(text=status['text'])
+            self.root.update()
+            worker.join(0.05)
+        window.destroy()
         return
 
     def get_recent_changes(self):
@@ -77,22 +601,20 @@ class gui_upload(object):
         gallerypage = asklistchoice('Add gallery statement to page?',
                                      self.get_recent_changes())
         if gallerypage != '':
-            page = self.wiki.pages[gallerypage]
-            gallerystring = '<gallery>\n'
-            for f in self.files:
-                gallerystring += 'Image: %s | \n' % path.split(f)[-1]
-            gallerystring += '</gallery>'
-            page.save(page.text(cache=False) + '\n' + gallerystring, minor=True)
+            add_gallery(self.wiki, gallerypage, gallery_names(self.results))
         return
 
     def show_results(self):
         result_str = ''
-        for f, r in zip(self.files, self.results):
-            if 'warnings' in r.keys():
-                warns = ['%s: %s\n' % (k, v) for k, v in r['warnings'].items()]
+        for r in self.results:
+            if r['status'] == 'warning':
+                warns = ['%s: %s\n' % (k, v) for k, v in r['response']['warnings'].items()]
                 result_str += linesep.join(warns)
+            elif r['error'] is not None:
+                result_str += '%s: %s, %s' % (r['file'], r['status'], r['error']) + linesep
             else:
-                result_str += '%s: %s' % (f, r['result']) + linesep
+                result_str += '%s: %s' % (r['file'], r['status']) + linesep
+        result_str += linesep + self.engine.summary()
         showinfo('upload summary', result_str)
         return
 
@@ -151,8 +673,15 @@ def asklistchoice(title, choices, **kw):
     return d.result
 
 
-if __name__ == "__main__":
-    if '--nocertcheck' in sys.argv[1:]:
+def print_progress(done, total, result):
+    line = '[%*d/%d] %s: %s' % (len(str(total)), done, total, result['name'], result['status'])
+    if result['error'] is not None:
+        line += ' ' + result['error']
+    print(line)
+
+
+def run_gui(nocertcheck=False):
+    if nocertcheck:
         import ssl
 #        if True:
         if hasattr(ssl, '_create_unverified_context'):
@@ -165,4 +694,55 @@ if __name__ == "__main__":
     g.upload()
     g.write_gallery_string()
     g.show_results()
-    g.close_gui()
\ No newline at end of file
+    g.close_gui()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Upload images to the wiki. Without files, the Tk dialogs are used.')
+    parser.add_argument('files', nargs='*', help='files, glob patterns or folders')
+    parser.add_argument('--list', help="text file with one file per line, '-' for stdin")
+    parser.add_argument('--user', default=os.environ.get('BULKUPLOAD_USER'),
+                        help='wiki user (default: $BULKUPLOAD_USER, password from $BULKUPLOAD_PASSWORD)')
+    parser.add_argument('--wiki', default=wikiurl)
+    parser.add_argument('--wikipath', default='/sg/')
+    parser.add_argument('--scheme', default='https', choices=['https', 'http'])
+    parser.add_argument('--page', help='append the gallery to this wiki page')
+    parser.add_argument('--max-size', type=int, default=None, help='downscale to this many pixels on the longest side')
+    parser.add_argument('--format', default=None, choices=sorted(FORMATS), help='recompress into this format')
+    parser.add_argument('--quality', type=int, default=85, help='jpeg/webp quality (default 85)')
+    parser.add_argument('--workers', type=int, default=4, help='parallel uploads (default 4)')
+    parser.add_argument('--processes', type=int, default=None, help='conversion processes (default: number of cores)')
+    parser.add_argument('--work-dir', default=None, help='keep the converted images in this folder')
+    parser.add_argument('--no-manifest', action='store_true', help='upload even files that are in the manifest')
+    parser.add_argument('--nocertcheck', action='store_true')
+    args = parser.parse_args(argv)
+
+    patterns = list(args.files)
+    if args.list is not None:
+        with (sys.stdin if args.list == '-' else open(args.list)) as f:
+            patterns += [line.strip() for line in f if line.strip()]
+    if args.list is None and not patterns:
+        run_gui(args.nocertcheck)
+        return
+    files = collect_files(patterns)
+    if not files:
+        sys.exit('No files match %s' % ' '.join(patterns))
+    if args.user is None:
+        sys.exit('--user or BULKUPLOAD_USER is needed without the dialogs')
+    passwd = os.environ.get('BULKUPLOAD_PASSWORD') or getpass.getpass('wiki password for %s: ' % args.user)
+    kwargs = dict(reqs={'verify': False}) if args.nocertcheck else {}
+    engine = UploadEngine(site_factory(args.wiki, args.user, passwd, wikipath=args.wikipath, scheme=args.scheme, **kwargs),
+                          n_workers=args.workers, manifest=None if args.no_manifest else MANIFEST, manifest_key=args.wiki)
+    results, gallerystring = upload_batch(files, engine, args.page, args.max_size, args.format, args.quality,
+                                          args.processes, args.work_dir, progress=print_progress)
+    for r in results:
+        if r['conversion'] == 'failed':
+            print('%s: conversion failed, %s' % (r['source'], r['error']))
+    print(engine.summary())
+    print(gallerystring)
+    if any(r['status'] == 'failed' for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+HDF5 store for processed MAXYMUS data: sorted and normalized time resolved
+stacks and position corrected images of a beamtime in one file, so they can be
+reloaded without running the preprocessing again.
+
+Stacks are chunked in blocks of a few frames and spatial tiles and compressed
+(Blosc/LZ4 if hdf5plugin is installed, gzip otherwise), so single frames or
+ROIs are read without decompressing the whole stack. Every dataset carries
+provenance attributes. Reading Blosc compressed stores needs hdf5plugin as
+well; ProcessedStore imports it when available.
+
+    with ProcessedStore('beamtime.h5') as store:
+        store.write_stack('bbx_353/normalized', stack, provenance = dict(source = fname, magic_number = 20))
+        store.write_image('Sample_Image_2024-04-11_033/posCorr', I_pc)
+        frame = store.read_frame('bbx_353/normalized', 100)
+        roi = store.read_roi('bbx_353/normalized', [10, 60, 20, 80], frames = [0, 99])
+"""
+
+import json
+import time
+
+import h5py
+import numpy as np
+
+
+def resolve_compression(compression = 'auto'):
+    '''
+    'blosc' if compression is 'auto' and hdf5plugin is installed (importing it
+    also registers the filters needed to read Blosc datasets), 'gzip' for
+    'auto' otherwise, else compression unchanged.
+    '''
+    if compression != 'auto':
+        return compression
+    try:
+        import hdf5plugin
+    except ImportError:
+        return 'gzip'
+    # importing hdf5plugin registers its filters with HDF5, check that Blosc is available
+    return 'blosc' if h5py.h5z.filter_avail(hdf5plugin.Blosc.filter_id) else 'gzip'
+
+
+def compression_options(compression = 'auto', level = None):
+    '''
+    Keyword arguments for h5py create_dataset().
+    INPUT:
+        compression: 'auto' (Blosc/LZ4 if hdf5plugin is available, otherwise gzip),
+                     'blosc', 'gzip', 'lzf' or None (default is 'auto')
+        level: compression level, None for the default of the filter
+    OUTPUT:
+        dict of create_dataset() arguments
+    '''
+    compression = resolve_compression(compression)
+    if compression == 'blosc':
+        import hdf5plugin
+        return dict(hdf5plugin.Blosc(cname = 'lz4', clevel = 5 if level is None else level, shuffle = hdf5plugin.Blosc.SHUFFLE))
+    if compression == 'gzip':
+        return dict(compression = 'gzip', compression_opts = 4 if level is None else level, shuffle = True)
+    if compression == 'lzf':
+        return dict(compression = 'lzf', shuffle = True)
+    if compression is None:
+        return dict()
+    raise ValueError("compression must be 'auto', 'blosc', 'gzip', 'lzf' or None, got %r." % compression)
+
+
+def chunk_shape(shape, frames_per_chunk = 8, tile = 64):
+    '''
+    Chunks of frames_per_chunk frames and tile x tile pixels for 3d stacks,
+    tile x tile pixels for 2d images.
+    '''
+    spatial = tuple(min(n, tile) for n in shape[-2:])
+    if len(shape) == 2:
+        return spatial
+    return (max(1, min(shape[0], frames_per_chunk)),) + spatial
+
+
+def _attr_value(value):
+    # h5py stores numbers, strings and arrays; everything else is kept as json
+    if isinstance(value, (str, bytes, int, float, np.generic)):
+        return value
+    if isinstance(value, slice):
+        return json.dumps([value.start, value.stop, value.step])
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+        return value
+    try:
+        return json.dumps(value, default = str)
+    except TypeError:
+        return str(value)
+
+
+class ProcessedStore(object):
+    '''
+    HDF5 file with processed stacks and images.
+    INPUT:
+        fname: filename of the store
+        mode: h5py file mode (default is 'a', i.e. read/write, created if missing)
+        compression, level: see compression_options() (default is 'auto')
+        frames_per_chunk: frames per chunk of stacks (default is 8)
+        tile: spatial chunk size in pixels (default is 64)
+    '''
+    def __init__(self, fname, mode = 'a', compression = 'auto', level = None, frames_per_chunk = 8, tile = 64):
+        self.fname = fname
+        self.compression_name = resolve_compression(compression)
+        self.compression = compression_options(self.compression_name, level)
+        self.file = h5py.File(fname, mode)
+        self.frames_per_chunk = frames_per_chunk
+        self.tile = tile
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.file
+
+    def names(self):
+        '''
+        Names of all datasets in the store.
+        '''
+        names = []
+        self.file.visititems(lambda name, obj: names.append(name) if isinstance(obj, h5py.Dataset) else None)
+        return names
+
+    def _create(self, name, shape, dtype, provenance, overwrite):
+        if name in self.file:
+            if not overwrite:
+                raise ValueError('%s already exists in %s, use overwrite = True to replace it.' % (name, self.fname))
+            del self.file[name]
+        chunks = chunk_shape(shape, self.frames_per_chunk, self.tile)
+        ds = self.file.create_dataset(name, shape = shape, dtype = dtype, chunks = chunks, **self.compression)
+        attrs = dict(created = time.strftime('%Y-%m-%dT%H:%M:%S'), writer = 'h5store.ProcessedStore', compression = str(self.compression_name),
+                     numpy_version = np.__version__, h5py_version = h5py.__version__)
+        attrs.update(provenance or {})
+        for key, value in attrs.items():
+            if value is not None:   # unset provenance entries are left out instead of stored as 'None'
+                ds.attrs[key] = _attr_value(value)
+        return ds
+
+    def write_stack(self, name, data, provenance = None, dtype = None, overwrite = False, block_frames = None):
+        '''
+        Write a [time, y, x] stack block by block, so lazy stacks (BBXStack,
+        SortedStack, np.memmap) are never loaded completely.
+        INPUT:
+            name: dataset name, groups are separated by '/'
+            data: 3d stack with time as first axis
+            provenance: dict of attributes, e.g. source file, magic_number, tlim, XMCD; None values are skipped (default is None)
+            dtype: dtype in the file (default is None, i.e. the dtype of data)
+            overwrite: replace an existing dataset (default is False)
+            block_frames: frames written at once (default is None, i.e. 8 chunks)
+        OUTPUT:
+            h5py Dataset
+        '''
+        shape = tuple(data.shape)
+        if len(shape) != 3:
+            raise ValueError('Expected a [time, y, x] stack, got shape %s.' % (shape,))
+        ds = self._create(name, shape, dtype or data.dtype, provenance, overwrite)
+        block_frames = block_frames or 8 * ds.chunks[0]
+        for a in range(0, shape[0], block_frames):
+            b = min(a + block_frames, shape[0])
+            ds[a:b] = np.asarray(data[a:b])
+        return ds
+
+    def write_image(self, name, image, provenance = None, dtype = None, overwrite = False):
+        '''
+        Write a 2d image, e.g. a position corrected scan.
+        INPUT:
+            name: dataset name, groups are separated by '/'
+            image: 2d image
+            provenance: dict of attributes, e.g. source file, interpolation; None values are skipped (default is None)
+            dtype: dtype in the file (default is None, i.e. the dtype of image)
+            overwrite: replace an existing dataset (default is False)
+        OUTPUT:
+            h5py Dataset
+        '''
+        image = np.asarray(image)
+        if image.ndim != 2:
+            raise ValueError('Expected a 2d image, got shape %s.' % (image.shape,))
+        ds = self._create(name, image.shape, dtype or image.dtype, provenance, overwrite)
+        ds[...] = image
+        return ds
+
+    def read(self, name):
+        return self.file[name][()]
+
+    def read_frame(self, name, index):
+        '''
+        Single frame of a stack, only the chunks holding it are decompressed.
+        '''
+        return self.file[name][index]
+
+    def read_roi(self, name, roi, frames = None):
+        '''
+        Region of interest of a stack or image.
+        INPUT:
+            name: dataset name
+            roi: region of interest [x0, x1, y0, y1] (python slice convention, as import_bbx())
+            frames: list of start and stop frame number (both included), None for all frames
+        OUTPUT:
+            np.array [time, y, x] for stacks, [y, x] for images
+        '''
+        ds = self.file[name]
+        spatial = np.s_[roi[2]:roi[3], roi[0]:roi[1]]
+        if ds.ndim == 2:
+            return ds[spatial]
+        t = np.s_[:] if frames is None else np.s_[frames[0]:frames[1]+1]
+        return ds[(t,) + spatial]
+
+    def provenance(self, name):
+        '''
+        Attributes of a dataset, json encoded values decoded.
+        '''
+        attrs = {}
+        for key, value in self.file[name].attrs.items():
+            if isinstance(value, str) and value[:1] in '[{':
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            attrs[key] = value
+        return attrs
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Reader for MAXYMUS scans (Sample_Image_*.hdf5) that opens every file once and
+resolves datasets through mnemonics.
+
+    scan = MaxymusScan.from_id(data_folder, file_prefix, 353)
+    image = scan.image
+    pixel_size_y, pixel_size_x = scan.pixel_size
+    field, energy = scan.magnetic_field, scan.energy
+"""
+
+import os
+import sys
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+
+
+# List of h5 keys for simple loading. {entry} and {detector} are filled in per
+# scan; if several paths are given, the first one present in the file is used.
+MNEMONICS = dict()
+MNEMONICS["image"] = "/{entry}/{detector}/data"
+MNEMONICS["energy"] = "/{entry}/{detector}/energy"
+MNEMONICS["count_time"] = "/{entry}/{detector}/count_time"
+MNEMONICS["sample_x"] = "/{entry}/{detector}/sample_x"
+MNEMONICS["sample_y"] = "/{entry}/{detector}/sample_y"
+MNEMONICS["magnetic_field"] = ["/{entry}/collection/magnetic_field/user_value", "/{entry}/{detector}/magnetic_field"]
+MNEMONICS["readback_x"] = "/{entry}/instrument/sample_x/data"
+MNEMONICS["readback_y"] = "/{entry}/instrument/sample_y/data"
+MNEMONICS["signal"] = "/{entry}/instrument/{detector}/data"
+MNEMONICS["start_time"] = "/{entry}/start_time"
+MNEMONICS["end_time"] = "/{entry}/end_time"
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class LRUCache(object):
+    '''
+    Least recently used cache with a budget in bytes instead of a number of
+    entries. Values larger than the budget are not cached.
+    INPUT:
+        max_bytes: byte budget (default is 256 MB)
+    '''
+    def __init__(self, max_bytes = 256 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default = None):
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key][0]
+
+    def put(self, key, value):
+        size = _nbytes(value)
+        self.pop(key)
+        if size > self.max_bytes:
+            return
+        self._data[key] = (value, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, s) = self._data.popitem(last = False)
+            self.nbytes -= s
+
+    def pop(self, key):
+        if key in self._data:
+            self.nbytes -= self._data.pop(key)[1]
+
+    def clear(self):
+        self._data.clear()
+        self.nbytes = 0
+
+
+class MaxymusScan(object):
+    '''
+    Single scan recorded at the MAXYMUS microscope. The .hdf5 file is opened
+    on first access and kept open until close() is called (or the scan is
+    used as context manager). Mnemonic paths are resolved on first use, values
+    read from the file are kept in an LRU cache with a byte budget.
+    INPUT:
+        fname: filename of the scan
+        entry: hdf5 entry (default is 'entry1')
+        detector: 'APD', 'timemachine', 'PMT' or 'VCO' (default is 'APD')
+        mnemonics: dict mnemonic -> path or list of candidate paths (default is MNEMONICS)
+        cache_bytes: byte budget of the cache (default is 256 MB)
+    '''
+    def __init__(self, fname, entry = 'entry1', detector = 'APD', mnemonics = None, cache_bytes = 256 * 2**20):
+        self.fname = fname
+        self.entry = entry
+        self.detector = detector
+        self.mnemonics = dict(MNEMONICS if mnemonics is None else mnemonics)
+        self.cache = LRUCache(cache_bytes)
+        self._paths = {}
+        self._file = None
+
+    @classmethod
+    def from_id(cls, data_folder, file_prefix, im_id, **kwargs):
+        '''
+        Scan <data_folder>/<file_prefix>_<im_id>.hdf5, e.g. file_prefix = 'Sample_Image_2024-04-18'.
+        '''
+        return cls(os.path.join(data_folder, "%s_%03d.hdf5" % (file_prefix, im_id)), **kwargs)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.fname)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def exists(self):
+        return os.path.exists(self.fname)
+
+    @property
+    def file(self):
+        if self._file is None:
+            self._file = h5py.File(self.fname, 'r')
+        return self._file
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def path(self, mnemonic):
+        '''
+        Resolve a mnemonic to its path in this file. Absolute hdf5 paths are
+        returned unchanged. Raises KeyError if none of the candidates exists.
+        '''
+        if mnemonic.startswith('/'):
+            return mnemonic
+        if mnemonic not in self._paths:
+            candidates = self.mnemonics[mnemonic]
+            if isinstance(candidates, str):
+                candidates = [candidates]
+            for candidate in candidates:
+                p = candidate.format(entry = self.entry, detector = self.detector)
+                if p in self.file:
+                    self._paths[mnemonic] = p
+                    break
+            else:
+                raise KeyError('%s not found in %s' % (mnemonic, self.fname))
+        return self._paths[mnemonic]
+
+    def dataset(self, mnemonic):
+        '''
+        h5py.Dataset of a mnemonic, nothing is read.
+        '''
+        return self.file[self.path(mnemonic)]
+
+    def __contains__(self, mnemonic):
+        try:
+            self.path(mnemonic)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, mnemonic):
+        '''
+        Full content of a mnemonic, cached.
+        '''
+        p = self.path(mnemonic)
+        value = self.cache.get(p)
+        if value is None:
+            value = self.file[p][()]
+            self.cache.put(p, value)
+        return value
+
+    def read(self, mnemonic, selection = np.s_[...]):
+        '''
+        Read only a selection (e.g. an ROI) of a dataset, not cached.
+        '''
+        return self.dataset(mnemonic)[selection]
+
+    def scalar(self, mnemonic):
+        '''
+        Single value of a dataset stored as array of one element; bytes are decoded.
+        '''
+        value = self[mnemonic]
+        if isinstance(value, np.ndarray):
+            value = value.reshape(-1)[0]
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', 'replace')
+        elif isinstance(value, np.generic):
+            value = value.item()
+        return value
+
+    @property
+    def image(self):
+        return self['image']
+
+    @property
+    def shape(self):
+        return self.dataset('image').shape
+
+    @property
+    def energy(self):
+        return self.scalar('energy')
+
+    @property
+    def magnetic_field(self):
+        return self.scalar('magnetic_field')
+
+    @property
+    def pixel_size(self):
+        '''
+        Pixel size (y, x) calculated from the setpoint positions.
+        '''
+        sample_x = self['sample_x']
+        sample_y = self['sample_y']
+        pixel_size_x = np.round(np.mean(np.abs(sample_x[0:-2] - sample_x[1:-1])), 3)
+        pixel_size_y = np.round(np.mean(np.abs(sample_y[0:-2] - sample_y[1:-1])), 3)
+        return (pixel_size_y, pixel_size_x)
+
+    def metadata(self, max_size = 1):
+        '''
+        Scalar metadata of the scan: all datasets in the detector group and all
+        mnemonics with at most max_size elements, plus the units attributes.
+        The image payload is never read.
+        OUTPUT:
+            dict name -> value
+        '''
+        meta = dict(fname = self.fname, shape = self.shape)
+        names = {}
+        group = self.file['/%s/%s' % (self.entry, self.detector)]
+        for key, ds in group.items():
+            if isinstance(ds, h5py.Dataset):
+                names[key] = ds.name
+        for mnemonic in self.mnemonics:
+            if mnemonic in self:
+                names[mnemonic] = self.path(mnemonic)
+        for key, p in names.items():
+            ds = self.file[p]
+            if ds.size > max_size:
+                continue
+            meta[key] = self.scalar(p) if ds.size == 1 else self[p]
+            units = ds.attrs.get('units')
+            if units is not None:
+                meta[key + '_units'] = units.decode('utf-8', 'replace') if isinstance(units, bytes) else str(units)
+        return meta
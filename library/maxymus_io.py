@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+Data import of the MAXYMUS microscope at BESSY: single images, .bbx stacks
+(lazy memmaps), .hdr headers and series of .hdf5 scans. Only numpy is
+imported with the module, pandas on the first call of import_single() or
+import_headers().
+
+Part of pymaxymus, which re-exports everything:
+
+    from maxymus_io import import_bbx, parse_header
+    stack = import_bbx(fname, lazy = True)
+
+authors: Kathinka Gerlinger, Michael Schneider, Max Born Institute Berlin
+"""
+
+import os
+import re
+import functools
+
+import numpy as np
+
+##################################################################################################################
+
+#                     IMPORT DATA
+
+##################################################################################################################
+
+def import_single(fname):
+    '''
+    Import a single image recorded at the MAXYMUS microscope at BESSY.
+    INPUT:
+        filename including path
+    OUTPUT:
+        np.array of the data
+    KG, 01.2020
+    '''
+    import pandas as pd
+    data = pd.read_csv(fname, sep = '\t', header = None)
+    data = np.array(data)
+    if np.isnan(data[0,-1]): #in the file, KG used as example, the last column contained NaN.
+        return data[:, :-1]
+    return data
+
+BBX_MASK = 0x7FFFF  # counts are stored in the lower 19 bits of each >i4 word
+
+class BBXStack(object):
+    '''
+    Lazy [time, y, x] view on a memory-mapped .bbx file as returned by
+    import_bbx(..., lazy = True). Nothing is read from disk until the stack is
+    indexed; only the requested frames/pixels are masked with BBX_MASK and
+    converted to native int32.
+    INPUT:
+        raw: big-endian np.memmap (or a view of it) with dimensions [time, y, x]
+    '''
+    def __init__(self, raw):
+        self.raw = raw
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def ndim(self):
+        return self.raw.ndim
+
+    @property
+    def dtype(self):
+        return np.dtype(np.int32)
+
+    @property
+    def size(self):
+        return self.raw.size
+
+    def __len__(self):
+        return self.raw.shape[0]
+
+    def __getitem__(self, key):
+        selection = np.asarray(self.raw[key])
+        out = selection.astype(np.int32) # byte swap to native order, copies only the selection
+        out &= BBX_MASK
+        return out
+
+    def __array__(self, dtype = None, copy = None):
+        out = self[...]
+        if dtype is not None:
+            out = out.astype(dtype, copy = False)
+        return out
+
+    def subset(self, frames = None, roi = None):
+        '''
+        Restrict the stack to a range of frames and/or a region of interest
+        without reading any data.
+        INPUT:
+            frames: list of start and stop frame number (both included), None for all frames
+            roi: region of interest [x0, x1, y0, y1] (python slice convention), None for the full image
+        OUTPUT:
+            BBXStack
+        '''
+        t = np.s_[:] if frames is None else np.s_[frames[0]:frames[1]+1]
+        if roi is None:
+            return BBXStack(self.raw[t])
+        return BBXStack(self.raw[t, roi[2]:roi[3], roi[0]:roi[1]])
+
+def import_bbx(fname, lazy = False, frames = None, roi = None):
+    '''
+    Import the time resolved data recorded at the MAXYMUS microscope at BESSY.
+    INPUT:
+        fname: filename to load
+        lazy: if True, memory-map the file and return a BBXStack that only reads
+              the frames you index (default is False)
+        frames: list of start and stop frame number (both included) to load, None for all frames
+        roi: region of interest [x0, x1, y0, y1] to load, None for the full image
+    OUTPUT:
+        native int32 np.array (or BBXStack if lazy) of the data with dimensions [time, y, x]
+    KG, MS 01.2020
+    '''
+    if not lazy and frames is None and roi is None:
+        imagedata = np.fromfile(fname, dtype='>i4').astype(np.int32) # native byte order, as the lazy path
+        imagedata &= BBX_MASK
+        dim_t, dim_x, dim_y = imagedata[:3]
+        return np.reshape(imagedata[3:], (dim_t, dim_y, dim_x))
+
+    dim_t, dim_x, dim_y = np.bitwise_and(np.fromfile(fname, dtype='>i4', count=3), BBX_MASK)
+    raw = np.memmap(fname, dtype='>i4', mode='r', offset=3*4, shape=(int(dim_t), int(dim_y), int(dim_x)))
+    stack = BBXStack(raw).subset(frames, roi)
+    if lazy:
+        return stack
+    return stack[...]
+
+_HDR_TOKEN = re.compile(r'''"(?:[^"\n\r\\]|""|\\(?:[^x]|x[0-9a-fA-F]+))*"'''    # double quoted string
+                        r"|'(?:[^'\n\r\\]|''|\\(?:[^x]|x[0-9a-fA-F]+))*'"        # single quoted string
+                        r"|[A-Za-z0-9_.\-]+"                                      # name or number
+                        r"|\S")                                                  # punctuation
+_HDR_NAME = re.compile(r"[A-Za-z0-9_]+$")
+_HDR_NUMBER = re.compile(r"[0-9.\-]+$")
+
+def _parse_header_text(text):
+    '''
+    Recursive descent parser for the header format
+        entry = name '=' value ';'
+        value = '{' entry+ '}' | '(' count ',' (dict|number) [',' (dict|number)]* ')' | number | quoted string
+    Dicts become dicts, lists of numbers lists of floats. As with the former
+    pyparsing grammar, the result is the content of the first entry, and the
+    dicts in a list are merged into one dict (later keys win).
+    '''
+    tokens = _HDR_TOKEN.findall(text)
+    n = len(tokens)
+    pos = 0
+
+    def fail(expected):
+        found = repr(tokens[pos]) if pos < n else 'end of file'
+        raise ValueError('Header: expected %s, found %s (token %d).' % (expected, found, pos))
+
+    def expect(token):
+        nonlocal pos
+        if pos >= n or tokens[pos] != token:
+            fail(repr(token))
+        pos += 1
+
+    def number():
+        nonlocal pos
+        token = tokens[pos] if pos < n else ''
+        if not _HDR_NUMBER.match(token):
+            fail('number')
+        pos += 1
+        return float(token)
+
+    def dictionary():
+        nonlocal pos
+        pos += 1    # '{'
+        result = {}
+        while True:
+            key, value = entry()
+            result[key] = value
+            if pos < n and tokens[pos] == '}':
+                pos += 1
+                return result
+
+    def listing():
+        nonlocal pos
+        pos += 1    # '('
+        if pos >= n or not tokens[pos].isdigit():
+            fail('list count')
+        pos += 1
+        expect(',')
+        values = []
+        while True:
+            values.append(dictionary() if pos < n and tokens[pos] == '{' else number())
+            if pos < n and tokens[pos] == ',':
+                pos += 1
+                continue
+            expect(')')
+            break
+        dicts = [v for v in values if isinstance(v, dict)]
+        if not dicts:
+            return values
+        merged = {}
+        for d in dicts:
+            merged.update(d)
+        return merged
+
+    def value():
+        nonlocal pos
+        token = tokens[pos] if pos < n else ''
+        if token == '{':
+            return dictionary()
+        if token == '(':
+            return listing()
+        if token[:1] in ('"', "'") and len(token) > 1:
+            pos += 1
+            return token[1:-1]
+        return number()
+
+    def entry():
+        nonlocal pos
+        if pos >= n or not _HDR_NAME.match(tokens[pos]):
+            fail('name')
+        key = tokens[pos]
+        pos += 1
+        expect('=')
+        result = value()
+        expect(';')
+        return key, result
+
+    key, result = entry()
+    return result if tokens[2:3] == ['{'] else {}
+
+@functools.lru_cache(maxsize = 256)
+def _parse_header_file(fname, mtime_ns, size):
+    with open(fname, 'r') as file:
+        return _parse_header_text(file.read())
+
+def _copy_tree(obj):
+    # copy of the nested dicts and lists, so callers cannot modify cached headers
+    if isinstance(obj, dict):
+        return {k: _copy_tree(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_copy_tree(v) for v in obj]
+    return obj
+
+def parse_header(fname, cache = True):
+    '''
+    Parses the separate header files (*.hdr) and returns a nested dict.
+    Parsed headers are cached by path, modification time and size.
+    INPUT:
+        fname: filename of the header
+        cache: use the cache (default is True)
+    OUTPUT:
+        nested dict with the content of the first entry (ScanDefinition)
+    '''
+    if not cache:
+        with open(fname, 'r') as file:
+            return _parse_header_text(file.read())
+    st = os.stat(fname)
+    return _copy_tree(_parse_header_file(os.path.abspath(fname), st.st_mtime_ns, st.st_size))
+    
+
+_HEADER_COLUMNS = ['Dwelltime', 'X-range', 'X-steps', 'Y-range', 'Y-steps']
+_NOT_NUMBER = re.compile(r'[^0-9.\-]')
+
+@functools.lru_cache(maxsize = None)
+def _keyword_pattern(keyword):
+    return re.compile(re.escape(keyword) + r' = (.*?);')
+
+def _to_number(value):
+    # '(81, -2, ...)' -> 81., '1.5' -> 1.5, '2.' -> 2.
+    if not value[0].isdigit() and value[0] != '-':
+        return float(_NOT_NUMBER.sub('', value[1:].split(',', 1)[0]))
+    if not value[-1].isdigit():
+        return float(value[:-1])
+    return float(value)
+
+def _header_numbers(fname):
+    '''
+    Dwell time, scan ranges and step numbers of one header in a single pass
+    over its lines; values that are not found are NaN.
+    '''
+    dwell, p_min, p_max, q_min, q_max, points = (_keyword_pattern(k) for k in ('Dwell', 'Min', 'Max', 'Min', 'Max', 'Points'))
+
+    def number(pattern, text):
+        match = pattern.search(text)
+        return _to_number(match.group(1)) if match else np.nan
+
+    values = dict.fromkeys(_HEADER_COLUMNS, np.nan)
+    x_min = x_max = y_min = y_max = np.nan
+    next_line_x = False
+    next_line_y = False
+    with open(fname, 'r') as file:
+        for text in file:
+            if 'ScanDefinition' in text:
+                values['Dwelltime'] = number(dwell, text)
+            if 'PAxis' in text:
+                x_min, x_max = number(p_min, text), number(p_max, text)
+                next_line_x = True
+                continue
+            if next_line_x:
+                values['X-steps'] = number(points, text)
+                next_line_x = False
+            if 'QAxis' in text:
+                y_min, y_max = number(q_min, text), number(q_max, text)
+                next_line_y = True
+                continue
+            if next_line_y:
+                values['Y-steps'] = number(points, text)
+                next_line_y = False
+    values['X-range'] = np.abs(x_max - x_min)
+    values['Y-range'] = np.abs(y_max - y_min)
+    return values
+
+def import_headers(fnames, fsave = None, key = 'header'):
+    '''
+    Import the headers of many measurements recorded at the MAXYMUS microscope at BESSY.
+    INPUT:
+        fnames: list of header filenames (*.hdr)
+        fsave: filename of a hdf file the table is appended to (default is None, i.e. not saved)
+        key: key of the table in the hdf file (default is 'header')
+    OUTPUT:
+        Pandas DataFrame with the dwelltime, x-range, x-step numbers, y-range and y-step numbers,
+        one row per file, indexed by the file name without extension
+    '''
+    fnames = list(fnames)
+    rows = [_header_numbers(fname) for fname in fnames]
+    import pandas as pd
+    index = pd.Index([os.path.splitext(os.path.basename(fname))[0] for fname in fnames], name = 'File')
+    df = pd.DataFrame(rows, index = index, columns = _HEADER_COLUMNS, dtype = float)
+    if fsave is not None:
+        df.to_hdf(fsave, key = key, mode = 'a', format = 'table', append = True, min_itemsize = {'index': 128})
+    return df
+
+def import_header(fname, fsave = None):
+    '''
+    Import the header for data recorded at the MAXYMUS microscope at BESSY.
+    INPUT:
+        fname: filename to load
+        fsave: filname of a hdf file the header data is appended to (default is None, i.e. not saved)
+    OUTPUT:
+        Pandas DataFrame with the dwelltime, x-range, x-step numbers, y-range and y-step numbers
+    KG, MS 01.2020
+    '''
+    return import_headers([fname], fsave).reset_index(drop = True)
+
+def get_number(keyword, text):
+    match = _keyword_pattern(keyword).search(text)
+    if match:
+        return _to_number(match.group(1))
+    else:
+        print('Keyword not found in text.')
+    return None
+
+def load_images(data_folder, file_prefix, im_ids, dtype = np.float32, entry = 'entry1', detector = 'APD'):
+    '''
+    Load the images of many scans (<data_folder>/<file_prefix>_<im_id>.hdf5) into one stack.
+    Every image is read directly into its slot of the stack, converted to dtype.
+    The files are read one after the other: h5py holds a global lock during
+    reads, so threads would not read concurrently.
+    INPUT:
+        data_folder: folder of the scans
+        file_prefix: e.g. 'Sample_Image_2024-04-18'
+        im_ids: list of scan numbers
+        dtype: dtype of the stack (default is float32)
+        entry, detector: see maxscan.MaxymusScan (default is 'entry1', 'APD')
+    OUTPUT:
+        np.array [scan, y, x]
+    '''
+    # h5py (through maxscan) is only imported here, so import_bbx() workers start quickly
+    from maxscan import MaxymusScan
+
+    scans = [MaxymusScan.from_id(data_folder, file_prefix, im_id, entry = entry, detector = detector) for im_id in im_ids]
+    missing = [scan.fname for scan in scans if not scan.exists]
+    if missing:
+        raise FileNotFoundError('Scans do not exist: %s' % ', '.join(missing))
+    with scans[0] as scan:
+        shape = scan.shape
+    stack = np.empty((len(scans),) + tuple(shape), dtype = dtype)
+    for i, scan in enumerate(scans):
+        with scan:
+            dataset = scan.dataset('image')
+            if dataset.shape != shape:
+                raise ValueError('%s: image shape %s differs from %s.' % (scan.fname, dataset.shape, shape))
+            dataset.read_direct(stack, dest_sel = np.s_[i])
+    return stack
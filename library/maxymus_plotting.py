@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+Display of MAXYMUS data: GIFs/movies of time resolved stacks, quicklook
+export with burnt-in scale bar and matplotlib figures. matplotlib,
+matplotlib_scalebar and imageio are imported by the functions that use them.
+
+Part of pymaxymus, which loads this module on first access of one of its
+functions:
+
+    import pymaxymus as mx
+    mx.make_gif(stack, [0, 99], folder_save, 'movie.gif', pixel_size = 25, length_fraction = 500)
+
+authors: Kathinka Gerlinger, Michael Schneider, Max Born Institute Berlin
+"""
+
+import os
+import functools
+
+import numpy as np
+
+from maxymus_processing import contrast_limits
+
+
+##################################################################################################################
+
+#                     DISPLAY DATA
+
+##################################################################################################################
+
+def _movie_figure(first, job):
+    '''
+    Build the figure used by make_gif()/make_gif_XMCD() once, frames are
+    exchanged with set_data(). Uses the Agg canvas directly (no pyplot), so
+    nothing is kept in the global figure manager.
+    '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib_scalebar.scalebar import ScaleBar
+
+    fig = Figure(frameon=False, dpi=job['dpi'])
+    FigureCanvasAgg(fig)
+    fig.set_size_inches(*job['figsize'])
+    ax = fig.add_axes([0., 0., 1., 1.])
+    ax.set_axis_off()
+    mp = ax.imshow(first, aspect='auto', cmap = job['cmap'], vmin = job['vmin'], vmax = job['vmax'])
+    scalebar = ScaleBar(job['pixel_size'], units = job['units'], location = job['location'], frameon = False, color = job['color'], fixed_value = job['length_fraction'])
+    ax.add_artist(scalebar)
+    if job['colorbar']:
+        cb = fig.colorbar(mp, ax = ax, orientation="horizontal", pad = .01, shrink = .9)
+        cb.set_label('Magnetization')
+    return fig, mp
+
+def _render_block(block, job):
+    '''
+    Render a block of frames into RGB uint8 arrays (worker of render_frames()).
+    '''
+    block = np.asarray(block) * job['factor']
+    fig, mp = _movie_figure(block[0], job)
+    images = []
+    for frame in block:
+        mp.set_data(frame)
+        fig.canvas.draw()
+        images.append(np.array(fig.canvas.buffer_rgba())[..., :3])
+    return images
+
+# below this many frames the start of a process pool costs more than it saves
+POOL_MIN_FRAMES = 32
+
+def render_frames(data, frames, job, n_workers = None, block_size = 8):
+    '''
+    Render frames[0] ... frames[1] (both included) of data and yield them in
+    order as RGB uint8 arrays. With more than one worker the frames are
+    rendered in a process pool in blocks of block_size frames; at most
+    2 * n_workers blocks are in flight, so memory stays bounded. By default the
+    pool is only used for series of at least POOL_MIN_FRAMES frames on machines
+    with more than one core, otherwise the frames render in this process.
+    INPUT:
+        data: 3d data with time as first axis (np.array, np.memmap or lazy stack)
+        frames: list of start and stop frame number
+        job: figure parameters, see make_gif()
+        n_workers: number of processes (default is None, i.e. the number of cores for long series and
+                   this process for short ones; 1 renders in this process)
+        block_size: number of frames per task (default is 8)
+    OUTPUT:
+        generator of np.arrays (height, width, 3)
+    '''
+    starts = range(frames[0], frames[1]+1, block_size)
+    blocks = ((a, min(a + block_size, frames[1]+1)) for a in starts)
+    if n_workers is None:
+        n_workers = (os.cpu_count() or 1) if frames[1] + 1 - frames[0] >= POOL_MIN_FRAMES else 1
+    if n_workers == 1:
+        for a, b in blocks:
+            for image in _render_block(data[a:b], job):
+                yield image
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    with ProcessPoolExecutor(max_workers = n_workers) as pool:
+        pending = deque()
+        max_pending = 2 * n_workers
+        for a, b in blocks:
+            pending.append(pool.submit(_render_block, np.asarray(data[a:b]), job))
+            if len(pending) >= max_pending:
+                for image in pending.popleft().result():
+                    yield image
+        while pending:
+            for image in pending.popleft().result():
+                yield image
+
+def write_movie(images, fname, duration = .5):
+    '''
+    Stream RGB frames into a GIF (or a movie if fname ends with .mp4, .avi,
+    .mov or .mkv, which needs imageio-ffmpeg) without temporary files.
+    INPUT:
+        images: iterable of np.arrays (height, width, 3)
+        fname: filename of the GIF/movie
+        duration: time each frame is shown in seconds (default is .5)
+    '''
+    import imageio
+    if os.path.splitext(fname)[1].lower() in ('.mp4', '.avi', '.mov', '.mkv'):
+        writer = imageio.get_writer(fname, fps = 1 / duration)
+    else:
+        writer = imageio.get_writer(fname, mode = 'I', duration = duration)
+    with writer:
+        for image in images:
+            writer.append_data(image)
+    return
+
+def _save_frames(images, folder_save, first, image_suffix):
+    # optionally keep every frame as *.png as make_gif() used to
+    import imageio
+    folder_tmp = folder_save + 'tmp/'
+    if not(os.path.exists(folder_tmp)):
+        print("Creating folder " + folder_tmp)
+        os.mkdir(folder_tmp)
+    for i, image in enumerate(images, first):
+        imageio.imwrite(folder_tmp + '%03d'%i + image_suffix + '.png', image)
+        yield image
+
+def make_gif(data, frames, folder_save, gif_name, pixel_size, length_fraction, color = 'k', location = 1, units = 'nm',  image_suffix = '', cmap = 'viridis', duration = .5, size = 2, n_workers = None, save_png = False, scale = (0,100)):
+    '''
+    Make a GIF out of a subset of images in the sorted data array. The frames are rendered (in parallel for long series)
+    straight into memory and streamed into the GIF, no temporary files are written.
+    INPUT:    data = data as returned by import_bbx(), sort() and normalize(); frames = list of start and stop image number; folder_save = folder where to save the images and the gif;
+              gif_name = file name of the GIF (.mp4 etc. for a movie); pixel_size = size of 1 pixel in nanometer for scale bar; image_suffix = string to be added to the image name; cmap = colormap, default is viridis;
+              duration = time each frame is shown in the gif; n_workers = number of processes, default is the number of cores (shorter series than POOL_MIN_FRAMES render in this process);
+              save_png = also save every image as *.png in folder_save/tmp, default is False;
+              scale = color limits in percentile of the frames, estimated with contrast_limits(), default is (0,100)
+    OUTPUT:   None, but the GIF of all these images is saved.
+    KG, 01.2020
+    '''
+    if not(os.path.exists(folder_save)):
+        print("Creating folder " + folder_save)
+        os.mkdir(folder_save)
+    
+    mi, ma = contrast_limits(data, scale, frames)
+    
+    job = dict(factor = 1, vmin = mi, vmax = ma, cmap = cmap, figsize = (size, size), dpi = 150, colorbar = False,
+               pixel_size = pixel_size, units = units, location = location, color = color, length_fraction = length_fraction)
+    images = render_frames(data, frames, job, n_workers)
+    if save_png:
+        images = _save_frames(images, folder_save, frames[0], image_suffix)
+    write_movie(images, folder_save + gif_name, duration)
+    return
+
+def make_gif_XMCD(data, norm, frames, folder_save, gif_name, pixel_size, length_fraction, location = 1, units = 'nm',  image_suffix = '', cmap = 'coolwarm', duration = .5, n_workers = None, save_png = False):
+    '''
+    Make a GIF out of a subset of images in the sorted data array. The frames are rendered (in parallel for long series)
+    straight into memory and streamed into the GIF, no temporary files are written.
+    INPUT:    data = data as returned by import_bbx(), sort() and normalize(); frames = list of start and stop image number; folder_save = folder where to save the images and the gif;
+              gif_name = file name of the GIF (.mp4 etc. for a movie); pixel_size = size of 1 pixel in nanometer for scale bar; image_suffix = string to be added to the image name; cmap = colormap, default is viridis;
+              duration = time each frame is shown in the gif; n_workers = number of processes, default is the number of cores (shorter series than POOL_MIN_FRAMES render in this process);
+              save_png = also save every image as *.png in folder_save/tmp, default is False
+    OUTPUT:   None, but the GIF of all these images is saved.
+    KG, 01.2020
+    '''
+    if not(os.path.exists(folder_save)):
+        print("Creating folder " + folder_save)
+        os.mkdir(folder_save)
+        
+    if norm:
+        mi, ma = contrast_limits(data, (0,100), frames)
+        lim = np.max([np.abs(mi), np.abs(ma)])
+        color = 'k'
+    else:
+        lim = np.abs(np.mean(data[:, :10, :10]))
+        color = 'w'
+    
+    job = dict(factor = 1 / lim, vmin = -1, vmax = 1, cmap = 'coolwarm', figsize = (3.2, 4), dpi = 150, colorbar = True,
+               pixel_size = pixel_size, units = units, location = location, color = color, length_fraction = length_fraction)
+    images = render_frames(data, frames, job, n_workers)
+    if save_png:
+        images = _save_frames(images, folder_save, frames[0], image_suffix)
+    write_movie(images, folder_save + gif_name, duration)
+    return
+
+_SCALEBAR_LOCATIONS = {1: ('upper', 'right'), 2: ('upper', 'left'), 3: ('lower', 'left'), 4: ('lower', 'right'),
+                       5: ('center', 'right'), 6: ('center', 'left'), 7: ('center', 'right'), 8: ('lower', 'center'),
+                       9: ('upper', 'center'), 10: ('center', 'center')}
+
+@functools.lru_cache(maxsize = 32)
+def colormap_lut(cmap, n = 256):
+    '''
+    Colormap as lookup table of n RGB uint8 colors, cached per colormap name.
+    '''
+    import matplotlib
+    lut = matplotlib.colormaps[cmap].resampled(n)(np.arange(n))[:, :3]
+    lut = np.round(lut * 255).astype(np.uint8)
+    lut.setflags(write = False)
+    return lut
+
+def apply_lut(data, vmin, vmax, lut):
+    '''
+    Map data linearly from [vmin, vmax] onto the entries of a colormap lookup
+    table (values outside are clipped, NaN gets the lowest color).
+    OUTPUT:
+        RGB uint8 np.array with shape data.shape + (3,)
+    '''
+    n = len(lut)
+    scale = n / (vmax - vmin) if vmax > vmin else 0.
+    index = np.asarray(data, dtype=np.float32) - np.float32(vmin)
+    index *= np.float32(scale)
+    index = np.nan_to_num(index, copy = False)
+    np.clip(index, 0, n - 1, out = index)
+    # np.take of whole rows is several times faster than lut[index]
+    return np.take(lut, index.astype(np.uint8 if n <= 256 else np.intp), axis = 0)
+
+def burn_scalebar(rgb, length_px, color = 'k', location = 1, thickness = None, margin = None):
+    '''
+    Draw a plain scale bar (without label) into an RGB image, in place.
+    INPUT:
+        rgb: RGB uint8 np.array (height, width, 3)
+        length_px: length of the bar in pixels
+        color: matplotlib color of the bar (default is 'k')
+        location: matplotlib legend location code as for ScaleBar (default is 1, right upper corner)
+        thickness: bar thickness in pixels (default is 1.5 % of the image height)
+        margin: distance from the image border in pixels (default is 4 % of the smaller image side)
+    OUTPUT:
+        rgb
+    '''
+    import matplotlib.colors
+    h, w = rgb.shape[:2]
+    length_px = int(round(min(length_px, w)))
+    thickness = max(1, int(round(0.015 * h))) if thickness is None else int(thickness)
+    margin = max(1, int(round(0.04 * min(h, w)))) if margin is None else int(margin)
+    vertical, horizontal = _SCALEBAR_LOCATIONS[location]
+    y0 = {'upper': margin, 'center': (h - thickness) // 2, 'lower': h - margin - thickness}[vertical]
+    x0 = {'left': margin, 'center': (w - length_px) // 2, 'right': w - margin - length_px}[horizontal]
+    y0, x0 = max(y0, 0), max(x0, 0)
+    rgb[y0:y0+thickness, x0:x0+length_px] = np.round(np.array(matplotlib.colors.to_rgb(color)) * 255).astype(np.uint8)
+    return rgb
+
+def export_image(data, destination, pixel_size, length_fraction, color = 'k', location = 1, cmap = 'gray', vmin = None, vmax = None, scale = (0,100), origin = 'upper', zoom = 1, compress_level = 1):
+    '''
+    Fast image export without matplotlib figures: the data is normalized to
+    [vmin, vmax], colored with a 256 entry colormap lookup table and a plain
+    scale bar is burned in. Written as PNG/TIFF depending on destination.
+    INPUT:
+        data: 2d image
+        destination: filename to save the image
+        pixel_size: size of one pixel (in the units of length_fraction)
+        length_fraction: length of the scale bar
+        color: color of the scale bar (default is 'k')
+        location: location of the scale bar (default is 1, right upper corner)
+        cmap: matplotlib colormap (default is 'gray')
+        vmin, vmax: precomputed color limits, e.g. shared by a series (default is None, i.e. from scale)
+        scale: percentiles used for missing vmin/vmax (default is (0,100))
+        origin: 'lower' puts the first row at the bottom as imshow does (default is 'upper')
+        zoom: integer upscaling factor of the exported image (default is 1)
+        compress_level: zlib level of PNG files, 0 (no compression, fastest, ~2.5x larger) to 9
+                        (default is 1, speed over file size for quicklooks)
+    OUTPUT:
+        RGB uint8 np.array as written
+    '''
+    data = np.asarray(data)
+    if vmin is None or vmax is None:
+        mi, ma = contrast_limits(data, scale, cache = False)
+        vmin = mi if vmin is None else vmin
+        vmax = ma if vmax is None else vmax
+    if origin == 'lower':
+        data = data[::-1]
+    rgb = apply_lut(data, vmin, vmax, colormap_lut(cmap))
+    if zoom > 1:
+        rgb = np.repeat(np.repeat(rgb, zoom, axis = 0), zoom, axis = 1)
+    burn_scalebar(rgb, length_fraction / pixel_size * zoom, color, location)
+    import imageio
+    if os.path.splitext(destination)[1].lower() == '.png':
+        imageio.imwrite(destination, rgb, compress_level = compress_level)
+    else:
+        imageio.imwrite(destination, rgb)
+    return rgb
+
+def plot_xmcd(data, destination, pixel_size, length_fraction, color, location = 1, units = 'nm', cmap = 'coolwarm', save = True, fast = False, close = None, compress_level = 1):
+    '''
+    Plot XMCD image recorded at the MAXYMUS microscope at BESSY.
+    INPUT:
+        data: XMCD data set
+        destination: filename where to save the image
+        pixel_size: size of one pixel in nm (otherwise change units)
+        length_fraction: length of the scale bar
+        color: color of the scale bar ('w' for white and 'k' for black)
+        location: location of the scale bar (default is 1, right upper corner)
+        units: unit of the pixel_size (default is 'nm')
+        cmap: matplotlib colormap (default is 'coolwarm')
+        save: boolean variable if you want to save the image at destination (default is True)
+        fast: write the image with export_image() instead of matplotlib, without colorbar
+              and scale bar label (default is False)
+        close: close the figure after saving, so exporting many images does not keep one open
+               pyplot figure per image; False keeps it, e.g. to show it in a notebook (default is None,
+               i.e. close if save)
+        compress_level: zlib level of PNG files written with fast=True, 0 is the fastest (default is 1)
+    OUTPUT:
+        no output, plots the image
+    KG 01.2020
+    '''
+    mi = np.min(data)
+    ma = np.max(data)
+    lim = np.max([np.abs(mi), np.abs(ma)])
+    
+    if fast:
+        if save:
+            export_image(data, destination, pixel_size, length_fraction, color, location, cmap = cmap, vmin = -lim, vmax = lim, compress_level = compress_level)
+        return
+    
+    #plot the image and save it as .png
+    import matplotlib.pyplot as plt
+    from matplotlib_scalebar.scalebar import ScaleBar
+    fig = plt.figure(frameon=False)
+    fig.set_size_inches(3.2,4)
+    ax = plt.Axes(fig, [0., 0., 1., 1.])
+    ax.set_axis_off()
+    fig.add_axes(ax)
+    mp = ax.imshow(data/lim, aspect='auto', cmap = 'coolwarm', vmin = -1, vmax = 1)
+    scalebar = ScaleBar(pixel_size, units = units, location = location, frameon = False, color = color, fixed_value = length_fraction)
+    plt.gca().add_artist(scalebar)
+    cb = plt.colorbar(mp, orientation="horizontal", pad = .01, shrink = .9)
+    cb.set_label('Magnetization')
+    if save:
+        plt.savefig(destination, dpi=150)
+    if save if close is None else close:
+        plt.close(fig)
+    return
+
+def plot(data, destination, pixel_size, length_fraction, color, location = 1, units = 'nm', cmap = 'gray', size = (2,2), save = True, scale = (0,100), fast = False, close = None, compress_level = 1):
+    '''
+    Plot single image recorded at the MAXYMUS microscope at BESSY.
+    INPUT:
+        data: data set
+        destination: filename where to save the image
+        pixel_size: size of one pixel in nm (otherwise change units)
+        length_fraction: length of the scale bar
+        color: color of the scale bar ('w' for white and 'k' for black)
+        location: location of the scale bar (default is 1, right upper corner)
+        units: unit of the pixel_size (default is 'nm')
+        cmap: matplotlib colormap (default is 'gray')
+        save: boolean variable if you want to save the image at destination (default is True)
+        scale: scale of the image in percentile (default is (0,100))
+        fast: write the image with export_image() instead of matplotlib, at the native
+              resolution, without scale bar label and with the percentiles of scale estimated
+              from a subsample; TIFF is the fastest format (default is False)
+        close: close the figure after saving, so exporting many images does not keep one open
+               pyplot figure per image; False keeps it, e.g. to show it in a notebook (default is None,
+               i.e. close if save)
+        compress_level: zlib level of PNG files written with fast=True, 0 is the fastest (default is 1)
+    OUTPUT:
+        no output, plots the image
+    KG 01.2020
+    '''
+    if fast:
+        if save:
+            # quicklook: percentiles of a strided subsample of at most 2**16 values
+            mi, ma = contrast_limits(data, scale, method = 'subsample', max_samples = 2**16)
+            export_image(data, destination, pixel_size, length_fraction, color, location, cmap = cmap, vmin = mi, vmax = ma, origin = 'lower', compress_level = compress_level)
+        return
+    
+    mi, ma = contrast_limits(data, scale, cache = False)
+    #plot the image and save it as .png
+    import matplotlib.pyplot as plt
+    from matplotlib_scalebar.scalebar import ScaleBar
+    fig = plt.figure(frameon=False)
+    fig.set_size_inches(size[0], size[1])
+    ax = plt.Axes(fig, [0., 0., 1., 1.])
+    ax.set_axis_off()
+    fig.add_axes(ax)
+    ax.imshow(data, aspect='auto', cmap = cmap, vmin = mi, vmax = ma, origin = 'lower')
+    scalebar = ScaleBar(pixel_size, units = units, frameon = False, color = color, fixed_value = length_fraction, location = location) 
+    plt.gca().add_artist(scalebar)
+    if save:
+        plt.savefig(destination, dpi=150)
+    if save if close is None else close:
+        plt.close(fig)
+    return
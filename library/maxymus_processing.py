@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+"""
+Processing of MAXYMUS data: time sorting and normalization of time resolved
+stacks, spectral maps, XMCD contrast of helicity pairs and contrast limits.
+Needs numpy only (scipy for spectral_maps() and the registration of
+xmcd_series(), imported when called), so process pool workers start quickly.
+
+Part of pymaxymus, which re-exports everything:
+
+    from maxymus_processing import sort_time, normalize
+    stack = normalize(sort_time(import_bbx(fname, lazy = True), 20, lazy = True), XMCD = True)
+
+authors: Kathinka Gerlinger, Michael Schneider, Max Born Institute Berlin
+"""
+
+import math
+import weakref
+import operator
+import functools
+
+import numpy as np
+
+from maxymus_io import load_images
+
+
+##################################################################################################################
+
+#                     TIME RESOLVED DATA SORTING AND NORMALIZING
+
+##################################################################################################################
+
+def time_order(n_frames, magic_number):
+    '''
+    Frame order used by sort_time(), i.e. sorted[k] = data[order[k]]. For
+    coprime n_frames and magic_number it is computed in closed form as
+    order[k] = k * magic_number^-1 mod n_frames, otherwise by a stable argsort.
+    Results are cached per (n_frames, magic_number) and returned read-only.
+    INPUT:
+        n_frames: number of frames in the stack
+        magic_number: is the magic number of the time resolution (python or numpy integer)
+    OUTPUT:
+        np.array of frame indices
+    '''
+    # numpy integers (e.g. read from headers) would break pow() and the cache key
+    return _time_order(operator.index(n_frames), operator.index(magic_number))
+
+@functools.lru_cache(maxsize = 64)
+def _time_order(n_frames, magic_number):
+    t_index = np.arange(n_frames, dtype=int)
+    if math.gcd(magic_number, n_frames) == 1:
+        order = (t_index * pow(magic_number, -1, n_frames)) % n_frames
+    else:
+        order = np.argsort((t_index * magic_number) % n_frames, kind = 'stable')
+    order.setflags(write = False)
+    return order
+
+class SortedStack(object):
+    '''
+    Time sorted view on a stack as returned by sort_time(..., lazy = True).
+    Indexing the first axis is mapped through the frame order, so only the
+    requested frames are pulled from the underlying array, np.memmap or BBXStack.
+    INPUT:
+        data: unsorted stack with time as first axis
+        order: frame order as returned by time_order()
+    '''
+    def __init__(self, data, order):
+        self.data = data
+        self.order = order
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def ndim(self):
+        return len(self.data.shape)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def size(self):
+        return self.data.size
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) == 0 or key[0] is Ellipsis:
+            key = (np.s_[:],) + key
+        return self.data[(self.order[key[0]],) + key[1:]]
+
+    def __array__(self, dtype = None, copy = None):
+        out = np.asarray(self[:])
+        if dtype is not None:
+            out = out.astype(dtype, copy = False)
+        return out
+
+def _permute_inplace(data, order):
+    '''
+    Apply data[:] = data[order] following the permutation cycles, so that only
+    a single frame is held as temporary copy.
+    '''
+    done = np.zeros(len(order), dtype=bool)
+    for start in range(len(order)):
+        if done[start] or order[start] == start:
+            continue
+        tmp = data[start].copy()
+        j = start
+        while True:
+            done[j] = True
+            src = order[j]
+            if src == start:
+                data[j] = tmp
+                break
+            data[j] = data[src]
+            j = src
+    return data
+
+def sort_time(data, magic_number, lazy = False, inplace = False):
+    '''
+    Sort the data returned by import_bbx(). Due to the measurement scheme,
+    the difference between pump and probe is not sorted in the timeline.
+    We need to sort it manually, using the so called magic number as a
+    reference. The frame order for magic_number=20 is [0, 20, 40, ..., 1980,
+    2000, 19, 39, 59, ...]
+    INPUT:
+        data: unsorted np.array (or BBXStack) as returned by import_bbx()
+        magic_number: is the magic number of the time resolution
+        lazy: if True, return a SortedStack that pulls sorted frames on demand (default is False)
+        inplace: if True, permute the np.array in place instead of copying it (default is False)
+    OUTPUT:
+        sorted np.array (or SortedStack if lazy)
+    KG, MS 01.2020
+    '''
+    order = time_order(data.shape[0], magic_number)
+    if lazy:
+        return SortedStack(data, order)
+    if inplace:
+        if not isinstance(data, np.ndarray):
+            raise TypeError('Sorting in place requires a np.array, got %s.' % type(data).__name__)
+        clear_contrast_cache(data)
+        return _permute_inplace(data, order)
+    return data[order]
+
+def _time_chunks(n_frames, tlim, chunk_size):
+    '''
+    Split the frames selected by tlim into blocks of at most chunk_size frames.
+    Yields slices for increasing ranges and index arrays otherwise.
+    '''
+    frames = range(n_frames)[tlim]
+    for i in range(0, len(frames), chunk_size):
+        block = frames[i:i+chunk_size]
+        if block.step > 0:
+            yield np.s_[block.start:block.stop:block.step]
+        else:
+            yield np.array(block)
+
+def time_mean(data, tlim = np.s_[:], xlim = np.s_[:], ylim = np.s_[:], chunk_size = 64):
+    '''
+    Mean over the time axis of data[tlim, xlim, ylim], accumulated in a single
+    pass over blocks of chunk_size frames. Works on np.memmap, BBXStack and
+    SortedStack without loading the full stack.
+    INPUT:
+        data: 3d image data with time as first axis
+        tlim, xlim, ylim: slices selecting the frames and pixels to average
+        chunk_size: number of frames read at once (default is 64)
+    OUTPUT:
+        np.array, float64 for integer data, otherwise the dtype of data
+    '''
+    total = None
+    count = 0
+    for t in _time_chunks(data.shape[0], tlim, chunk_size):
+        block = np.asarray(data[t])[:, xlim, ylim]
+        if total is None:
+            total = np.zeros(block.shape[1:], dtype = np.float64)
+        total += block.sum(axis = 0, dtype = np.float64)
+        count += block.shape[0]
+    if total is None:
+        raise ValueError('tlim does not select any frame.')
+    mean = total / count
+    if np.issubdtype(data.dtype, np.inexact):
+        mean = mean.astype(data.dtype)
+    return mean
+
+def normalize(data, XMCD, tlim = np.s_[:], xlim = np.s_[:], ylim = np.s_[:], axis = 0, out = None, dtype = None, chunk_size = 64):
+    '''
+    Normalize each data point over time (i.e. every pixel is divided by the
+    mean of that pixel over time, or the mean is subtracted if XMCD is False).
+    For axis = 0 the stack is processed in blocks of chunk_size frames, so peak
+    memory stays close to the size of the output.
+    INPUT:
+        data: 3d image data with time as first axis (np.array, np.memmap, BBXStack or SortedStack)
+        XMCD: divide by the mean if True, subtract it otherwise
+        tlim, xlim, ylim: slices selecting the frames and pixels used to calculate the mean
+        axis: axis along which the mean is calculated (default is 0, i.e. time)
+        out: float array to write the result into, may be data itself for in-place
+             normalization of float data (integer stacks from import_bbx() need a separate out)
+        dtype: float dtype of the result if out is not given, e.g. np.float32 (default is float64 for integer data)
+        chunk_size: number of frames processed at once (default is 64)
+    OUTPUT:
+        normalized np.array
+    KG, MS 01.2020
+    '''
+    # an integer result would truncate the mean (subtract) or fail to cast (divide)
+    if out is not None and not np.issubdtype(out.dtype, np.floating):
+        raise TypeError('out must be a float array, got %s.' % out.dtype)
+    if dtype is not None and not np.issubdtype(dtype, np.floating):
+        raise TypeError('dtype must be a float dtype, got %s.' % np.dtype(dtype))
+    if out is not None:
+        clear_contrast_cache(out)     # e.g. out = data, cached limits of the old values
+    op = np.divide if XMCD else np.subtract
+    if axis != 0:
+        data = np.asarray(data)
+        mean = np.mean(data[tlim,xlim, ylim], axis=axis, keepdims=True)
+        if out is None:
+            out = np.empty(data.shape, dtype = dtype or np.result_type(data.dtype, mean.dtype))
+        return op(data, mean, out = out)
+
+    mean = time_mean(data, tlim, xlim, ylim, chunk_size)
+    if out is None:
+        if dtype is None:
+            dtype = np.result_type(data.dtype, mean.dtype)
+        out = np.empty(data.shape, dtype = dtype)
+    mean = mean.astype(out.dtype, copy = False)
+    for t in _time_chunks(data.shape[0], np.s_[:], chunk_size):
+        op(np.asarray(data[t]), mean, out = out[t])
+    return out
+
+def spectral_maps(data, frequencies, dt = 1., tlim = np.s_[:], window = None, max_bytes = 256 * 2**20, workers = None):
+    '''
+    Amplitude and phase of the time signal of every pixel at the chosen
+    frequencies. A real FFT (scipy.fft.rfft) runs along the time axis for
+    blocks of image rows, so memory stays below about max_bytes also for
+    np.memmap, BBXStack and SortedStack input.
+    INPUT:
+        data: 3d data with time as first axis, e.g. as returned by normalize()
+        frequencies: frequencies of interest in units of 1/dt, each is mapped to the nearest FFT bin
+        dt: time between two frames (default is 1, i.e. frequencies in cycles per frame)
+        tlim: slice selecting the frames (default is all frames)
+        window: None or 'hann', window applied along time before the FFT (default is None)
+        max_bytes: memory budget of one block of rows (default is 256 MB)
+        workers: number of threads of scipy.fft (default is None, i.e. 1; -1 for all cores)
+    OUTPUT:
+        amplitude: float32 np.array [frequency, y, x], amplitude of the oscillation (2 |X| / n,
+                   |X| / n for the zero and Nyquist frequency)
+        phase: float32 np.array [frequency, y, x] in rad
+        freqs: the frequencies of the FFT bins used
+    '''
+    import scipy.fft
+
+    frames = range(data.shape[0])[tlim]
+    n_t, n_y, n_x = len(frames), data.shape[1], data.shape[2]
+    if n_t < 2:
+        raise ValueError('tlim must select at least two frames.')
+    t = np.s_[frames.start:frames.stop:frames.step] if frames.step > 0 else np.array(frames)
+    all_freqs = scipy.fft.rfftfreq(n_t, dt)
+    bins = np.array([np.argmin(np.abs(all_freqs - f)) for f in np.atleast_1d(frequencies)])
+    scale = np.where((bins == 0) | ((n_t % 2 == 0) & (bins == n_t // 2)), 1., 2.) / n_t
+
+    if window is None:
+        taper = None
+    elif window == 'hann':
+        taper = np.hanning(n_t).astype(np.float32)
+        scale = scale * n_t / taper.sum()    # keep the amplitude of a sine on a bin
+        taper = taper[:, None, None]
+    else:
+        raise ValueError("window must be None or 'hann', got %r." % window)
+
+    amplitude = np.empty((len(bins), n_y, n_x), dtype = np.float32)
+    phase = np.empty((len(bins), n_y, n_x), dtype = np.float32)
+    # float32 block plus its complex64 spectrum
+    rows = int(max(1, min(n_y, max_bytes // (n_t * n_x * 8 + 1))))
+    for r in range(0, n_y, rows):
+        block = np.asarray(data[t, r:r+rows], dtype = np.float32)
+        if taper is not None:
+            block = block * taper
+        spectrum = scipy.fft.rfft(block, axis = 0, workers = workers)[bins]
+        np.abs(spectrum, out = amplitude[:, r:r+rows])
+        amplitude[:, r:r+rows] *= scale[:, None, None].astype(np.float32)
+        np.arctan2(spectrum.imag, spectrum.real, out = phase[:, r:r+rows])
+    return amplitude, phase, all_freqs[bins]
+
+##################################################################################################################
+
+#                     XMCD SERIES
+
+##################################################################################################################
+
+def xmcd_contrast(pos, neg, out = None, topo_out = None):
+    '''
+    XMCD contrast log(pos / neg) and topography pos + neg of single images or
+    whole stacks, computed with out= buffers and without temporaries.
+    INPUT:
+        pos, neg: positive and negative helicity images (neg can be a single image for a stack pos)
+        out: array for the XMCD contrast, may be pos itself (default is None, i.e. a new array)
+        topo_out: array for the topography (default is None, i.e. a new array)
+    OUTPUT:
+        xmcd, topo
+    '''
+    dtype = np.result_type(pos, neg, np.float32)
+    shape = np.broadcast_shapes(np.shape(pos), np.shape(neg))
+    if topo_out is None:
+        topo_out = np.empty(shape, dtype = dtype)
+    if out is None:
+        out = np.empty(shape, dtype = dtype)
+    np.add(pos, neg, out = topo_out)    # before out, which may overwrite pos
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        np.divide(pos, neg, out = out)
+        np.log(out, out = out)
+    return out, topo_out
+
+def xmcd_series(data_folder, file_prefix, pos_ids, neg_ids, align = False, roi = None, upsample_factor = 100, workers = None, entry = 'entry1', detector = 'APD'):
+    '''
+    XMCD contrast and topography for a whole series of helicity pairs, in float32.
+    INPUT:
+        data_folder: folder of the scans
+        file_prefix: e.g. 'Sample_Image_2024-04-18'
+        pos_ids: list of positive helicity scan numbers
+        neg_ids: list of negative helicity scan numbers of the same length, or a single
+                 scan number used for all positive images
+        align: register all images with registration.py and shift them onto the first
+               positive image (onto the negative image if there is only one) (default is False)
+        roi: region of interest [x0, x1, y0, y1] used for the alignment (default is None, i.e. full image)
+        upsample_factor: alignment precision is 1/upsample_factor pixel (default is 100)
+        workers: number of threads of scipy.fft for the alignment (default is None)
+        entry, detector: see maxscan.MaxymusScan (default is 'entry1', 'APD')
+    OUTPUT:
+        xmcd: np.array [pair, y, x], ready for make_gif_XMCD()
+        topo: np.array [pair, y, x]
+        drift: shifts (dy, dx) applied to the positive and negative images as np.array (2, n, 2), None without align
+    '''
+    pos_ids = list(np.atleast_1d(pos_ids))
+    neg_ids = list(np.atleast_1d(neg_ids))
+    if len(neg_ids) not in (1, len(pos_ids)):
+        raise ValueError('Expected one negative helicity scan or one per positive scan, got %d for %d.' % (len(neg_ids), len(pos_ids)))
+    pos = load_images(data_folder, file_prefix, pos_ids, entry = entry, detector = detector)
+    neg = load_images(data_folder, file_prefix, neg_ids, entry = entry, detector = detector)
+    if neg.shape[1:] != pos.shape[1:]:
+        raise ValueError('Positive and negative helicity images differ in shape: %s, %s.' % (pos.shape[1:], neg.shape[1:]))
+
+    drift = None
+    if align:
+        import registration
+        reference = pos[0].copy() if len(neg) > 1 else neg[0].copy()
+        drift = []
+        for stack in (pos, neg):
+            shifts = registration.register_stack(stack, reference, roi, upsample_factor, workers = workers)
+            registration.apply_shifts(stack, shifts, out = stack, workers = workers)
+            drift.append(shifts)
+        drift = np.array([drift[0], np.broadcast_to(drift[1], drift[0].shape)])
+
+    if len(neg) == 1:
+        neg = neg[0]
+    xmcd, topo = xmcd_contrast(pos, neg, out = pos, topo_out = None)
+    return xmcd, topo, drift
+
+##################################################################################################################
+
+#                     CONTRAST LIMITS
+
+##################################################################################################################
+
+_contrast_cache = {}
+
+def _contrast_entry(data):
+    # results per dataset, keyed by id(data) and dropped when data is garbage collected;
+    # objects that do not support weak references are not cached
+    key = id(data)
+    if key not in _contrast_cache:
+        try:
+            weakref.finalize(data, _contrast_cache.pop, key, None)
+        except TypeError:
+            return None
+        _contrast_cache[key] = {}
+    return _contrast_cache[key]
+
+def clear_contrast_cache(data = None):
+    '''
+    Forget the cached contrast_limits() of data (of all datasets if None),
+    needed after data was modified in place.
+    '''
+    if data is None:
+        _contrast_cache.clear()
+    else:
+        _contrast_cache.pop(id(data), None)
+
+def _blocks(data, frames = None, chunk_size = 64, step = 1, stride = 1):
+    '''
+    Yield the selected data in blocks of at most chunk_size frames, every
+    step-th frame and every stride-th pixel. 2d images are a single block.
+    '''
+    if data.ndim < 3:
+        yield np.asarray(data)[(np.s_[::stride],) * data.ndim]
+        return
+    tlim = np.s_[::step] if frames is None else np.s_[frames[0]:frames[1]+1:step]
+    for t in _time_chunks(data.shape[0], tlim, chunk_size):
+        yield np.asarray(data[t])[:, ::stride, ::stride]
+
+def _finite(block):
+    if np.issubdtype(block.dtype, np.inexact):
+        return block[~np.isnan(block)]
+    return block.ravel()
+
+def _min_max(data, frames, chunk_size):
+    lo, hi = np.inf, -np.inf
+    for block in _blocks(data, frames, chunk_size):
+        block = _finite(block)
+        if block.size:
+            lo, hi = min(lo, block.min()), max(hi, block.max())
+    if lo > hi:
+        return np.nan, np.nan
+    return float(lo), float(hi)
+
+def _histogram_percentiles(data, frames, percentiles, lo, hi, bins, chunk_size):
+    # counts in bins over [lo, hi], percentiles interpolated linearly inside the bin
+    counts = np.zeros(bins, dtype = np.int64)
+    width = (hi - lo) / bins
+    for block in _blocks(data, frames, chunk_size):
+        index = (_finite(block) - lo) / width
+        np.clip(index, 0, bins - 1, out = index)
+        counts += np.bincount(index.astype(np.intp), minlength = bins)
+    cumulative = np.cumsum(counts)
+    values = []
+    for p in percentiles:
+        rank = p / 100 * (cumulative[-1] - 1)
+        b = int(np.searchsorted(cumulative, rank, side = 'right'))
+        before = cumulative[b - 1] if b else 0
+        values.append(lo + width * (b + (rank - before + .5) / counts[b]))
+    return values
+
+def contrast_limits(data, scale = (0,100), frames = None, method = 'auto', max_samples = 2**20, bins = 4096, chunk_size = 64, cache = False):
+    '''
+    Color limits of an image or a stack at the percentiles in scale, NaNs are
+    ignored. Large stacks are never sorted or copied as a whole: percentiles 0
+    and 100 are the exact min/max computed block by block, other percentiles
+    are estimated depending on method. With cache=True the results are kept
+    per dataset, so rendering the same stack again does not rescan it.
+    INPUT:
+        data: 2d image or 3d stack with time as first axis (np.array, np.memmap or lazy stack)
+        scale: percentiles of the limits (default is (0,100), i.e. min and max)
+        frames: list of start and stop frame number (both included), None for all frames
+        method: 'exact' uses np.nanpercentile of the full selection,
+                'subsample' of a strided subsample of at most max_samples values (every n-th frame and pixel),
+                'histogram' reads the selection twice in blocks and interpolates in a histogram of bins bins
+                (error below (max-min)/bins, memory independent of the size of the stack),
+                'auto' is 'exact' up to max_samples values and 'subsample' above (default)
+        max_samples: maximum number of values used by 'subsample' (default is 2**20)
+        bins: number of histogram bins for 'histogram' (default is 4096)
+        chunk_size: number of frames read at once (default is 64)
+        cache: use and store cached results, keyed by the identity of data; sort_time(inplace=True)
+               and normalize(out=data) clear them, after other in-place changes call
+               clear_contrast_cache(data) (default is False)
+    OUTPUT:
+        tuple of floats, one per entry of scale
+    '''
+    scale = tuple(float(p) for p in np.atleast_1d(scale))
+    frames = None if frames is None or data.ndim < 3 else (int(frames[0]), int(frames[1]))
+    if method not in ('auto', 'exact', 'subsample', 'histogram'):
+        raise ValueError("method must be 'auto', 'exact', 'subsample' or 'histogram', got %r." % method)
+    shape = list(data.shape)
+    if frames is not None:
+        shape[0] = len(range(shape[0])[frames[0]:frames[1]+1])
+    size = int(np.prod(shape))
+    if size == 0:
+        raise ValueError('The selection does not contain any value.')
+    if method == 'auto':
+        method = 'exact' if size <= max_samples else 'subsample'
+
+    entry = _contrast_entry(data) if cache else None
+    key = (scale, frames, method, max_samples if method == 'subsample' else None, bins if method == 'histogram' else None)
+    if entry is not None and key in entry:
+        return entry[key]
+
+    inner = [p for p in scale if 0 < p < 100]
+    if len(inner) < len(scale) or method == 'histogram':
+        minmax = entry.get((frames, 'minmax')) if entry is not None else None
+        if minmax is None:
+            minmax = _min_max(data, frames, chunk_size)
+            if entry is not None:
+                entry[(frames, 'minmax')] = minmax
+    if not inner:
+        estimates = []
+    elif method == 'exact':
+        estimates = np.nanpercentile(np.concatenate([b.ravel() for b in _blocks(data, frames, chunk_size)]), inner)
+    elif method == 'subsample':
+        factor = size / max_samples
+        step = 1
+        if len(shape) == 3:
+            step = max(1, min(math.ceil(factor), shape[0] // 16))   # keep at least 16 frames
+            factor /= step
+        stride = max(1, math.ceil(math.sqrt(factor)))
+        sample = np.concatenate([b.ravel() for b in _blocks(data, frames, chunk_size, step, stride)])
+        estimates = np.nanpercentile(sample, inner)
+    elif minmax[1] > minmax[0]:
+        estimates = _histogram_percentiles(data, frames, inner, minmax[0], minmax[1], bins, chunk_size)
+    else:
+        estimates = [minmax[0]] * len(inner)
+
+    estimates = iter(estimates)
+    limits = tuple(minmax[0] if p <= 0 else minmax[1] if p >= 100 else float(next(estimates)) for p in scale)
+    if entry is not None:
+        entry[key] = limits
+    return limits
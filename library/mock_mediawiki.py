@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Local mock of the MediaWiki api.php for testing and benchmarking
+bulkupload.py without the wiki.
+
+The mock answers the requests mwclient sends for logging in and uploading:
+    query   meta=siteinfo|userinfo|tokens, prop=info|revisions
+    login   lgname/lgpassword, checked against `users` if given
+    upload  single requests and chunked uploads (stash, offset, filekey)
+    edit    replaces the text of a page
+Uploaded files are kept in mock.files (wiki name -> bytes), page texts in
+mock.pages (title -> wikitext). Uploading the same
+content under the same name again gives the error fileexists-no-change, as
+the real wiki does. To exercise the client, every request can be delayed
+(latency), request bodies are throttled to `bandwidth` bytes/s, and upload
+requests fail with HTTP 503 at random with probability failure_rate.
+
+    with MockMediaWiki(latency=0.01, failure_rate=0.1) as wiki:
+        site = mwclient.Site(wiki.host, path=wiki.path, scheme='http')
+        site.upload(open(fname, 'rb'), 'image.png', ignore=True)
+"""
+
+import time
+import json
+import random
+import hashlib
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _form(content_type, body):
+    '''
+    Fields of an urlencoded or multipart/form-data request body as dict of
+    str (bytes for file fields).
+    '''
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True)
+            fields[name] = payload if part.get_filename() else payload.decode('utf-8')
+        return fields
+    return {k: v[0] for k, v in parse_qs(body.decode('utf-8'), keep_blank_values=True).items()}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, so clients can reuse their connection
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def answer(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.handle_api({k: v[0] for k, v in parse_qs(urlparse(self.path).query, keep_blank_values=True).items()})
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if mock.bandwidth:
+            time.sleep(len(body) / mock.bandwidth)
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        params.update(_form(self.headers.get('Content-Type', ''), body))
+        self.handle_api(params)
+
+    def handle_api(self, params):
+        mock = self.server.mock
+        if mock.latency:
+            time.sleep(mock.latency)
+        if not urlparse(self.path).path.endswith('api.php'):
+            self.answer(404, {})
+            return
+        status, data = mock.process(params)
+        self.answer(status, data)
+
+
+class MockMediaWiki(object):
+    '''
+    Mock MediaWiki api.php running in a background thread.
+    INPUT:
+        host: interface to listen on (default is 'localhost')
+        port: port to listen on (default is 0, i.e. any free port)
+        path: script path as passed to mwclient.Site (default is '/sg/')
+        users: dict username -> password accepted by login (default is None, i.e. any)
+        latency: delay in seconds before every answer (default is 0)
+        bandwidth: bytes/s at which request bodies are received (default is None, i.e. unlimited)
+        failure_rate: probability that an upload request fails with HTTP 503 (default is 0)
+        seed: seed of the failures (default is 0)
+    '''
+    def __init__(self, host='localhost', port=0, path='/sg/', users=None, latency=0, bandwidth=None,
+                 failure_rate=0, seed=0):
+        self.path = path
+        self.users = users
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.files = {}
+        self.pages = {}
+        self.requests = {}
+        self.failures = 0
+        self._stash = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _Handler, bind_and_activate=False)
+        self.server.allow_reuse_address = True
+        self.server.daemon_threads = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self.server.mock = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return '%s:%d' % self.server.server_address[:2]
+
+    def process(self, params):
+        '''
+        Handle one api.php request, returns the HTTP status and the json answer.
+        '''
+        action = params.get('action')
+        with self._lock:
+            self.requests[action] = self.requests.get(action, 0) + 1
+            if action == 'upload' and self.failure_rate and self._random.random() < self.failure_rate:
+                self.failures += 1
+                return 503, {}
+        if action == 'query':
+            return 200, self.query(params)
+        if action == 'login':
+            return 200, self.login(params)
+        if action == 'upload':
+            return 200, self.upload(params)
+        if action == 'edit':
+            return 200, self.edit(params)
+        return 200, dict(error=dict(code='unknown_action', info='Unrecognized value for parameter "action": %s.' % action))
+
+    def query(self, params):
+        meta = params.get('meta', '').split('|')
+        query = {}
+        if 'siteinfo' in meta:
+            query['general'] = dict(generator='MediaWiki 1.39.0', sitename='MockWiki', mainpage='Main Page')
+            query['namespaces'] = {'0': dict(id=0, **{'*': ''}), '6': dict(id=6, **{'*': 'File'})}
+        if 'userinfo' in meta:
+            query['userinfo'] = dict(id=1, name='MockUser', groups=['user'], rights=['read', 'edit', 'upload', 'reupload'])
+        if 'tokens' in meta:
+            query['tokens'] = {'%stoken' % t: 'mocktoken+\\' for t in params.get('type', 'csrf').split('|')}
+        prop = params.get('prop', '').split('|')
+        if 'info' in prop or 'revisions' in prop:
+            query['pages'] = {}
+            for i, title in enumerate(params.get('titles', '').split('|'), 1):
+                page = dict(ns=6 if title.startswith('File:') else 0, title=title)
+                with self._lock:
+                    text = self.pages.get(title)
+                if text is None:
+                    query['pages'][str(-i)] = dict(page, missing='')
+                    continue
+                page.update(pageid=i, lastrevid=i, length=len(text))
+                if 'revisions' in prop:
+                    page['revisions'] = [dict(timestamp='2024-01-01T00:00:00Z', slots=dict(main={'*': text}))]
+                query['pages'][str(i)] = page
+        return dict(batchcomplete='', query=query)
+
+    def login(self, params):
+        user, password = params.get('lgname'), params.get('lgpassword')
+        if self.users is not None and self.users.get(user) != password:
+            return dict(login=dict(result='Failed', reason='Incorrect username or password entered.'))
+        return dict(login=dict(result='Success', lguserid=1, lgusername=user))
+
+    def _store(self, name, content, ignore):
+        with self._lock:
+            old = self.files.get(name)
+            if old is not None and old == content:
+                return dict(error=dict(code='fileexists-no-change', info='The upload is an exact duplicate of the current version of [[:File:%s]].' % name))
+            if old is not None and not ignore:
+                return dict(upload=dict(result='Warning', warnings=dict(exists=name), filekey='stash'))
+            self.files[name] = content
+        return dict(upload=dict(result='Success', filename=name,
+                                imageinfo=dict(size=len(content), sha1=hashlib.sha1(content).hexdigest())))
+
+    def upload(self, params):
+        name = params.get('filename')
+        ignore = params.get('ignorewarnings') == 'true'
+        if 'chunk' in params:
+            # chunked upload: the chunks are collected under a filekey, the last one completes the stash
+            with self._lock:
+                key = params.get('filekey') or '%s.%d.stash' % (name, len(self._stash))
+                stash = self._stash.setdefault(key, bytearray())
+                if int(params.get('offset', 0)) != len(stash):
+                    return dict(error=dict(code='stashfailed', info='Chunk offset does not match the stash.'))
+                stash += params['chunk']
+                size = len(stash)
+            if size < int(params['filesize']):
+                return dict(upload=dict(result='Continue', offset=size, filekey=key))
+            return dict(upload=dict(result='Success', filekey=key))
+        if 'file' in params:
+            return self._store(name, params['file'], ignore)
+        with self._lock:
+            content = self._stash.pop(params.get('filekey'), None)
+        if content is None:
+            return dict(error=dict(code='missingparam', info='One of the parameters "filekey", "file" and "url" is required.'))
+        return self._store(name, bytes(content), ignore)
+
+    def edit(self, params):
+        with self._lock:
+            self.pages[params['title']] = params.get('text', '')
+        return dict(edit=dict(result='Success', title=params['title'], newtimestamp='2024-01-01T00:00:01Z'))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
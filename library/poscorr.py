@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Position correction of MAXYMUS images: interpolate the detector signal recorded
+at the readback positions sample_x/sample_y onto the regular setpoint grid.
+
+Methods:
+    'lines'          separable 1-D interpolation along the scan lines and then along
+                     the columns, exploits the near-raster scan order (fastest); needs
+                     a complete scan of len(setpx)*len(setpy) points, otherwise
+                     (e.g. aborted scans) griddata 'linear' is used
+    'cached'         linear interpolation on the Delaunay triangulation of the readback
+                     positions, identical to griddata 'linear'; the triangulation and the
+                     interpolation weights are cached and reused for every image (or
+                     detector channel) with the same readback positions
+    'linear', 'cubic', 'nearest'
+                     scipy.interpolate.griddata, triangulates on every call ('linear'
+                     is the default)
+
+See benchmarks/bench_poscorr.py for an accuracy and speed comparison.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from scipy.interpolate import griddata
+from scipy.spatial import Delaunay
+
+
+METHODS = ('lines', 'cached', 'linear', 'cubic', 'nearest')
+
+
+def _interp_rows(xq, xp, fp, fill_value, tolerance = 0):
+    '''
+    Row-wise np.interp: interpolate fp(xp) at xq for every row at once. xp has
+    to be increasing in each row. Queries up to tolerance outside a row's range
+    get the edge value, queries further outside get fill_value. The rows are
+    shifted apart along the x axis so that a single np.interp call handles the
+    whole array.
+    '''
+    n = xp.shape[0]
+    lo = min(xp.min(), xq.min())
+    span = max(xp.max(), xq.max()) - lo + 1
+    offset = (np.arange(n) * span)[:, None] - lo
+    out = np.interp((xq + offset).ravel(), (xp + offset).ravel(), fp.ravel()).reshape(xq.shape)
+    outside = (xq < xp[:, :1] - tolerance) | (xq > xp[:, -1:] + tolerance)
+    out[outside] = fill_value
+    return out
+
+
+def _sort_rows(xp, *fp):
+    '''
+    Sort every row of xp (e.g. for serpentine scans) and apply the same order to fp.
+    '''
+    if np.all(np.diff(xp, axis=1) > 0):
+        return (xp,) + fp
+    order = np.argsort(xp, axis=1, kind='stable')
+    return tuple(np.take_along_axis(a, order, axis=1) for a in (xp,) + fp)
+
+
+def correct_lines(X, Y, Xq, Yq, data, fill_value = 0):
+    '''
+    Position correction by separable 1-D interpolation. Every scan line is
+    first interpolated onto the setpoint x positions (signal and readback y),
+    then every column is interpolated onto the setpoint y positions. Grid
+    points up to half a step outside the scanned area take the edge value.
+    INPUT:
+        X, Y: setpoint grid as returned by np.meshgrid, shape (ny, nx)
+        Xq, Yq: readback positions in scan order, nx*ny values
+        data: detector signal at the readback positions
+        fill_value: value for grid points outside the scanned area (default is 0)
+    OUTPUT:
+        np.array of shape (ny, nx)
+    '''
+    ny, nx = X.shape
+    tol_x = 0.5 * np.median(np.abs(np.diff(X[0]))) if nx > 1 else 0
+    tol_y = 0.5 * np.median(np.abs(np.diff(Y[:, 0]))) if ny > 1 else 0
+    xr, yr, vr = _sort_rows(np.reshape(Xq, (ny, nx)), np.reshape(Yq, (ny, nx)), np.reshape(data, (ny, nx)).astype(float))
+    v_rows = _interp_rows(X, xr, vr, np.nan, tol_x)
+    y_rows = _interp_rows(X, xr, yr, np.nan, tol_x)
+
+    # second pass along y; the few edge columns that are not covered by every
+    # scan line are interpolated one by one from the lines that do cover them
+    valid = ~np.isnan(y_rows).any(axis=0)
+    out = np.full((nx, ny), fill_value, dtype=float)
+    if valid.any():
+        yc, vc = _sort_rows(y_rows.T[valid], v_rows.T[valid])
+        out[valid] = _interp_rows(Y.T[valid], yc, vc, fill_value, tol_y)
+    for j in np.flatnonzero(~valid):
+        covered = ~np.isnan(y_rows[:, j])
+        if covered.sum() < 2:
+            continue
+        yj, vj = _sort_rows(y_rows[covered, j][None], v_rows[covered, j][None])
+        out[j] = _interp_rows(Y[None, :, j], yj, vj, fill_value, tol_y)[0]
+    return out.T
+
+
+class TriangulationCache(object):
+    '''
+    LRU cache of barycentric interpolation weights of the setpoint grid in the
+    Delaunay triangulation of the readback positions. Images sharing readback
+    positions (e.g. the detector channels of one file) triangulate only once.
+    INPUT:
+        maxsize: number of triangulations kept (default is 8)
+    '''
+    def __init__(self, maxsize = 8):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def weights(self, X, Y, Xq, Yq):
+        '''
+        OUTPUT:
+            (vertices, barycentric weights, mask of grid points outside the hull)
+        '''
+        h = hashlib.sha1()
+        for a in (X, Y, Xq, Yq):
+            h.update(np.ascontiguousarray(a, dtype=float).tobytes())
+        key = h.hexdigest()
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        tri = Delaunay(np.column_stack((np.ravel(Xq), np.ravel(Yq))))
+        grid = np.column_stack((np.ravel(X), np.ravel(Y)))
+        simplex = tri.find_simplex(grid)
+        outside = simplex < 0
+        T = tri.transform[simplex]
+        b = np.einsum('nij,nj->ni', T[:, :2, :], grid - T[:, 2, :])
+        bary = np.column_stack((b, 1 - b.sum(axis=1)))
+        vertices = tri.simplices[simplex]
+        bary[outside] = 0
+        self._cache[key] = (vertices, bary, outside)
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return self._cache[key]
+
+    def interpolate(self, X, Y, Xq, Yq, data, fill_value = 0):
+        vertices, bary, outside = self.weights(X, Y, Xq, Yq)
+        out = np.einsum('ni,ni->n', np.ravel(data)[vertices], bary)
+        out[outside] = fill_value
+        return out.reshape(X.shape)
+
+
+_triangulations = TriangulationCache()
+
+
+def correct_positions(setpx, setpy, readx, ready, data, method = 'linear', fill_value = 0):
+    '''
+    Interpolate the detector signal recorded at the readback positions onto the
+    setpoint grid. Both are centered on their mean as in loadSingleImage.py.
+    INPUT:
+        setpx, setpy: setpoint positions (/entry1/<detector>/sample_x, sample_y)
+        readx, ready: readback positions (/entry1/instrument/sample_x/data, sample_y/data)
+        data: detector signal at the readback positions (/entry1/instrument/<detector>/data)
+        method: 'linear', 'cubic', 'nearest', 'cached' or 'lines', see module docstring (default is 'linear')
+        fill_value: value for grid points outside the scanned area (default is 0)
+    OUTPUT:
+        position corrected np.array of shape (len(setpy), len(setpx))
+    '''
+    X, Y = np.meshgrid(setpx, setpy)
+    Xq = readx-np.mean(readx)
+    Yq = ready-np.mean(ready)
+    X = X-np.mean(X)
+    Y = Y-np.mean(Y)
+
+    if method == 'lines' and np.size(Xq) != X.size:
+        method = 'linear'     # incomplete scan, the readbacks cannot be reshaped onto the scan lines
+    if method == 'lines':
+        return correct_lines(X, Y, Xq, Yq, data, fill_value)
+    if method == 'cached':
+        return _triangulations.interpolate(X, Y, Xq, Yq, data, fill_value)
+    if method in ('linear', 'cubic', 'nearest'):
+        return griddata((Xq, Yq), data, (X, Y), method=method, fill_value=fill_value)
+    raise ValueError('Unknown position correction method %r, use one of %s.' % (method, ', '.join(METHODS)))
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution cache of a [time, y, x] stack for interactive viewing.
+Binned versions of the stack (2x2, 4x4, 8x8 mean) are built block by block on
+first use and kept in memory (LRU with a byte budget) or on disk (.npy
+memmaps), so scrubbing through thousands of frames only touches small
+arrays. Per-frame contrast limits are computed once from the coarsest level,
+the common limits of the stack from a strided subsample of the data.
+
+    pyr = StackPyramid(stack, cache_dir = folder_save + 'pyramid', name = 'bbx_353')
+    viewer = PyramidViewer(pyr)            # matplotlib figure
+    viewer.show(1000)                      # e.g. from an ipywidgets slider
+
+    image = pyr.frame(1000, display_shape = (400, 400))   # level that fits the display
+    vmin, vmax = pyr.clims(1000)
+"""
+
+import os
+import hashlib
+import threading
+
+import numpy as np
+
+from maxscan import LRUCache
+from maxymus_processing import contrast_limits
+
+
+def bin_frames(block, factor):
+    '''
+    Mean over factor x factor pixels of a [time, y, x] block, rows and columns
+    that do not fill a bin are dropped.
+    OUTPUT:
+        float32 np.array [time, y // factor, x // factor]
+    '''
+    block = np.asarray(block)
+    t, ny, nx = block.shape
+    my, mx = ny // factor, nx // factor
+    block = block[:, :my*factor, :mx*factor].reshape(t, my, factor, mx, factor)
+    return block.mean(axis = (2, 4), dtype = np.float32)
+
+
+def fingerprint(data, n_frames = 16, n_pixels = 64):
+    '''
+    sha1 hex digest of the shape, dtype and a strided sample (about n_frames
+    frames of n_pixels x n_pixels values) of a stack. Identifies the source of
+    cached levels without reading the whole stack, so changes that miss
+    the sample are not detected.
+    '''
+    shape = tuple(data.shape)
+    digest = hashlib.sha1(repr((shape, str(data.dtype))).encode('ascii'))
+    stride = tuple(max(1, n // n_pixels) for n in shape[1:])
+    for t in np.unique(np.linspace(0, shape[0] - 1, min(shape[0], n_frames)).astype(int)):
+        digest.update(np.ascontiguousarray(np.asarray(data[t])[::stride[0], ::stride[1]]).tobytes())
+    return digest.hexdigest()
+
+
+class StackPyramid(object):
+    '''
+    Binned levels of a stack, built and cached per block of frames.
+    INPUT:
+        data: 3d stack with time as first axis (np.array, np.memmap, BBXStack, SortedStack)
+        factors: binning factors of the levels (default is (2, 4, 8))
+        block_frames: frames binned at once (default is 64)
+        cache_bytes: memory budget of the level cache (default is 256 MB, ignored with cache_dir)
+        cache_dir: folder to keep the levels on disk as .npy files, reused by later sessions
+                   with the same name and the same fingerprint() of the data (default is None, i.e. in memory)
+        name: file name prefix in cache_dir (default is 'stack')
+        scale: percentiles of the per-frame contrast limits (default is (0.1, 99.9))
+    '''
+    def __init__(self, data, factors = (2, 4, 8), block_frames = 64, cache_bytes = 256 * 2**20, cache_dir = None, name = 'stack',
+                 scale = (0.1, 99.9)):
+        if len(data.shape) != 3:
+            raise ValueError('Expected a [time, y, x] stack, got shape %s.' % (data.shape,))
+        self.data = data
+        self.shape = tuple(data.shape)
+        self.factors = (1,) + tuple(sorted(f for f in factors if f > 1 and min(self.shape[1:]) // f > 0))
+        self.block_frames = block_frames
+        self.cache_dir = cache_dir
+        self.name = name
+        self.scale = scale
+        self.cache = LRUCache(cache_bytes)
+        self._lock = threading.RLock()
+        self._levels = {}
+        self._done = {}
+        self._clims = None
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok = True)
+            self.fingerprint = fingerprint(data)
+            for f in self.factors[1:]:
+                self._open_level(f)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def level_shape(self, factor):
+        return (self.shape[0], self.shape[1] // factor, self.shape[2] // factor)
+
+    def _open_level(self, factor):
+        # level as .npy memmap plus a flag per block and the fingerprint of the source,
+        # files of another shape or source are rebuilt
+        base = os.path.join(self.cache_dir, '%s_bin%d' % (self.name, factor))
+        shape = self.level_shape(factor)
+        n_blocks = -(-shape[0] // self.block_frames)
+        try:
+            with open(base + '_source.txt', 'r') as f:
+                if f.read().strip() != self.fingerprint:
+                    raise ValueError
+            level = np.load(base + '.npy', mmap_mode = 'r+')
+            done = np.load(base + '_done.npy', mmap_mode = 'r+')
+            if level.shape != shape or level.dtype != np.float32 or done.shape != (n_blocks,):
+                raise ValueError
+        except (OSError, ValueError):
+            level = np.lib.format.open_memmap(base + '.npy', mode = 'w+', dtype = np.float32, shape = shape)
+            done = np.lib.format.open_memmap(base + '_done.npy', mode = 'w+', dtype = bool, shape = (n_blocks,))
+            with open(base + '_source.txt', 'w') as f:
+                f.write(self.fingerprint)
+        self._levels[factor] = level
+        self._done[factor] = done
+
+    def _build_block(self, factor, b):
+        # the next finer level is used as source, so every level reads the raw data only once
+        a, z = b * self.block_frames, min((b + 1) * self.block_frames, self.shape[0])
+        finer = [f for f in self.factors if f < factor and factor % f == 0][-1]
+        source = self.data[a:z] if finer == 1 else self.block(finer, b)
+        return bin_frames(source, factor // finer)
+
+    def block(self, factor, b):
+        '''
+        Block b (frames b * block_frames ...) of a binned level.
+        '''
+        with self._lock:
+            if self.cache_dir is not None:
+                if not self._done[factor][b]:
+                    a = b * self.block_frames
+                    binned = self._build_block(factor, b)
+                    self._levels[factor][a:a+len(binned)] = binned
+                    self._done[factor][b] = True
+                a = b * self.block_frames
+                return self._levels[factor][a:a+self.block_frames]
+            binned = self.cache.get((factor, b))
+            if binned is None:
+                binned = self._build_block(factor, b)
+                self.cache.put((factor, b), binned)
+            return binned
+
+    def level_for(self, display_shape):
+        '''
+        Coarsest binning factor whose images still have at least display_shape (height, width) pixels.
+        '''
+        fitting = [f for f in self.factors if self.shape[1] // f >= display_shape[0] and self.shape[2] // f >= display_shape[1]]
+        return fitting[-1] if fitting else 1
+
+    def frame(self, index, factor = None, display_shape = None):
+        '''
+        One frame at a binning factor, or at the level fitting display_shape (height, width).
+        OUTPUT:
+            2d np.array (float32 for binned levels)
+        '''
+        if factor is None:
+            factor = 1 if display_shape is None else self.level_for(display_shape)
+        if factor == 1:
+            return np.asarray(self.data[index])
+        if factor not in self.factors:
+            raise ValueError('No level with binning %d, available are %s.' % (factor, self.factors))
+        index = range(self.shape[0])[index]
+        b, i = divmod(index, self.block_frames)
+        return self.block(factor, b)[i]
+
+    def build(self, factors = None):
+        '''
+        Build all blocks of the given levels (default is all levels).
+        '''
+        for f in (factors or self.factors[1:]):
+            for b in range(-(-self.shape[0] // self.block_frames)):
+                self.block(f, b)
+
+    def build_async(self, factors = None):
+        '''
+        Build the levels in a background thread, frames are served meanwhile.
+        '''
+        thread = threading.Thread(target = self.build, args = (factors,), daemon = True)
+        thread.start()
+        return thread
+
+    def precompute_clims(self):
+        '''
+        Per-frame contrast limits at the percentiles in scale, from the coarsest level.
+        OUTPUT:
+            np.array (n_frames, 2)
+        '''
+        factor = self.factors[-1]
+        clims = np.empty((self.shape[0], 2))
+        for b in range(-(-self.shape[0] // self.block_frames)):
+            a = b * self.block_frames
+            block = self.block(factor, b) if factor > 1 else np.asarray(self.data[a:a+self.block_frames])
+            flat = np.asarray(block, dtype = np.float32).reshape(len(block), -1)
+            clims[a:a+len(block)] = np.nanpercentile(flat, self.scale, axis = 1).T
+        self._clims = clims
+        return clims
+
+    def clims(self, index = None):
+        '''
+        Contrast limits of one frame, or common limits of the stack if index is None
+        (pymaxymus.contrast_limits of the data, estimated from a strided subsample for
+        large stacks, so no level has to be built).
+        '''
+        if index is None:
+            return contrast_limits(self.data, self.scale)
+        if self._clims is None:
+            self.precompute_clims()
+        return tuple(self._clims[index])
+
+
+class PyramidViewer(object):
+    '''
+    Matplotlib image of a StackPyramid that shows every frame at the level
+    fitting the size of the axes on screen, in full resolution pixel coordinates.
+    INPUT:
+        pyramid: StackPyramid
+        ax: matplotlib axes (default is None, i.e. a new figure)
+        per_frame_clims: use the contrast limits of every frame instead of common ones (default is False)
+        kwargs: passed to imshow, e.g. cmap
+    '''
+    def __init__(self, pyramid, ax = None, per_frame_clims = False, **kwargs):
+        import matplotlib.pyplot as plt
+        if ax is None:
+            _, ax = plt.subplots()
+        self.pyramid = pyramid
+        self.ax = ax
+        self.per_frame_clims = per_frame_clims
+        self.index = 0
+        self.clim = pyramid.clims()
+        extent = (-.5, pyramid.shape[2] - .5, pyramid.shape[1] - .5, -.5)
+        self.image = ax.imshow(self.pyramid.frame(0, display_shape = self.display_shape()), extent = extent,
+                               vmin = self.clim[0], vmax = self.clim[1], **kwargs)
+
+    def display_shape(self):
+        bbox = self.ax.get_window_extent()
+        return (int(bbox.height), int(bbox.width))
+
+    def show(self, index):
+        '''
+        Show frame index (e.g. as callback of an ipywidgets IntSlider).
+        '''
+        self.index = index
+        self.image.set_data(self.pyramid.frame(index, display_shape = self.display_shape()))
+        if self.per_frame_clims:
+            self.image.set_clim(*self.pyramid.clims(index))
+        self.ax.figure.canvas.draw_idle()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Metadata index of a beamtime folder. Only scalar metadata of every scan is
+read (in parallel) and stored in a SQLite file, so finding scans by energy,
+field or date does not read any image data. Updating the index only visits
+new or modified files.
+
+    update_index(data_folder)
+    df = query_index(data_folder, "date = ? AND energy BETWEEN ? AND ?", ('2024-04-18', 700, 710))
+"""
+
+import os
+import re
+import glob
+import json
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from maxscan import MaxymusScan
+
+
+INDEX_NAME = 'maxymus_index.sqlite'
+FNAME_PATTERN = re.compile(r'(?P<prefix>.+)_(?P<date>\d{4}-\d{2}-\d{2})_(?P<scan_id>\d+)\.hdf5$')
+
+# scalar metadata stored as own (indexed) columns, everything else (also arrays of these
+# keys, e.g. the energies of a stack) goes into the json column
+COLUMNS = ('energy', 'magnetic_field', 'count_time', 'start_time', 'end_time', 'stxm_scan_type')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scans (
+    fname TEXT PRIMARY KEY,
+    prefix TEXT,
+    date TEXT,
+    scan_id INTEGER,
+    mtime REAL,
+    size INTEGER,
+    ny INTEGER,
+    nx INTEGER,
+    energy REAL,
+    magnetic_field REAL,
+    count_time REAL,
+    start_time TEXT,
+    end_time TEXT,
+    stxm_scan_type TEXT,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS scans_date ON scans (date, scan_id);
+CREATE INDEX IF NOT EXISTS scans_energy ON scans (energy);
+CREATE INDEX IF NOT EXISTS scans_field ON scans (magnetic_field);
+'''
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return str(value)
+
+
+def _scalar(value):
+    # python scalar for the typed columns, None for multi-valued metadata (e.g. the
+    # energies of a stack), which sqlite would store as an opaque blob
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.item() if value.size == 1 else None
+    if isinstance(value, (list, tuple)):
+        return None
+    return value
+
+
+def read_metadata(fname, entry = 'entry1', detector = 'APD', max_size = 16):
+    '''
+    Row of the index for one scan. Never raises, unreadable (e.g. incomplete)
+    files return None so that they are retried on the next update.
+    '''
+    try:
+        st = os.stat(fname)
+        with MaxymusScan(fname, entry = entry, detector = detector) as scan:
+            meta = scan.metadata(max_size = max_size)
+    except Exception:
+        return None
+    row = dict(fname = os.path.abspath(fname), mtime = st.st_mtime, size = st.st_size, prefix = None, date = None, scan_id = None)
+    match = FNAME_PATTERN.match(os.path.basename(fname))
+    if match:
+        row.update(prefix = match.group('prefix'), date = match.group('date'), scan_id = int(match.group('scan_id')))
+    shape = meta.pop('shape')
+    row['ny'] = shape[-2] if len(shape) > 1 else None
+    row['nx'] = shape[-1] if len(shape) > 0 else None
+    meta.pop('fname')
+    for key in COLUMNS:
+        value = meta.pop(key, None)
+        row[key] = _scalar(value)
+        if row[key] is None and value is not None:
+            meta[key] = value   # arrays stay in the json column
+    row['metadata'] = json.dumps(meta, default = _to_json)
+    return row
+
+
+def index_path(data_folder, db_path = None):
+    return os.path.join(data_folder, INDEX_NAME) if db_path is None else db_path
+
+
+def connect(data_folder, db_path = None):
+    con = sqlite3.connect(index_path(data_folder, db_path))
+    con.executescript(SCHEMA)
+    return con
+
+
+def _insert(con, row):
+    keys = list(row.keys())
+    con.execute('INSERT OR REPLACE INTO scans (%s) VALUES (%s)' % (', '.join(keys), ', '.join('?' * len(keys))),
+                [row[k] for k in keys])
+
+
+def index_scan(fname, data_folder, db_path = None, entry = 'entry1', detector = 'APD'):
+    '''
+    Add or update a single scan, e.g. as soon as it was written.
+    OUTPUT:
+        True if the scan was indexed, False if it could not be read
+    '''
+    row = read_metadata(fname, entry, detector)
+    if row is None:
+        return False
+    con = connect(data_folder, db_path)
+    try:
+        _insert(con, row)
+        con.commit()
+    finally:
+        con.close()
+    return True
+
+
+def update_index(data_folder, db_path = None, pattern = '*.hdf5', recursive = True, entry = 'entry1', detector = 'APD', n_workers = None, prune = True):
+    '''
+    Add new and modified scans below data_folder to the index.
+    INPUT:
+        data_folder: folder to scan
+        db_path: SQLite file (default is <data_folder>/maxymus_index.sqlite)
+        pattern: glob pattern of the scan files (default is '*.hdf5')
+        recursive: also search sub folders, e.g. one per date (default is True)
+        entry, detector: see MaxymusScan
+        n_workers: number of processes (default is None, i.e. the number of cores)
+        prune: remove scans from the index whose files disappeared (default is True)
+    OUTPUT:
+        dict with the number of added, updated, removed and unreadable files
+    '''
+    search = os.path.join(data_folder, '**', pattern) if recursive else os.path.join(data_folder, pattern)
+    files = [os.path.abspath(f) for f in glob.glob(search, recursive = recursive)]
+    con = connect(data_folder, db_path)
+    try:
+        known = dict((f, (m, s)) for f, m, s in con.execute('SELECT fname, mtime, size FROM scans'))
+        todo = []
+        for f in files:
+            st = os.stat(f)
+            if known.get(f) != (st.st_mtime, st.st_size):
+                todo.append(f)
+
+        stats = dict(added = 0, updated = 0, removed = 0, unreadable = 0)
+        if todo:
+            with ProcessPoolExecutor(max_workers = n_workers) as pool:
+                rows = pool.map(read_metadata, todo, [entry] * len(todo), [detector] * len(todo), chunksize = 16)
+                for f, row in zip(todo, rows):
+                    if row is None:
+                        stats['unreadable'] += 1
+                        continue
+                    stats['updated' if f in known else 'added'] += 1
+                    _insert(con, row)
+        if prune:
+            gone = set(known) - set(files)
+            con.executemany('DELETE FROM scans WHERE fname = ?', [(f,) for f in gone])
+            stats['removed'] = len(gone)
+        con.commit()
+    finally:
+        con.close()
+    return stats
+
+
+def query_index(data_folder, where = None, params = (), db_path = None, expand = False):
+    '''
+    Query the index, e.g. query_index(folder, "date = ? AND magnetic_field > ?", ('2024-04-18', 50)).
+    INPUT:
+        data_folder: indexed folder
+        where: SQL condition on the columns of the scans table (default is None, i.e. all scans)
+        params: parameters for the ? placeholders in where
+        db_path: SQLite file (default is <data_folder>/maxymus_index.sqlite)
+        expand: add the remaining metadata from the json column as columns (default is False)
+    OUTPUT:
+        pandas DataFrame indexed by fname, sorted by date and scan_id
+    '''
+    import pandas as pd
+
+    sql = 'SELECT * FROM scans'
+    if where:
+        sql += ' WHERE ' + where
+    sql += ' ORDER BY date, scan_id'
+    con = connect(data_folder, db_path)
+    try:
+        df = pd.read_sql_query(sql, con, params = params, index_col = 'fname')
+    finally:
+        con.close()
+    if expand and len(df):
+        extra = pd.DataFrame([json.loads(m) for m in df['metadata']], index = df.index)
+        df = df.drop(columns = 'metadata').join(extra)
+    return df
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Update the metadata index of a MAXYMUS data folder.')
+    parser.add_argument('data_folder')
+    parser.add_argument('--db', default = None, help = 'SQLite file (default: <data_folder>/%s)' % INDEX_NAME)
+    parser.add_argument('--detector', default = 'APD')
+    parser.add_argument('--workers', type = int, default = None)
+    args = parser.parse_args(argv)
+    stats = update_index(args.data_folder, db_path = args.db, detector = args.detector, n_workers = args.workers)
+    print(', '.join('%d %s' % (v, k) for k, v in stats.items()))
+
+
+if __name__ == '__main__':
+    main()
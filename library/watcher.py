@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Live processing of a beamtime folder: new Sample_Image_*.hdf5 files are
+picked up as soon as the microscope has finished writing them and pushed
+through a configurable list of steps on a bounded worker pool.
+
+Steps (run in this order for every scan):
+    load       read image, pixel size, energy and field (maxscan.MaxymusScan)
+    poscorr    raw and position corrected float32 .tif (batchconvert.convert_image)
+    quicklook  .png quicklook with scale bar (maxymus_plotting.export_image)
+    index      add the scan to the metadata index (scanindex.index_scan)
+
+A file counts as complete when its size and modification time did not change
+for `settle` seconds and it can be opened with h5py. Only 2 * n_workers scans
+are queued at once; while the pool is busy, new files simply stay on disk
+until a slot is free, and with newest_first the most recent scan is processed
+next so the quicklooks keep up with the microscope.
+
+    python watcher.py Z:\\data2\\2024-04-18 --steps poscorr quicklook index --workers 2
+
+or from python:
+
+    watcher = FolderWatcher(data_folder, steps = ('load', 'quicklook'), options = dict(save_path = folder_save))
+    watcher.run()   # stop with Ctrl+C or watcher.stop()
+"""
+
+import os
+import glob
+import time
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import h5py
+
+
+STEP_ORDER = ('load', 'poscorr', 'quicklook', 'index')
+
+DEFAULT_OPTIONS = dict(entry = 'entry1', detector = 'APD', save_path = None, interpolation = 'linear',
+                       cmap = 'gray', scale = (1, 99), scalebar = 1., db_path = None)
+
+
+def _save_path(fname, options):
+    save_path = options['save_path'] or os.path.join(os.path.dirname(fname), 'Analyzed')
+    if not os.path.exists(save_path):
+        os.makedirs(save_path, exist_ok = True)
+    return save_path
+
+
+def step_load(fname, context, options):
+    from maxscan import MaxymusScan
+    with MaxymusScan(fname, entry = options['entry'], detector = options['detector']) as scan:
+        context['image'] = scan.image
+        context['pixel_size'] = scan.pixel_size
+        context['energy'] = scan.energy
+        context['magnetic_field'] = scan.magnetic_field
+
+
+def step_poscorr(fname, context, options):
+    from batchconvert import convert_image
+    context['outputs'] += convert_image(fname, _save_path(fname, options), options['entry'], options['detector'], options['interpolation'])
+
+
+def step_quicklook(fname, context, options):
+    from maxymus_plotting import export_image
+    if 'image' not in context:
+        step_load(fname, context, options)
+    destination = os.path.join(_save_path(fname, options), os.path.splitext(os.path.basename(fname))[0] + '.png')
+    export_image(context['image'], destination, context['pixel_size'][1], options['scalebar'], color = 'r',
+                 cmap = options['cmap'], scale = options['scale'], origin = 'lower')
+    context['outputs'].append(destination)
+
+
+def step_index(fname, context, options):
+    import scanindex
+    if not scanindex.index_scan(fname, os.path.dirname(fname), options['db_path'], options['entry'], options['detector']):
+        raise IOError('could not read the metadata')
+
+
+STEPS = dict(load = step_load, poscorr = step_poscorr, quicklook = step_quicklook, index = step_index)
+
+
+def process_scan(fname, steps, options):
+    '''
+    Run the steps for one scan (worker of FolderWatcher), never raises.
+    OUTPUT:
+        dict with the keys name, status ('done' or 'failed'), step (failed step or None),
+        outputs, seconds, latency (seconds since the file was last modified) and error
+    '''
+    t0 = time.perf_counter()
+    result = dict(name = os.path.basename(fname), status = 'done', step = None, outputs = [], error = None)
+    context = dict(outputs = result['outputs'])
+    for step in steps:
+        try:
+            STEPS[step](fname, context, options)
+        except Exception as e:
+            result.update(status = 'failed', step = step, error = '%s: %s' % (type(e).__name__, e))
+            break
+    result['seconds'] = time.perf_counter() - t0
+    try:
+        result['latency'] = time.time() - os.path.getmtime(fname)
+    except OSError:
+        result['latency'] = None
+    return result
+
+
+def is_complete(fname, entry = 'entry1', detector = 'APD'):
+    '''
+    True if the file can be opened with h5py and contains the image, i.e. the
+    writer closed it.
+    '''
+    try:
+        with h5py.File(fname, 'r') as f:
+            return '/%s/%s/data' % (entry, detector) in f
+    except (OSError, KeyError):
+        return False
+
+
+def print_result(result):
+    if result['status'] == 'done':
+        print('%s: done in %.1f s (%.1f s after writing), %d files' % (result['name'], result['seconds'], result['latency'] or 0, len(result['outputs'])))
+    else:
+        print('%s: %s failed, %s' % (result['name'], result['step'], result['error']))
+
+
+class FolderWatcher(object):
+    '''
+    Poll a data folder and process every complete new scan.
+    INPUT:
+        data_folder: folder the microscope writes to
+        steps: names of the steps, see STEPS (default is ('load', 'quicklook', 'index'))
+        options: dict updating DEFAULT_OPTIONS, e.g. save_path, detector, interpolation, cmap, scale
+        pattern: glob pattern of the scan files (default is 'Sample_Image_*.hdf5')
+        interval: seconds between two polls (default is 1)
+        settle: seconds size and mtime must stay unchanged (default is 2)
+        n_workers: size of the worker pool (default is 2)
+        processes: use processes instead of threads for the workers (default is True)
+        newest_first: when scans are waiting, process the newest one first (default is True)
+        skip_existing: only process files that appear after the start (default is False)
+        on_result: called with the result dict of every scan in the watcher thread (default is print_result)
+    '''
+    def __init__(self, data_folder, steps = ('load', 'quicklook', 'index'), options = None, pattern = 'Sample_Image_*.hdf5',
+                 interval = 1., settle = 2., n_workers = 2, processes = True, newest_first = True, skip_existing = False,
+                 on_result = print_result):
+        unknown = [s for s in steps if s not in STEPS]
+        if unknown:
+            raise ValueError('Unknown steps %s, available are %s.' % (unknown, list(STEPS)))
+        self.data_folder = data_folder
+        self.steps = tuple(s for s in STEP_ORDER if s in steps)
+        self.options = dict(DEFAULT_OPTIONS, **(options or {}))
+        self.pattern = pattern
+        self.interval = interval
+        self.settle = settle
+        self.n_workers = n_workers
+        self.processes = processes
+        self.newest_first = newest_first
+        self.on_result = on_result
+        self.results = []
+        self._seen = {}         # fname -> (size, mtime, time the state was first seen)
+        self._done = set(self.files()) if skip_existing else set()
+        self._waiting = []
+        self._slots = threading.BoundedSemaphore(2 * n_workers)
+        self._finished = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def files(self):
+        return glob.glob(os.path.join(self.data_folder, self.pattern))
+
+    def poll(self, now = None):
+        '''
+        Check the folder once. New complete files are added to the waiting list.
+        OUTPUT:
+            list of files that became complete
+        '''
+        now = time.time() if now is None else now
+        complete = []
+        for fname in self.files():
+            if fname in self._done:
+                continue
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            state = (st.st_size, st.st_mtime)
+            seen = self._seen.get(fname)
+            if seen is None or seen[:2] != state:
+                self._seen[fname] = state + (now,)
+                continue
+            if now - seen[2] >= self.settle and is_complete(fname, self.options['entry'], self.options['detector']):
+                del self._seen[fname]
+                self._done.add(fname)
+                complete.append(fname)
+        self._waiting.extend(sorted(complete))
+        return complete
+
+    def _next(self):
+        return self._waiting.pop() if self.newest_first else self._waiting.pop(0)
+
+    def _finish(self, future):
+        try:
+            result = future.result()
+        except Exception as e:    # e.g. a worker process died
+            result = dict(name = None, status = 'failed', step = None, outputs = [], error = '%s: %s' % (type(e).__name__, e),
+                          seconds = None, latency = None)
+        with self._lock:
+            self._finished.append(result)
+        self._slots.release()
+
+    def _report(self):
+        with self._lock:
+            finished, self._finished = self._finished, []
+        for result in finished:
+            self.results.append(result)
+            if self.on_result is not None:
+                self.on_result(result)
+
+    @property
+    def backlog(self):
+        '''
+        Number of complete scans waiting for a free worker.
+        '''
+        return len(self._waiting)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, duration = None, max_scans = None):
+        '''
+        Watch until stop() is called, KeyboardInterrupt, duration seconds passed
+        or max_scans scans were processed. Running jobs are finished before returning.
+        OUTPUT:
+            list of the result dicts, see process_scan()
+        '''
+        t_end = None if duration is None else time.time() + duration
+        Executor = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        submitted = 0
+        self._stop.clear()
+        with Executor(max_workers = self.n_workers) as pool:
+            try:
+                while not self._stop.is_set():
+                    if t_end is not None and time.time() >= t_end:
+                        break
+                    if max_scans is not None and submitted >= max_scans:
+                        break
+                    self.poll()
+                    # backpressure: only submit while a slot is free, everything else waits on disk
+                    while self._waiting and (max_scans is None or submitted < max_scans) and self._slots.acquire(blocking = False):
+                        future = pool.submit(process_scan, self._next(), self.steps, self.options)
+                        future.add_done_callback(self._finish)
+                        submitted += 1
+                    self._report()
+                    self._stop.wait(self.interval)
+            except KeyboardInterrupt:
+                pass
+        self._report()
+        return self.results
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Process new MAXYMUS scans while they are written.')
+    parser.add_argument('data_folder')
+    parser.add_argument('--steps', nargs = '+', default = ['load', 'quicklook', 'index'], choices = list(STEPS))
+    parser.add_argument('--save-path', default = None, help = 'output folder (default: <data_folder>/Analyzed)')
+    parser.add_argument('--detector', default = 'APD')
+    parser.add_argument('--workers', type = int, default = 2)
+    parser.add_argument('--interval', type = float, default = 1.)
+    parser.add_argument('--settle', type = float, default = 2.)
+    parser.add_argument('--skip-existing', action = 'store_true', help = 'only process scans written after the start')
+    args = parser.parse_args(argv)
+    watcher = FolderWatcher(args.data_folder, args.steps, dict(save_path = args.save_path, detector = args.detector),
+                            interval = args.interval, settle = args.settle, n_workers = args.workers, skip_existing = args.skip_existing)
+    print('Watching %s (%s), stop with Ctrl+C' % (args.data_folder, ', '.join(watcher.steps)))
+    watcher.run()
+
+
+if __name__ == '__main__':
+    main()
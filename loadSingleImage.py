@@ -4,11 +4,14 @@ For importing single .hdf5 images, and saving them as .tif images
 """
 
 import os
+import sys
 import h5py
 import imageio
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.interpolate import griddata
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'library'))
+from poscorr import correct_positions
 
 
 ## User variables
@@ -18,7 +21,7 @@ imageNumber = '033'
 
 entryNumber = 'entry1'
 
-interpolation = 'linear' ## 'cubic'
+interpolation = 'linear' ## 'cubic', 'cached', 'lines' (fast, complete scans only), see library/poscorr.py
 detector = 'APD' ## available detectors 'APD', 'timemachine', 'PMT', 'VCO'
 rootPath = 'Z:\\data2'
 #rootPath = 'C:\\Users\\finizio_s\\Desktop'
@@ -46,14 +49,7 @@ with h5py.File(imagePath,'r') as f:
     ready = f[datasetInst+'/sample_y/data'][()]
     data = f[datasetInst+'/'+detector+'/data'][()]
     
-    X,Y = np.meshgrid(setpx, setpy)
-    
-    Xq = readx-np.mean(readx)
-    Yq = ready-np.mean(ready)
-    X = X-np.mean(X)
-    Y = Y-np.mean(Y)
-    
-    I_pc = griddata((Xq, Yq), data, (X, Y), method=interpolation, fill_value=0)
+I_pc = correct_positions(setpx, setpy, readx, ready, data, method=interpolation, fill_value=0)
 
 
 I = np.flip(I,0)
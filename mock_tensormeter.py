@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Local mock of the tensormeter TCP server for testing and benchmarking
+tensormeter.py without the instrument.
+
+Frames in both directions are [length >i][command 4s][payload], length counts
+the command and the payload. The mock understands
+    meas  [N_samples >i]  stored in mock.N_samples
+    vodc  [voltage >d]    stored in mock.voltage
+    cldt                  restarts the time stamps at 0
+    newd, alld            answered with [rows >i][columns >i][rows*columns >f8],
+                          column 0 holds time stamps in seconds since cldt
+Other commands are recorded and ignored. To exercise the client, answers can
+be delayed (latency), preceded by unsolicited frames with other commands
+(which get_data must skip) and sent in small fragments (chunk_size,
+chunk_delay), which shows up as short reads on the client side.
+
+    with MockTensormeter(rows=1000, columns=12, chunk_size=1000) as server:
+        tens = tensormeter(0, HOST=server.host, PORT=server.port)
+        d, a = tens.get_all_data()
+"""
+
+import time
+import socket
+import struct
+import threading
+import socketserver
+
+import numpy as np
+
+
+VALUE_FORMATS = {'meas': 'i', 'vodc': 'd'}
+
+
+def frame(command, payload = b''):
+    return struct.pack('>i4s', 4 + len(payload), command.encode("ascii")) + payload
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        # tensormeter sets a global default timeout, the server waits forever
+        self.request.settimeout(None)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def recv_exact(self, n):
+        buf = bytearray(n)
+        view = memoryview(buf)
+        pos = 0
+        while pos < n:
+            k = self.request.recv_into(view[pos:], n - pos)
+            if k == 0:
+                raise ConnectionError("client closed connection")
+            pos += k
+        return bytes(buf)
+
+    def send(self, data):
+        mock = self.server.mock
+        if mock.chunk_size is None:
+            self.request.sendall(data)
+            return
+        view = memoryview(data)
+        for pos in range(0, len(data), mock.chunk_size):
+            self.request.sendall(view[pos:pos + mock.chunk_size])
+            if mock.chunk_delay:
+                time.sleep(mock.chunk_delay)
+
+    def handle(self):
+        mock = self.server.mock
+        while True:
+            try:
+                length, command = struct.unpack('>i4s', self.recv_exact(8))
+                payload = self.recv_exact(length-4)
+            except (ConnectionError, OSError):
+                return
+            answer = mock.process(command.decode("ascii"), payload)
+            if answer is None:
+                continue
+            if mock.latency:
+                time.sleep(mock.latency)
+            try:
+                self.send(b''.join(mock.unsolicited_frames()) + answer)
+            except OSError:
+                return
+
+
+class MockTensormeter(object):
+    '''
+    Mock tensormeter server running in a background thread.
+    INPUT:
+        rows, columns: size of the matrix sent for newd/alld
+        host: interface to listen on (default is 'localhost')
+        port: port to listen on (default is 0, i.e. any free port)
+        latency: delay in seconds before every answer (default is 0)
+        unsolicited: number of frames with other commands sent before every answer (default is 0)
+        chunk_size: send answers in fragments of this many bytes (default is None, i.e. at once)
+        chunk_delay: pause in seconds between two fragments (default is 0)
+    '''
+    def __init__(self, rows = 100, columns = 12, host = 'localhost', port = 0, latency = 0, unsolicited = 0,
+                 chunk_size = None, chunk_delay = 0):
+        self.rows = rows
+        self.columns = columns
+        self.latency = latency
+        self.unsolicited = unsolicited
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.received = []
+        self.N_samples = None
+        self.voltage = None
+        self.t0 = time.time()
+        self._rng = np.random.default_rng(0)
+        self._data = self._rng.normal(size = (rows, columns)).astype('>f8')
+        self._lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer((host, port), _Handler, bind_and_activate = False)
+        self.server.allow_reuse_address = True
+        self.server.daemon_threads = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self.server.mock = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def process(self, command, payload):
+        '''
+        Handle one request, returns the answer frame or None.
+        '''
+        value = payload
+        if command in VALUE_FORMATS and len(payload) == struct.calcsize('>' + VALUE_FORMATS[command]):
+            value = struct.unpack('>' + VALUE_FORMATS[command], payload)[0]
+        with self._lock:
+            self.received.append((command, value))
+            if command == 'meas':
+                self.N_samples = value
+            elif command == 'vodc':
+                self.voltage = value
+            elif command == 'cldt':
+                self.t0 = time.time()
+            elif command in ('newd', 'alld'):
+                return self.matrix_frame(command)
+        return None
+
+    def matrix(self):
+        # random data generated once, only the time stamps are updated
+        self._data[:, 0] = time.time() - self.t0 - np.arange(self.rows)[::-1] * 1e-3
+        return self._data
+
+    def matrix_frame(self, command):
+        return frame(command, struct.pack('>ii', self.rows, self.columns) + self.matrix().tobytes())
+
+    def unsolicited_frames(self):
+        # status frames of random length with commands the client did not ask for
+        return [frame('stat', self._rng.bytes(int(self._rng.integers(0, 64)))) for _ in range(self.unsolicited)]
+
+    def start(self):
+        self._thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -6,12 +6,13 @@ Created on Tue May  9 15:48:01 2023
 """
 
 import numpy as np
-import time
 import socket
 import struct
 from time import sleep
 import serial
 
+from tensormeter_protocol import pack_frame
+
 class tensormeter:
     
     def __init__(self, N_samples, n_max_attempts = 10, HOST = 'localhost', PORT = 6340  ):
@@ -20,9 +21,22 @@ class tensormeter:
         
         self.N_samples = N_samples
         self.n_max_attempts = n_max_attempts
+        self.address = (HOST, PORT)
         socket.setdefaulttimeout(0.5)
+        self.connect()
+    
+    def connect(self):
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.s.connect((HOST, PORT))
+        self.s.connect(self.address)
+    
+    def reconnect(self):
+        # the rest of a frame broken off by a timeout stays in the stream and would
+        # be read as the next header, a new connection starts at a frame boundary
+        try:
+            self.s.close()
+        except OSError:
+            pass
+        self.connect()
     
     def fomt(self,c):
         switcher = {
@@ -50,209 +64,101 @@ class tensormeter:
     
     
     def send_meas(self, N_samples):
-        value = struct.pack('>i', N_samples)
-        
-        size_value = struct.calcsize('i')
-
-        command = b'meas'
-        size_command = 4
-        size = size_command + size_value
-        size = struct.pack('>i', size)
-        self.s.sendall(size+command+value)
+        self.s.sendall(pack_frame('meas', 'i', N_samples))
         
     def send_vodc(self, voltage):
-        value = struct.pack('>d', voltage)
-        
-        size_value = struct.calcsize('d')
-        command = b'vodc'
-        size_command = 4
-        size = size_command + size_value
-        size = 12
-        size = struct.pack('>i', size)
-        self.s.sendall(size+command+value)
+        self.s.sendall(pack_frame('vodc', 'd', voltage))
     
     def send_cldt(self):
-        command = b'cldt'
-        size_command = 4
-        size = size_command
-        size = struct.pack('>i', size)
-        self.s.sendall(size+command)
+        self.s.sendall(pack_frame('cldt'))
     
     def send_newd(self):
-        command = b'newd'
-        size_command = 4
-        size = size_command
-        size = struct.pack('>i', size)
-        self.s.sendall(size+command)
+        self.s.sendall(pack_frame('newd'))
         
     def send_alld(self):
-        command = b'alld'
-        size_command = 4
-        size = size_command
-        size = struct.pack('>i', size)
-        self.s.sendall(size+command)
+        self.s.sendall(pack_frame('alld'))
         
     def empty(self):
         self.s.recv(1)
         return
+    
+    def recv_exact(self, n, buf = None):
+        # receive exactly n bytes into buf (allocated if None), loops over short reads
+        if buf is None:
+            buf = bytearray(n)
+        view = memoryview(buf)[:n]
+        pos = 0
+        while pos < n:
+            k = self.s.recv_into(view[pos:], n - pos)
+            if k == 0:
+                raise ConnectionError("connection closed by tensormeter")
+            pos += k
+        return buf
+    
+    def recv_header(self):
+        # length (including the 4 command bytes) and command of the next frame
+        length, command = struct.unpack('>i4s', self.recv_exact(8))
+        return length, command.decode("ascii")
+    
+    def recv_matrix(self):
+        # rows x columns big-endian doubles, decoded without copying the buffer
+        rows, columns = struct.unpack('>ii', self.recv_exact(8))
+        rawdata = self.recv_exact(rows*columns*8)
+        return np.frombuffer(rawdata, dtype='>f8').reshape(rows, columns)
+    
+    def request_matrix(self, command, send):
+        # send the request and skip unrelated frames until the answer arrives
+        n_failed_attempts = 0
+        while n_failed_attempts < self.n_max_attempts:
+            try:
+                send()
+                while True:
+                    length, rcv_command = self.recv_header()
+                    if rcv_command == command:
+                        break
+                    self.recv_exact(length-4)
+                return self.recv_matrix()
+            except Exception as e:
+                print(e)
+                n_failed_attempts += 1
+                print("failed.. ",n_failed_attempts)
+                try:
+                    self.reconnect()
+                except OSError as e:
+                    print(e)
+        print("Could not retrieve data!")
         
     def get_data(self, int_time):
-        got_all_data = False
+        rawdata = self.request_matrix("newd", self.send_newd)
+        if rawdata is None:
+            return
         
-        n_failed_attempts = 0
-        n_max_attempts = self.n_max_attempts
-        #time.sleep(int_time)
-        while not got_all_data and n_failed_attempts< n_max_attempts:
-            self.send_newd()
-            
-            done = False
-            
-            
-            while not done:
-                #print("reading length...")
-                length = struct.unpack('>i', self.s.recv(4))[0]
-                #print("reading command...")
-                command = struct.unpack('>4s', self.s.recv(4))
-                command = command[0].decode("ascii")
-                #print("command: ", command, "length: ", length)
-                
-                if command=="newd":
-                    try:
-                        rows = struct.unpack('>i', self.s.recv(4))[0]
-                        columns = struct.unpack('>i', self.s.recv(4))[0]
-                        X = rows*columns
-                        #print("reading data... rows: ",rows, " colmuns: ",columns)
-                        #rawdata = self.s.recv(4096)
-                        #while len(rawdata) != X*8:
-                        #    rawdata += self.s.recv(4096)
-                        
-                        max_msg_size = 4096
-                        msg_len = X*8
-                        rawdata = bytearray(msg_len )
-                        pos = 0
-                        while pos < msg_len:
-                            rawdata[pos:pos+max_msg_size] = self.s.recv(max_msg_size)
-                            pos += max_msg_size
-                        
-                        fmt = ">"+str(X)+"d"
-                        
-                        rawdata = struct.unpack(fmt,rawdata)[0:X]
-                        
-                        rawdata = np.array(rawdata)
-                        
-                        rawdata = rawdata.reshape(rows,columns)
-                        
-                        got_all_data = True
-                        
-                        #print(rawdata)
-                        print(rawdata.shape)
-                        print(rawdata[0,0],rawdata[-1,0])
-                        print(rawdata[0,0]-rawdata[-1,0])
-                        #print( np.abs(rawdata[:,0]-rawdata[-1,0])<int_time )
-                        #print( rawdata[:,0][np.abs(rawdata[:,0]-rawdata[-1,0])<int_time].shape )
-                        
-                        valids = rawdata[:,0][np.abs(rawdata[:,0]-rawdata[-1,0])<int_time].shape[0]
-                        rawdata = rawdata[-valids:,:]
- 
-                        #print(rawdata)
-                        print(rawdata.shape)
-                        print(rawdata[0,0],rawdata[-1,0])
-                        print(rawdata[0,0]-rawdata[-1,0])
-                        
-                        return rawdata, n_max_attempts
-                    
-                    except Exception as e:
-                        print(e)
-                        n_failed_attempts += 1
-                        print("failed.. ",n_failed_attempts)
-                        pass
-                    
-                    done=True
-                    
-                    
-                else:
-                    rcv = self.s.recv(length-4)
-            
-        print("Could not retrieve data!")    
+        #print(rawdata)
+        print(rawdata.shape)
+        print(rawdata[0,0],rawdata[-1,0])
+        print(rawdata[0,0]-rawdata[-1,0])
+        
+        valids = rawdata[:,0][np.abs(rawdata[:,0]-rawdata[-1,0])<int_time].shape[0]
+        rawdata = rawdata[-valids:,:]
+        
+        #print(rawdata)
+        print(rawdata.shape)
+        print(rawdata[0,0],rawdata[-1,0])
+        print(rawdata[0,0]-rawdata[-1,0])
+        
+        return rawdata, self.n_max_attempts
         
     def get_all_data(self):
-        got_all_data = False
+        rawdata = self.request_matrix("alld", self.send_alld)
+        if rawdata is None:
+            return
         
-        n_failed_attempts = 0
-        n_max_attempts = 10
-        #time.sleep(int_time)
-        while not got_all_data and n_failed_attempts< n_max_attempts:
-            self.send_alld()
-            
-            done = False
-            
-            
-            while not done:
-                #print("reading length...")
-                length = struct.unpack('>i', self.s.recv(4))[0]
-                #print("reading command...")
-                command = struct.unpack('>4s', self.s.recv(4))
-                command = command[0].decode("ascii")
-                #print("command: ", command, "length: ", length)
-                
-                if command=="alld":
-                    try:
-                        rows = struct.unpack('>i', self.s.recv(4))[0]
-                        columns = struct.unpack('>i', self.s.recv(4))[0]
-                        X = rows*columns
-                        #print("reading data... rows: ",rows, " colmuns: ",columns)
-                        #rawdata = self.s.recv(4096)
-                        #while len(rawdata) != X*8:
-                        #    rawdata += self.s.recv(4096)
-                        
-                        max_msg_size = 4096
-                        msg_len = X*8
-                        rawdata = bytearray(msg_len )
-                        pos = 0
-                        while pos < msg_len:
-                            rawdata[pos:pos+max_msg_size] = self.s.recv(max_msg_size)
-                            pos += max_msg_size
-                        
-                        fmt = ">"+str(X)+"d"
-                        
-                        rawdata = struct.unpack(fmt,rawdata)[0:X]
-                        
-                        rawdata = np.array(rawdata)
-                        
-                        rawdata = rawdata.reshape(rows,columns)
-                        
-                        got_all_data = True
-                        
-                        #print(rawdata)
-                        print(rawdata.shape)
-                        print(rawdata[0,0],rawdata[-1,0])
-                        print(rawdata[0,0]-rawdata[-1,0])
-                        #print( np.abs(rawdata[:,0]-rawdata[-1,0])<int_time )
-                        #print( rawdata[:,0][np.abs(rawdata[:,0]-rawdata[-1,0])<int_time].shape )
-                        
-                        #valids = rawdata[:,0][np.abs(rawdata[:,0]-rawdata[-1,0])<int_time].shape[0]
-                        #rawdata = rawdata[-valids:,:]
- 
-                        #print(rawdata)
-                        print(rawdata.shape)
-                        print(rawdata[0,0],rawdata[-1,0])
-                        print(rawdata[0,0]-rawdata[-1,0])
-                        
-                        return rawdata, n_max_attempts
-                    
-                    except Exception as e:
-                        print(e)
-                        n_failed_attempts += 1
-                        print("failed.. ",n_failed_attempts)
-                        pass
-                    
-                    done=True
-                    
-                    
-                else:
-                    rcv = self.s.recv(length-4)
-            
-        print("Could not retrieve data!")   
+        #print(rawdata)
+        print(rawdata.shape)
+        print(rawdata[0,0],rawdata[-1,0])
+        print(rawdata[0,0]-rawdata[-1,0])
+        
+        return rawdata, self.n_max_attempts
                 
         
 #%%
@@ -263,10 +169,8 @@ if __name__ == "__main__":
 def measure_data_point(tens, int_time=1):
     #tens.send_meas(-1)
     tens.send_cldt()
-    t0 = time.time()
     print("integrate...")
-    while time.time()-t0<int_time:
-        pass
+    sleep(int_time)
     print("request data")
     d,a = tens.get_all_data()
     print(d[:,9].mean())
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Framing of the tensormeter TCP protocol, shared by tensormeter.py and
+async_tensormeter.py. Frames in both directions are
+[length >i][command 4s][payload], length counts the command and the payload.
+Only needs struct, so clients that do not talk to the serial port can use it
+without pyserial.
+
+    sock.sendall(pack_frame('vodc', 'd', 0.5))
+"""
+
+import struct
+
+
+HEADER_SIZE = 8
+
+
+def pack_frame(command, fmt = None, value = None):
+    # [length >i][command 4s][value], length counts command and value
+    payload = command.encode("ascii")
+    if fmt is not None:
+        payload += struct.pack('>'+fmt, value)
+    return struct.pack('>i', len(payload)) + payload
+
+
+def unpack_header(header):
+    # length of the payload (without the command) and command of a frame
+    length, command = struct.unpack('>i4s', header)
+    return length-4, command.decode("ascii")
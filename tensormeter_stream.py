@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming acquisition for the tensormeter: a background thread keeps pulling
+the 'newd' increments into a fixed-size ring buffer, so a measurement point is
+a lookup in the buffer instead of a full 'alld' transfer.
+
+    tens = tensormeter(0, HOST="134.30.1.138")
+    with TensormeterStream(tens, capacity=200000) as stream:
+        value = stream.measure_data_point(int_time=3)   # mean of channel 9
+        d = stream.last(1000)                            # copy of the last 1000 rows
+        count, mean, std = stream.buffer.stats()         # running statistics
+"""
+
+import threading
+
+import numpy as np
+
+
+class RingBuffer(object):
+    '''
+    Fixed-size ring buffer of rows with running statistics per column.
+    Every row is stored twice (at i and i + capacity), so the last n rows are
+    always contiguous. last() and since() copy them under the lock; with
+    copy=False they return a view, which is only safe while no other thread
+    appends (the rows are overwritten in place).
+    INPUT:
+        capacity: maximum number of rows kept
+        columns: number of columns (channels)
+        dtype: dtype of the buffer (default is float64)
+    '''
+    def __init__(self, capacity, columns, dtype = np.float64):
+        self.capacity = capacity
+        self.columns = columns
+        self.lock = threading.Lock()
+        self._data = np.zeros((2 * capacity, columns), dtype = dtype)
+        self._head = 0   # position of the next row in [0, capacity)
+        self.count = 0   # rows currently in the buffer
+        self.total = 0   # rows appended since creation
+        self.reset_stats()
+
+    def __len__(self):
+        return self.count
+
+    def reset_stats(self):
+        '''
+        Restart the running statistics (the buffer content is kept).
+        '''
+        self._n = 0
+        self._mean = np.zeros(self.columns)
+        self._m2 = np.zeros(self.columns)
+
+    def append(self, rows):
+        '''
+        Append a (n, columns) block; only the last capacity rows are kept in
+        the buffer, but all rows enter the running statistics.
+        '''
+        rows = np.asarray(rows)
+        if rows.ndim != 2 or rows.shape[1] != self.columns or len(rows) == 0:
+            if rows.size == 0:
+                return
+            raise ValueError('expected (n, %d) rows, got %s' % (self.columns, rows.shape))
+        with self.lock:
+            self._update_stats(rows)
+            self.total += len(rows)
+            keep = rows[-self.capacity:]
+            n = len(keep)
+            first = min(n, self.capacity - self._head)
+            for offset in (0, self.capacity):
+                self._data[self._head + offset:self._head + offset + first] = keep[:first]
+                self._data[offset:offset + n - first] = keep[first:]
+            self._head = (self._head + n) % self.capacity
+            self.count = min(self.count + n, self.capacity)
+
+    def _update_stats(self, rows):
+        # Chan et al. parallel update of count, mean and sum of squared deviations
+        n_b = len(rows)
+        mean_b = rows.mean(axis = 0)
+        m2_b = ((rows - mean_b)**2).sum(axis = 0)
+        n = self._n + n_b
+        delta = mean_b - self._mean
+        self._mean = self._mean + delta * n_b / n
+        self._m2 = self._m2 + m2_b + delta**2 * self._n * n_b / n
+        self._n = n
+
+    def _last(self, n):
+        n = self.count if n is None else max(0, min(n, self.count))
+        end = self._head + self.capacity
+        return self._data[end - n:end]
+
+    def last(self, n = None, copy = True):
+        '''
+        The last n rows (all rows in the buffer if None), oldest first.
+        '''
+        with self.lock:
+            rows = self._last(n)
+            return rows.copy() if copy else rows
+
+    def since(self, total, copy = True):
+        '''
+        The rows appended after the buffer had received total rows,
+        e.g. since(buffer.total) taken before an integration window.
+        '''
+        with self.lock:
+            rows = self._last(self.total - total)
+            return rows.copy() if copy else rows
+
+    def stats(self):
+        '''
+        Running statistics of all rows since creation or reset_stats().
+        OUTPUT:
+            count, mean and standard deviation per column
+        '''
+        with self.lock:
+            std = np.sqrt(self._m2 / self._n) if self._n else np.full(self.columns, np.nan)
+            return self._n, self._mean.copy(), std
+
+
+class TensormeterStream(object):
+    '''
+    Background reader that polls 'newd' on a tensormeter connection and
+    appends the increments to a RingBuffer. The stream owns the connection
+    while it is running, do not send requests on tens in the meantime.
+    start() sends 'cldt' like measure_data_point() in tensormeter.py, so the
+    first poll does not return the backlog of the instrument. It is not sent
+    again per data point: 'newd' only returns new rows anyway, and the data
+    point is the rows between two marks in the buffer; clearing would only
+    restart the time stamps in the middle of the buffer.
+    A poll for which request_matrix gave up (it reopens the connection after
+    e.g. socket.timeout) is counted in failures, the reader keeps running.
+    INPUT:
+        tens: connected tensormeter instance
+        capacity: number of rows kept in the ring buffer (default is 100000)
+        interval: pause between two polls in seconds (default is 0.05)
+    '''
+    def __init__(self, tens, capacity = 100000, interval = 0.05):
+        self.tens = tens
+        self.capacity = capacity
+        self.interval = interval
+        self.buffer = None
+        self.polls = 0
+        self.failures = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._polled = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self.tens.send_cldt()
+        self._thread = threading.Thread(target = self._run, name = 'TensormeterStream', daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                # request_matrix reconnects after socket.timeout and lost connections
+                # and returns None when all n_max_attempts attempts failed
+                d = self.tens.request_matrix("newd", self.tens.send_newd)
+                if d is None:
+                    self.failures += 1
+                elif len(d):
+                    if self.buffer is None:
+                        self.buffer = RingBuffer(self.capacity, d.shape[1])
+                    self.buffer.append(d)
+                with self._polled:
+                    self.polls += 1
+                    self._polled.notify_all()
+                self._stop.wait(self.interval)
+        except Exception as e:
+            self.error = e
+            with self._polled:
+                self._polled.notify_all()
+
+    def wait_poll(self, timeout = None):
+        '''
+        Block until the reader completed one more poll. Returns False on timeout
+        or if the reader stopped.
+        '''
+        with self._polled:
+            polls = self.polls
+            return self._polled.wait_for(lambda: self.polls > polls or not self.running, timeout) and self.running
+
+    def mark(self):
+        '''
+        Current row count, to be passed to rows_since() later.
+        '''
+        self.wait_poll()
+        return 0 if self.buffer is None else self.buffer.total
+
+    def rows_since(self, mark):
+        if self.buffer is None:
+            return np.empty((0, 0))
+        return self.buffer.since(mark)
+
+    def last(self, n = None):
+        if self.buffer is None:
+            return np.empty((0, 0))
+        return self.buffer.last(n)
+
+    def measure_data_point(self, int_time = 1, channel = 9):
+        '''
+        Mean of one channel over the rows that arrived during int_time seconds,
+        nan if no rows arrived.
+        '''
+        start = self.mark()
+        self._stop.wait(int_time)
+        self.wait_poll()
+        if self.error is not None:
+            raise self.error
+        rows = self.rows_since(start)
+        return rows[:, channel].mean() if len(rows) else np.nan